@@ -3,100 +3,149 @@ Main file for launching the Flask backend
 """
 
 import logging
+import os
+import time
 from datetime import datetime
 from pathlib import Path
-import sys
-from typing import Any
+from typing import Any, Iterable
 
 from bson import json_util, ObjectId
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, g, jsonify, request, send_from_directory, stream_with_context
 from flask_cors import CORS
 from flask_pymongo import PyMongo
-from pynpm import NPMPackage
 
 import configs
-from assessment import Assessment, get_all_assessments
+import llm_cache
+import question_bank
+from coalesce import ensure_coalesce_indexes
+from assessment import (
+    Assessment,
+    bulk_delete_assessments,
+    bulk_save_assessments,
+    BULK_FAILED,
+    BULK_OK,
+    BULK_SKIPPED,
+    ensure_assessment_indexes,
+    get_all_assessments,
+    get_assessment_summaries,
+    iter_all_assessments,
+    stream_questions,
+)
 from configs import (
     ALLOWED_EXTENSIONS,
     ALLOWED_MIMETYPES,
-    FRONTEND_BASE,
     FRONTEND_BUILD,
+    HISTORY_PAGE_SIZE,
+    JOB_MAX_WAIT,
     MONGO_URI,
+    STREAM_BATCH_SIZE,
     UPLOADS_BASE,
 )
 from userinput import UserInput
-from exceptions import DBError, OutputFormatError, UserInputError
+from exceptions import (
+    ConflictError,
+    DBError,
+    OutputFormatError,
+    ServiceBusyError,
+    UserInputError,
+)
+from extraction import extraction_cache, get_upload_status, queue_extraction
+from frontend import CHECKED_ENV_VAR, rebuild_frontend
+from jobs import ensure_job_indexes, get_job, job_response, submit_generation
+from llm_interface import session_stats
+from metrics import observe_request, render_metrics, stage
+from streaming import (
+    iter_json_array,
+    iter_ndjson,
+    sse_event,
+    JSON_MIMETYPE,
+    NDJSON_MIMETYPE,
+    SSE_MIMETYPE,
+)
 
 
-def _get_last_modified_time(path: Path):
-    """
-    Recursive function to get last modified time of a path in nanoseconds.
-    If a directory is passed, returns the last modified time of the whole tree
-    under the directory.
-    """
-    ret = path.stat().st_mtime_ns
-    if path.is_dir():
-        for child in path.iterdir():
-            ret = max(ret, _get_last_modified_time(child))
+# under gunicorn, the master process has already checked the frontend
+if CHECKED_ENV_VAR not in os.environ:
+    rebuild_frontend()
 
-    return ret
+app = Flask(__name__, static_folder=FRONTEND_BUILD)
+CORS(app)
+app.logger.setLevel(logging.INFO)
 
+configs.pymongo = PyMongo(app, MONGO_URI)
 
-def _get_directory_newest_member(path: Path):
-    """
-    Helper function to get path to last modified child of the directory passed
-    """
-    times_and_paths = [(_get_last_modified_time(i), i) for i in path.iterdir()]
-    return max(times_and_paths)[1]
+# create the indexes the app needs (indexes that exist already are left as is)
+ensure_assessment_indexes()
+llm_cache.ensure_cache_indexes()
+ensure_coalesce_indexes()
+ensure_job_indexes()
+question_bank.ensure_question_bank_indexes()
 
 
-def rebuild_frontend():
+@app.before_request
+def start_request_timer():
     """
-    Function to rebuild frontend (if it is outdated)
+    Notes the start time of every request, for the request metrics
     """
-    # This block of code is needed to ensure that this function is running only
-    # once, even when there are multiple processes
-    lock_file = Path("temp.lock")
-    try:
-        lock_file.touch(exist_ok=False)
-    except FileExistsError:
-        return
-
-    try:
-        if _get_directory_newest_member(FRONTEND_BASE) != FRONTEND_BUILD:
-            print("Rebuilding frontend build...")
-            pkg = NPMPackage(str(FRONTEND_BASE / "package.json"))
-            if ret := pkg.run_script("build", "--report"):
-                if isinstance(ret, int):
-                    sys.exit(ret)
-    finally:
-        lock_file.unlink()
+    g.request_start = time.perf_counter()
 
 
-rebuild_frontend()
-
-app = Flask(__name__, static_folder=FRONTEND_BUILD)
-CORS(app)
-app.logger.setLevel(logging.INFO)
+@app.after_request
+def observe_request_time(response):
+    """
+    Records the time taken by every request (until its response body starts)
+    in the request metrics
+    """
+    if (start := g.get("request_start")) is not None:
+        observe_request(
+            request.endpoint or "unknown",
+            response.status_code,
+            time.perf_counter() - start,
+        )
 
-configs.pymongo = PyMongo(app, MONGO_URI)
+    return response
 
 
 @app.errorhandler(UserInputError)
 @app.errorhandler(OutputFormatError)
 @app.errorhandler(DBError)
-def handle_exception(err: UserInputError | OutputFormatError | DBError):
+@app.errorhandler(ServiceBusyError)
+@app.errorhandler(ConflictError)
+def handle_exception(
+    err: (
+        UserInputError | OutputFormatError | DBError | ServiceBusyError | ConflictError
+    ),
+):
     """
     Return JSON instead of HTML for UserInputError errors.
     """
+    return jsonify(_error_dict(err)), err.code
+
 
+def _error_dict(
+    err: (
+        UserInputError | OutputFormatError | DBError | ServiceBusyError | ConflictError
+    ),
+):
+    """
+    Helper function to make the dict sent to the client for an error
+    """
     response: dict[str, Any] = {"error": err.description}
     if len(err.args) > 0:
         response["message"] = err.args[0]
         if len(err.args) > 1:
             response["extra_messages"] = err.args[1:]
 
-    return jsonify(response), err.code
+    return response
+
+
+def _form_flag(name: str, form: dict[str, Any] | None = None):
+    """
+    Helper function to read an optional boolean field of the request form
+    (or of the passed form dict)
+    """
+    form = request.form if form is None else form
+    return form.get(name, "").strip().lower() in ("1", "true", "yes", "on")
 
 
 def _make_filename_unique(file: Path):
@@ -123,6 +172,9 @@ def upload_file():
     This endpoint only accepts one file, and this file is checked to be a PDF
     file. It is stored in the predefined uploads folder with a unique name, and
     this new name is returned as a response.
+
+    Text extraction of the file is started in the background right away, so
+    that it is ready by the time the assessment is generated.
     """
     if len(request.files) != 1 and "file" not in request.files:
         raise UserInputError("Got an invalid amount of file uploads")
@@ -142,34 +194,159 @@ def upload_file():
 
     uploaded_path = _make_filename_unique(uploaded_path)
     file.save(uploaded_path)
+    queue_extraction(uploaded_path.name)
     return uploaded_path.name
 
 
+@app.route("/api/v1/upload_status/<string:filename>", methods=["GET"])
+def upload_status(filename: str):
+    """
+    Implements /api/v1/upload_status endpoint.
+
+    Given the name returned by /api/v1/upload_file, this endpoint returns the
+    status of the background text extraction of that file.
+    """
+    status = get_upload_status(filename)
+    if status is None:
+        raise UserInputError("No upload with the given name")
+
+    return jsonify({"filename": filename, "status": status})
+
+
 def bsonify(obj: Any):
     """
     Just like jsonify but handles bson stuff like ObjectId
     """
+    with stage("serialize"):
+        body = json_util.dumps(obj)
+
     return app.response_class(
-        response=json_util.dumps(obj),
+        response=body,
         status=200,
         mimetype="application/json",
     )
 
 
+def bsonify_stream(docs: Iterable[Any], stream_format: str):
+    """
+    Like bsonify, but streams an iterable of documents (like a db cursor) as it
+    is encoded. stream_format can be 'ndjson' (one document per line) or
+    'json' (a JSON array sent in chunks).
+    """
+    if stream_format == "ndjson":
+        chunks, mimetype = iter_ndjson(docs, STREAM_BATCH_SIZE), NDJSON_MIMETYPE
+    elif stream_format == "json":
+        chunks, mimetype = iter_json_array(docs, STREAM_BATCH_SIZE), JSON_MIMETYPE
+    else:
+        raise UserInputError("'stream' must be one of 'ndjson' or 'json'")
+
+    return app.response_class(response=chunks, status=200, mimetype=mimetype)
+
+
 @app.route("/api/v1/generate_assessment", methods=["POST"])
 def generate_assessment():
     """
     Implements /api/v1/generate_assessment endpoint.
 
-    Expects all attributes as needed by UserInput.from_request_form to be set
+    Expects all attributes as needed by UserInput.from_request_form to be set.
+    If the optional 'fresh' attribute is true, cached LLM responses are not
+    used, so that new questions are generated.
     """
 
     user_inp = UserInput.from_request_form(request.form)
-    assessment = Assessment.from_user_input(user_inp)
+    assessment = Assessment.from_user_input(user_inp, use_cache=not _form_flag("fresh"))
     assessment.save()
     return bsonify(assessment.to_dict())
 
 
+@app.route("/api/v1/generate_assessment_stream", methods=["GET", "POST"])
+def generate_assessment_stream():
+    """
+    Implements /api/v1/generate_assessment_stream endpoint.
+
+    Takes the same attributes as /api/v1/generate_assessment (as a form, or as
+    query parameters so that the browser EventSource API can be used), but
+    responds with server-sent events: a 'question' event with every question
+    dict as soon as it is generated, and then a 'done' event with the '_id',
+    'last_modified' and 'version' of the saved assessment. On failure, an
+    'error' event is sent with the same data as the error responses of other
+    endpoints.
+
+    The response ends after the 'done' or 'error' event, and an EventSource
+    client must close() on either, since an EventSource reconnects to a
+    response that ended (which would generate and save the assessment
+    again). The 'done' and 'error' events have an event ID, so a reconnect
+    after them has the Last-Event-ID header, and gets a 204 response, which
+    stops the EventSource.
+    """
+    if request.headers.get("Last-Event-ID"):
+        return app.response_class(status=204)
+
+    form = request.form if request.method == "POST" else request.args
+    user_inp = UserInput.from_request_form(form)
+    use_cache = not _form_flag("fresh", form)
+
+    def events():
+        questions = []
+        try:
+            for question in stream_questions(user_inp, use_cache):
+                questions.append(question)
+                yield sse_event("question", question.to_dict())
+
+            assessment = Assessment(user_input=user_inp, questions=questions)
+            assessment.save()
+        except (UserInputError, OutputFormatError, DBError, ServiceBusyError) as err:
+            yield sse_event("error", _error_dict(err), "error")
+            return
+
+        yield sse_event(
+            "done",
+            {
+                "_id": assessment.get_id(),
+                "last_modified": assessment.last_modified,
+                "version": assessment.version,
+            },
+            str(assessment.get_id()),
+        )
+
+    return app.response_class(
+        stream_with_context(events()),
+        mimetype=SSE_MIMETYPE,
+        # stop proxies from buffering the events
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/api/v1/jobs/generate_assessment", methods=["POST"])
+def submit_generate_assessment():
+    """
+    Implements /api/v1/jobs/generate_assessment endpoint.
+
+    Takes the same attributes as /api/v1/generate_assessment, but only queues
+    the generation and returns the 'job_id' right away. The job can be polled
+    with /api/v1/jobs/<job_id>.
+    """
+    user_inp = UserInput.from_request_form(request.form)
+    job_id = submit_generation(user_inp, use_cache=not _form_flag("fresh"))
+    return bsonify({"job_id": job_id}), 202
+
+
+@app.route("/api/v1/jobs/<ObjectId:job_id>", methods=["GET"])
+def get_job_status(job_id: ObjectId):
+    """
+    Implements /api/v1/jobs/<job_id> endpoint.
+
+    Returns the 'status' of the job ('queued', 'running', 'done' or 'failed')
+    and its current 'stage'. Once done, '_id' of the saved assessment is set
+    as 'assessment_id', and on failure 'error' is set. The optional 'wait'
+    query parameter makes this wait (up to the given number of seconds, at
+    most JOB_MAX_WAIT, which is 0 unless the workers are threaded) for the
+    job to finish.
+    """
+    wait = min(max(request.args.get("wait", 0, type=float), 0), JOB_MAX_WAIT)
+    return bsonify(job_response(get_job(job_id, wait)))
+
+
 @app.route("/api/v1/save_assessment", methods=["POST"])
 def save_assessment():
     """
@@ -178,11 +355,19 @@ def save_assessment():
     This endpoint can handle both 'save as copy' and 'save as overwrite'. If the
     request has an '_id' attribute this endpoint does 'save as overwrite' on the
     document with that ID, otherwise this endpoint creates a new copy document.
+
+    Every save increments the 'version' of the document. If the request has
+    the 'version' that the client loaded, and the document was saved by
+    someone else since, this errors with 409.
     """
     assessment = Assessment.from_request_json(request.json)
     assessment.save()
     return bsonify(
-        {"_id": assessment.get_id(), "last_modified": assessment.last_modified}
+        {
+            "_id": assessment.get_id(),
+            "last_modified": assessment.last_modified,
+            "version": assessment.version,
+        }
     )
 
 
@@ -191,11 +376,68 @@ def get_history():
     """
     Implements /api/v1/get_history endpoint.
 
-    The response is just a list of all assessment dictionaries.
+    The response is just a list of all assessment dictionaries. If the 'stream'
+    query parameter is set (to 'ndjson' or 'json'), the response is streamed
+    from the database in batches instead of being built in memory first.
     """
+    if stream_format := request.args.get("stream"):
+        return bsonify_stream(iter_all_assessments(STREAM_BATCH_SIZE), stream_format)
+
     return bsonify(get_all_assessments())
 
 
+@app.route("/api/v1/get_history_page", methods=["GET"])
+def get_history_page():
+    """
+    Implements /api/v1/get_history_page endpoint.
+
+    Unlike /api/v1/get_history this returns one page of assessment summaries
+    (with only the fields needed to list them), sorted by last modified time.
+    Accepts the optional query parameters 'limit', 'order' ('asc' or 'desc')
+    and 'cursor'. The response has the 'assessments' list, and 'next_cursor'
+    which must be passed as 'cursor' to get the next page.
+    """
+    limit = request.args.get("limit", HISTORY_PAGE_SIZE, type=int)
+    return bsonify(
+        get_assessment_summaries(
+            limit, request.args.get("cursor"), request.args.get("order", "desc")
+        )
+    )
+
+
+@app.route("/api/v1/stats", methods=["GET"])
+def stats():
+    """
+    Implements /api/v1/stats endpoint.
+
+    Returns hit/miss statistics of the PDF extraction cache and the LLM
+    response cache, the size of the question bank, and connection reuse
+    statistics of the LLM session (of the worker process that handles this
+    request).
+    """
+    return jsonify(
+        {
+            "extraction_cache": extraction_cache.stats(),
+            "llm_cache": llm_cache.stats(),
+            "llm_connections": session_stats(),
+            "question_bank": question_bank.stats(),
+        }
+    )
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Implements /metrics endpoint.
+
+    Returns the latency histograms of the request stages, db queries and
+    requests in the Prometheus text format, aggregated over all worker
+    processes.
+    """
+    body, content_type = render_metrics()
+    return app.response_class(response=body, status=200, content_type=content_type)
+
+
 @app.route("/api/v1/get_assessment/<ObjectId:assessment_id>", methods=["GET"])
 def get_assessment(assessment_id: ObjectId):
     """
@@ -220,6 +462,59 @@ def delete_assessment(assessment_id: ObjectId):
     return jsonify({"message": "Assessment deleted successfully."})
 
 
+def _bulk_request():
+    """
+    Helper function that returns the JSON body of a bulk request, and its
+    'ordered' flag (true by default)
+    """
+    if not isinstance(request.json, dict):
+        raise UserInputError("Bulk requests must have a JSON object body")
+
+    ordered = request.json.get("ordered", True)
+    if not isinstance(ordered, bool):
+        raise UserInputError("'ordered' must be a boolean")
+
+    return request.json, ordered
+
+
+def _bulk_response(results: list[dict[str, Any]]):
+    return bsonify(
+        {
+            "results": results,
+            "ok": sum(i["status"] == BULK_OK for i in results),
+            "failed": sum(i["status"] == BULK_FAILED for i in results),
+            "skipped": sum(i["status"] == BULK_SKIPPED for i in results),
+        }
+    )
+
+
+@app.route("/api/v1/bulk_save_assessments", methods=["POST"])
+def bulk_save():
+    """
+    Implements /api/v1/bulk_save_assessments endpoint.
+
+    Expects a JSON object with an 'assessments' list (each like the body of
+    /api/v1/save_assessment) and an optional 'ordered' flag. All of them are
+    saved in a single database round trip, and the response has the result of
+    every item. If ordered is true (the default), the items after the first
+    failed one are skipped.
+    """
+    body, ordered = _bulk_request()
+    return _bulk_response(bulk_save_assessments(body.get("assessments"), ordered))
+
+
+@app.route("/api/v1/bulk_delete_assessments", methods=["POST"])
+def bulk_delete():
+    """
+    Implements /api/v1/bulk_delete_assessments endpoint.
+
+    Expects a JSON object with an 'ids' list of assessment IDs and an optional
+    'ordered' flag, and responds like /api/v1/bulk_save_assessments.
+    """
+    body, ordered = _bulk_request()
+    return _bulk_response(bulk_delete_assessments(body.get("ids"), ordered))
+
+
 @app.route("/", defaults={"path": "index.html"})
 @app.route("/<path:path>")
 def serve_static(path: str):
@@ -2,23 +2,51 @@
 Implements the Assessment class
 """
 
-import re
+import base64
+import binascii
+import contextvars
+import functools
+import json
+import logging
 import string
+import uuid
 
+from concurrent.futures import as_completed, ThreadPoolExecutor
 from datetime import datetime
-from typing import Any
-
-# This third party library is used instead of stdlib json is because it accepts
-# trailing commas in json - something that the LLM can incorrectly add
-import jsonc
+from typing import Any, Callable, Iterable
 
+from bson.errors import InvalidId
 from bson.objectid import ObjectId
+from pymongo import (
+    ASCENDING,
+    DeleteOne,
+    DESCENDING,
+    IndexModel,
+    InsertOne,
+    UpdateOne,
+)
+from pymongo.errors import BulkWriteError
 
 import configs
-from exceptions import DBError, OutputFormatError, UserInputError
-from llm_interface import get_prompt_response
+from configs import (
+    BULK_MAX_BATCH,
+    GENERATION_BATCH_RETRIES,
+    GENERATION_BATCH_SIZE,
+    GENERATION_PARALLELISM,
+    GENERATION_TOPUP_RETRIES,
+    HISTORY_MAX_PAGE_SIZE,
+)
+import dedup
+from dbutils import ensure_indexes, timed_query
+from exceptions import ConflictError, DBError, OutputFormatError, UserInputError
+from llm_interface import get_prompt_response, stream_prompt_response
+from metrics import stage
+from question_bank import add_assessments, find_questions
+from question_parser import IncrementalQuestionParser
 from userinput import UserInput
 
+logger = logging.getLogger(__name__)
+
 
 def option_id_as_int(option_id: str | int):
     """
@@ -47,8 +75,12 @@ class QuestionBase:
     """
     A base class for implementing different kind of questions.
     This represents the simplest kind of question.
+
+    Question classes use __slots__ instead of a per-instance dict, because
+    very large numbers of them are loaded at once for reports.
     """
 
+    __slots__ = ("question",)
     question_type = None
 
     def __init__(self, question_dict: dict[str, Any]):
@@ -92,6 +124,8 @@ class QuestionSubjectiveAnswer(QuestionBase):
     A class for representing subjective answer kind of questions
     """
 
+    __slots__ = ("sample_answer",)
+
     def __init__(self, question_dict: dict[str, Any]):
         super().__init__(question_dict)
         try:
@@ -124,6 +158,7 @@ class QuestionShortAnswer(QuestionSubjectiveAnswer):
     A class for representing short answer kind of questions
     """
 
+    __slots__ = ()
     question_type = "Short Answer"
 
 
@@ -132,6 +167,7 @@ class QuestionLongAnswer(QuestionSubjectiveAnswer):
     A class for representing long answer kind of questions
     """
 
+    __slots__ = ()
     question_type = "Long Answer"
 
 
@@ -140,17 +176,21 @@ class QuestionMCQ(QuestionBase):
     A class for representing MCQ kind of questions
     """
 
+    __slots__ = ("options", "correct_answer")
     question_type = "MCQ"
 
     def __init__(self, question_dict: dict[str, Any]):
         super().__init__(question_dict)
-        self.options: list[str] = []
         try:
-            for i, option in enumerate(question_dict["options"]):
-                self.update_option(i, option)
+            options = list(question_dict["options"])
         except KeyError:
             raise OutputFormatError("'question_dict' must have key 'options'") from None
 
+        # all options are validated at once, instead of with update_option
+        if not all(isinstance(i, str) for i in options):
+            raise OutputFormatError("'option' must be a string")
+        self.options: list[str] = options
+
         try:
             self.update_correct_answer(question_dict["correct_answer"])
         except KeyError:
@@ -193,11 +233,30 @@ class QuestionMCQ(QuestionBase):
 
     def to_dict(self):
         ret = super().to_dict()
-        ret["options"] = self.options
+        ret["options"] = list(self.options)
         ret["correct_answer"] = self.correct_answer
         return ret
 
 
+@functools.lru_cache(maxsize=64)
+def _question_class(question_type: str):
+    """
+    Internal helper function that returns the Question class of a
+    'question_type' value (cached, because the LLM uses only a few spellings)
+    """
+    q_type = question_type.lower()
+    if "mcq" in q_type:
+        return QuestionMCQ
+
+    if "short" in q_type:
+        return QuestionShortAnswer
+
+    if "long" in q_type:
+        return QuestionLongAnswer
+
+    raise OutputFormatError("Invalid question type recieved")
+
+
 def _make_question_obj(question: dict[str, Any] | QuestionBase):
     """
     Internal helper function called to ensure every question dict is converted
@@ -210,43 +269,348 @@ def _make_question_obj(question: dict[str, Any] | QuestionBase):
         raise OutputFormatError("question must be a dict")
 
     try:
-        q_type = question["question_type"].lower()
-        if "mcq" in q_type:
-            return QuestionMCQ(question)
-
-        if "short" in q_type:
-            return QuestionShortAnswer(question)
-
-        if "long" in q_type:
-            return QuestionLongAnswer(question)
-
-        raise OutputFormatError("Invalid question type recieved")
-
+        q_type = question["question_type"]
     except KeyError:
         raise OutputFormatError(
             "All questions must have the 'question_type' attribute"
         ) from None
 
+    if not isinstance(q_type, str):
+        raise OutputFormatError("Invalid question type recieved")
+
+    return _question_class(q_type)(question)
+
 
-def _questions_from_str_or_none(content: str | None):
+def make_questions(questions: Iterable[dict[str, Any] | QuestionBase]):
     """
-    Internal helper function called to get a list of question dicts from str
-    output generated by the LLM
+    Bulk constructor that converts (and validates) a whole list of question
+    dicts in one pass. On an invalid question, OutputFormatError is raised
+    with the index of the question in the message.
     """
-    questions: list[dict[str, Any]] = []
-    if content:
+    ret: list[QuestionBase] = []
+    append = ret.append
+    for i, question in enumerate(questions):
         try:
-            for match in re.findall(r"```json(.*?)```", content, re.DOTALL):
-                if isinstance(match, str):
-                    questions.extend(jsonc.loads(match.strip()))
+            append(_make_question_obj(question))
+        except OutputFormatError as err:
+            raise OutputFormatError(f"question {i}: {err.args[0]}") from None
+
+    return ret
+
+
+def _salvage_questions(content: str | None):
+    """
+    Internal helper function called to get the question objects from str
+    output generated by the LLM, in a single pass. Questions that are not
+    valid are dropped instead of failing the whole response. Returns the
+    questions, and the list of reasons for the dropped questions.
+    """
+    questions: list[QuestionBase] = []
+    parser = IncrementalQuestionParser(salvage=True)
+    with stage("parse"):
+        parsed = parser.feed(content or "")
+
+    with stage("questions"):
+        for question in parsed:
+            try:
+                questions.append(_make_question_obj(question))
+            except OutputFormatError as err:
+                parser.drop(err.args[0])
+
+    parser.close()
+    return questions, parser.dropped
+
+
+def _log_dropped(dropped: list[str]):
+    if dropped:
+        logger.warning(
+            "Dropped %d invalid questions from LLM response: %s",
+            len(dropped),
+            "; ".join(dropped),
+        )
+
+
+def _top_up_questions(
+    user_input: UserInput,
+    questions: list[QuestionBase],
+    num_questions: int,
+    part: tuple[int, int] | None = None,
+    use_cache: bool = True,
+):
+    """
+    Internal helper function that asks the LLM for only the questions missing
+    from questions (at most GENERATION_TOPUP_RETRIES times), and returns the
+    list of new questions along with the reasons for any dropped ones
+    """
+    new_questions: list[QuestionBase] = []
+    dropped: list[str] = []
+    for attempt in range(GENERATION_TOPUP_RETRIES):
+        missing = num_questions - len(_dedupe_questions(questions + new_questions))
+        if missing <= 0:
+            break
+
+        with stage("prompt"):
+            prompt = user_input.make_prompt(missing, part)
+
+        # a top up that failed must not be served from the cache again
+        more, more_dropped = _salvage_questions(
+            get_prompt_response(prompt, use_cache and attempt == 0)
+        )
+        new_questions.extend(more)
+        dropped.extend(more_dropped)
+
+    return new_questions, dropped
+
+
+def _generate_questions(
+    user_input: UserInput,
+    use_cache: bool = True,
+    num_questions: int | None = None,
+    part: tuple[int, int] | None = None,
+):
+    """
+    Internal helper function that generates num_questions questions (all the
+    questions of user_input by default) with one LLM call, salvaging the valid
+    questions of a partly invalid response and topping up the missing ones.
+    Returns the questions, and the reasons for all dropped questions.
+    Raises OutputFormatError if the response had no valid question at all.
+    """
+    if num_questions is None:
+        num_questions = user_input.num_questions
+
+    with stage("prompt"):
+        prompt = user_input.make_prompt(num_questions, part)
+
+    questions, dropped = _salvage_questions(get_prompt_response(prompt, use_cache))
+    if not questions:
+        _log_dropped(dropped)
+        raise OutputFormatError("LLM sent invalid json response")
+
+    more, more_dropped = _top_up_questions(
+        user_input, questions, num_questions, part, use_cache
+    )
+    dropped.extend(more_dropped)
+    _log_dropped(dropped)
+    return _dedupe_questions(questions + more)[:num_questions], dropped
+
+
+def _question_dedupe_key(question: QuestionBase):
+    """
+    Internal helper function that returns the key of duplicate questions (see
+    dedup.question_key): questions that only differ in case, whitespace or
+    punctuation (of their text, and of their options) are duplicates
+    """
+    return dedup.question_key(question.to_dict())
 
-            if not questions:
-                questions.extend(jsonc.loads(content.strip()))
 
-        except jsonc.JSONDecodeError:
-            raise OutputFormatError("LLM sent invalid json response") from None
+def _dedupe_questions(questions: list[QuestionBase]):
+    """
+    Internal helper function that removes duplicate questions, and (if
+    enabled by DEDUP_THRESHOLD) near-duplicate ones (see dedup.py), keeping
+    the first of every duplicate
+    """
+    seen = set()
+    ret = []
+    for question in questions:
+        key = _question_dedupe_key(question)
+        if key not in seen:
+            seen.add(key)
+            ret.append(question)
+
+    if dedup.is_enabled() and len(ret) > 1:
+        duplicates = dedup.find_duplicates(
+            [dedup.question_text(i.to_dict()) for i in ret]
+        )
+        ret = [i for i, duplicate in zip(ret, duplicates) if duplicate is None]
 
-    return questions
+    return ret
+
+
+def _merge_questions(
+    user_input: UserInput,
+    questions: list[QuestionBase],
+    num_questions: int,
+    use_cache: bool,
+    dropped: list[str],
+):
+    """
+    Internal helper function that de-duplicates questions merged from several
+    sources (like batches), and tops up the questions that are missing after
+    that (see _top_up_questions), so that num_questions are returned if the
+    LLM allows. The reasons for dropped questions are added to dropped.
+    """
+    questions = _dedupe_questions(questions)
+    if len(questions) < num_questions:
+        more, more_dropped = _top_up_questions(
+            user_input, questions, num_questions, use_cache=use_cache
+        )
+        _log_dropped(more_dropped)
+        dropped.extend(more_dropped)
+        questions = _dedupe_questions(questions + more)
+
+    return questions[:num_questions]
+
+
+def _generate_batched(
+    user_input: UserInput,
+    use_cache: bool = True,
+    progress: Callable[[str], None] | None = None,
+    num_questions: int | None = None,
+):
+    """
+    Internal helper function that splits generation of num_questions
+    questions (all the questions of user_input by default) into batches of at
+    most GENERATION_BATCH_SIZE questions, and generates GENERATION_PARALLELISM
+    batches at a time. Failed batches are retried (at most
+    GENERATION_BATCH_RETRIES times) without redoing the batches that
+    succeeded. The merged questions are de-duplicated, and the duplicates are
+    topped up. Returns the questions, and the reasons for all dropped
+    questions.
+    """
+    if num_questions is None:
+        num_questions = user_input.num_questions
+
+    num_batches = -(-num_questions // GENERATION_BATCH_SIZE)
+    sizes = [
+        num_questions // num_batches + (i < num_questions % num_batches)
+        for i in range(num_batches)
+    ]
+
+    def generate_batch(index: int, batch_use_cache: bool):
+        return _generate_questions(
+            user_input, batch_use_cache, sizes[index], (index, num_batches)
+        )
+
+    results: dict[int, tuple[list[QuestionBase], list[str]]] = {}
+    pending = list(range(num_batches))
+    error: OutputFormatError | None = None
+    with ThreadPoolExecutor(max_workers=GENERATION_PARALLELISM) as executor:
+        for attempt in range(GENERATION_BATCH_RETRIES + 1):
+            if progress is not None:
+                progress(f"generating ({len(results)}/{num_batches} batches done)")
+
+            # a response that failed must not be served from the cache again.
+            # The batches run with the context (like the LLM call priority) of
+            # this thread.
+            futures = {
+                executor.submit(
+                    contextvars.copy_context().run,
+                    generate_batch,
+                    i,
+                    use_cache and attempt == 0,
+                ): i
+                for i in pending
+            }
+            pending = []
+            for future in as_completed(futures):
+                try:
+                    results[futures[future]] = future.result()
+                except OutputFormatError as err:
+                    pending.append(futures[future])
+                    error = err
+
+            if not pending:
+                break
+
+    if pending and error is not None:
+        raise error
+
+    questions = [question for i in range(num_batches) for question in results[i][0]]
+    dropped = [reason for i in range(num_batches) for reason in results[i][1]]
+    questions = _merge_questions(
+        user_input, questions, num_questions, use_cache, dropped
+    )
+    return questions, dropped
+
+
+def stream_questions(user_input: UserInput, use_cache: bool = True):
+    """
+    Generates questions for user_input with a streamed LLM response, and
+    yields every question object as soon as the LLM has finished generating it.
+    Invalid and repeated questions are dropped, at most num_questions questions
+    are yielded, and the missing ones are topped up once the streamed response
+    is done.
+    """
+    sent: list[QuestionBase] = []
+    seen = set()
+    parser = IncrementalQuestionParser(salvage=True)
+    # the whole response is read (even after enough questions were sent), so
+    # that it is cached
+    for chunk in stream_prompt_response(user_input.make_prompt(), use_cache):
+        for question in parser.feed(chunk):
+            try:
+                question_obj = _make_question_obj(question)
+            except OutputFormatError as err:
+                parser.drop(err.args[0])
+                continue
+
+            key = _question_dedupe_key(question_obj)
+            if key in seen or len(sent) >= user_input.num_questions:
+                continue
+
+            seen.add(key)
+            sent.append(question_obj)
+            yield question_obj
+
+    parser.close()
+    if not sent:
+        _log_dropped(parser.dropped)
+        raise OutputFormatError("LLM sent no questions")
+
+    more, dropped = _top_up_questions(
+        user_input, sent, user_input.num_questions, use_cache=use_cache
+    )
+    _log_dropped(parser.dropped + dropped)
+
+    # the streamed questions were already sent, so only new ones can be added
+    new = {id(i) for i in more}
+    for question in _dedupe_questions(sent + more):
+        if id(question) in new and len(sent) < user_input.num_questions:
+            sent.append(question)
+            yield question
+
+
+CONFLICT_MESSAGE = "Assessment was saved by someone else, reload it and try again"
+
+# a field set to a new token by every bulk update, so that the updates that
+# were written can be told from the ones that did not match
+SAVE_ID_FIELD = "save_id"
+
+# the fields of a stored assessment that are not compared by an update
+_UPDATE_SKIPPED_FIELDS = ("version", SAVE_ID_FIELD)
+
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _diff_update(old: Any, new: Any, path: str, update: dict[str, dict[str, Any]]):
+    """
+    Internal helper function that adds to update the '$set' and '$unset' paths
+    that turn the document old into new. Only changed fields (and changed
+    elements of same length lists) are set, instead of the whole document.
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key, value in new.items():
+            sub_path = f"{path}.{key}" if path else key
+            if key not in old:
+                update["$set"][sub_path] = value
+            elif old[key] != value:
+                _diff_update(old[key], value, sub_path, update)
+
+        for key in old.keys() - new.keys():
+            update["$unset"][f"{path}.{key}" if path else key] = ""
+    elif (
+        path
+        and isinstance(old, list)
+        and isinstance(new, list)
+        and len(old) == len(new)
+    ):
+        for i, (old_value, value) in enumerate(zip(old, new)):
+            if old_value != value:
+                _diff_update(old_value, value, f"{path}.{i}", update)
+    else:
+        update["$set"][path] = new
 
 
 class Assessment:
@@ -260,6 +624,7 @@ class Assessment:
         user_input: UserInput | dict | None = None,
         questions: list[QuestionBase] | list[dict[str, Any]] | str | None = None,
         last_modified: str | None = None,
+        version: int | None = None,
     ):
         if isinstance(_id, dict):
             _id = ObjectId(_id["$oid"])
@@ -268,28 +633,81 @@ class Assessment:
         self.user_input = (
             UserInput(**user_input) if isinstance(user_input, dict) else user_input
         )
+
+        # reasons for the questions dropped from the LLM response, which are
+        # only known for a newly generated assessment
+        self.dropped: list[str] = []
         if questions is None or isinstance(questions, str):
-            questions = _questions_from_str_or_none(questions)
-        self.questions = [_make_question_obj(i) for i in questions]
+            questions, self.dropped = _salvage_questions(questions)
+        with stage("questions"):
+            self.questions = make_questions(questions)
 
-        self.last_modified = (
-            datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            if last_modified is None
-            else last_modified
-        )
+        self.last_modified = _now() if last_modified is None else last_modified
+
+        # the number of times the stored document was saved, which every
+        # save increments (None if unknown, like for a new assessment)
+        self.version = version
+
+        # the document as it is stored in the db (when known), so that save
+        # only writes what changed, and the version the changes are based on,
+        # for detecting conflicting saves
+        self._saved: dict[str, Any] | None = None
+        self._base_version = version
 
     def __str__(self):
         return "\n\n".join(f"{i}. {val}" for i, val in enumerate(self.questions))
 
     @classmethod
-    def from_user_input(cls, user_input: UserInput):
+    def from_user_input(
+        cls,
+        user_input: UserInput,
+        use_cache: bool = True,
+        progress: Callable[[str], None] | None = None,
+    ):
         """
-        Constructs Assessment object from given UserInput object
+        Constructs Assessment object from given UserInput object.
+        use_cache=False bypasses the LLM response cache and the question bank.
+        If progress is passed, it is called with the name of every stage as it
+        starts.
+
+        As many questions as possible are taken from the question bank, and
+        only the rest are generated. If more than GENERATION_BATCH_SIZE
+        questions are needed, they are generated in concurrent batches (see
+        _generate_batched). Invalid questions in the LLM response are dropped
+        and topped up, and the reasons are kept in the dropped attribute.
         """
-        return cls(
-            user_input=user_input,
-            questions=get_prompt_response(user_input.make_prompt()),
-        )
+        if progress is not None:
+            progress("preparing")
+
+        questions: list[QuestionBase] = []
+        if use_cache:
+            questions = make_questions(
+                find_questions(user_input, user_input.num_questions)
+            )
+
+        dropped: list[str] = []
+        missing = user_input.num_questions - len(questions)
+        if missing > 0:
+            user_input.pdf_context()
+            if missing > GENERATION_BATCH_SIZE:
+                generated, dropped = _generate_batched(
+                    user_input, use_cache, progress, missing
+                )
+            else:
+                if progress is not None:
+                    progress("generating")
+                generated, dropped = _generate_questions(user_input, use_cache, missing)
+            questions = _merge_questions(
+                user_input,
+                questions + generated,
+                user_input.num_questions,
+                use_cache,
+                dropped,
+            )
+
+        ret = cls(user_input=user_input, questions=questions)
+        ret.dropped = dropped
+        return ret
 
     @classmethod
     def from_db(cls, assessment_id: ObjectId):
@@ -299,7 +717,15 @@ class Assessment:
         if configs.pymongo is None or configs.pymongo.db is None:
             raise DBError()
 
-        return cls(**configs.pymongo.db.assessments.find_one_or_404(assessment_id))
+        collection = configs.pymongo.db.assessments
+        with timed_query(
+            "assessments.find_one",
+            lambda: collection.find({"_id": assessment_id}).explain(),
+        ):
+            doc = collection.find_one_or_404(assessment_id)
+        ret = cls(**{key: value for key, value in doc.items() if key != SAVE_ID_FIELD})
+        ret._saved = {key: value for key, value in doc.items() if key != "_id"}
+        return ret
 
     @staticmethod
     def delete_from_db(assessment_id: ObjectId):
@@ -309,7 +735,12 @@ class Assessment:
         if configs.pymongo is None or configs.pymongo.db is None:
             raise DBError()
 
-        result = configs.pymongo.db.assessments.delete_one({"_id": assessment_id})
+        collection = configs.pymongo.db.assessments
+        with timed_query(
+            "assessments.delete_one",
+            lambda: collection.find({"_id": assessment_id}).explain(),
+        ):
+            result = collection.delete_one({"_id": assessment_id})
 
         if result.deleted_count == 0:
             raise UserInputError("Assessment not found or already deleted.")
@@ -319,16 +750,25 @@ class Assessment:
     @classmethod
     def from_request_json(cls, request_json: Any):
         """
-        Constructor to make Assessment instance from request.json style object
+        Constructor to make Assessment instance from request.json style object.
+        The 'version' value in request_json (if any) is the version the client
+        has edited, which is checked on save.
         """
         if not isinstance(request_json, dict):
             raise UserInputError("request_json must be a dictionary")
 
+        version = request_json.get("version")
+        if version is not None and (
+            not isinstance(version, int) or isinstance(version, bool)
+        ):
+            raise UserInputError("'version' must be an integer")
+
         try:
             return cls(
                 _id=request_json.get("_id"),
                 user_input=request_json["user_input"],
                 questions=request_json["questions"],
+                version=version,
             )
         except KeyError:
             raise UserInputError("'request_json' missing needed attributes!") from None
@@ -349,6 +789,7 @@ class Assessment:
             "user_input": self.user_input.to_dict(),
             "questions": [i.to_dict() for i in self.questions],
             "last_modified": self.last_modified,
+            "version": self.version,
         }
 
         if with_id:
@@ -358,24 +799,86 @@ class Assessment:
 
     def save(self):
         """
-        This method saves the current instance as a new entry in the db.
-        Sets a new object ID
+        This method saves the current instance as a new entry in the db (and
+        sets a new object ID), or updates the existing entry if _id is set.
+
+        An update only sets (and unsets) the fields that changed, increments
+        the version of the entry, and raises ConflictError if the entry was
+        saved by someone else since the version this instance is based on.
+        The saved questions are added to the question bank.
         """
         if configs.pymongo is None or configs.pymongo.db is None:
             raise DBError()
 
+        collection = configs.pymongo.db.assessments
         if self._id is None:
-            result = configs.pymongo.db.assessments.insert_one(
-                self.to_dict(with_id=False)
-            )
+            self.version = 1
+            doc = self.to_dict(with_id=False)
+            with timed_query("assessments.insert_one"):
+                result = collection.insert_one(doc)
             if not isinstance(result.inserted_id, ObjectId):
                 raise DBError()
 
             self._id = result.inserted_id
+            doc.pop("_id", None)
         else:
-            result = configs.pymongo.db.assessments.replace_one(
-                {"_id": self._id}, self.to_dict(with_id=False)
-            )
+            saved = self._saved
+            if saved is None:
+                with timed_query(
+                    "assessments.find_one",
+                    lambda: collection.find({"_id": self._id}).explain(),
+                ):
+                    saved = collection.find_one({"_id": self._id}, {"_id": 0})
+                if saved is None:
+                    raise UserInputError("Assessment not found or already deleted.")
+
+            query, update, doc = self._make_update(saved)
+            if update:
+                with timed_query(
+                    "assessments.update_one",
+                    lambda: collection.find(query).explain(),
+                ):
+                    result = collection.update_one(query, update)
+                if result.matched_count == 0:
+                    raise ConflictError(CONFLICT_MESSAGE)
+
+        self._saved = doc
+        self._base_version = self.version
+        add_assessments([doc])
+
+    def _make_update(self, saved: dict[str, Any]):
+        """
+        Internal helper method that returns the (query, update, new document)
+        that update the stored document saved to this instance, with a new
+        'last_modified' and the next version. Only the changed fields are
+        updated, and the update is empty if nothing changed. The query only
+        matches the version of saved. Raises ConflictError if saved is not
+        the version this instance is based on.
+        """
+        base = saved.get("version")
+        if self._base_version not in (None, base):
+            raise ConflictError(CONFLICT_MESSAGE)
+
+        self.last_modified = _now()
+        doc = self.to_dict(with_id=False)
+        fields = {key: value for key, value in doc.items() if key != "version"}
+        old = {
+            key: value
+            for key, value in saved.items()
+            if key not in _UPDATE_SKIPPED_FIELDS
+        }
+        update: dict[str, dict[str, Any]] = {"$set": {}, "$unset": {}}
+        _diff_update(old, fields, "", update)
+
+        # a document saved before versions were added has no version
+        query = {"_id": self._id, "version": base}
+
+        update = {key: value for key, value in update.items() if value}
+        if update:
+            update["$inc"] = {"version": 1}
+            self.version = doc["version"] = (base or 0) + 1
+
+        return query, update, doc
 
     def get_id(self):
         """
@@ -387,6 +890,229 @@ class Assessment:
         return self._id
 
 
+# status values of the items of a bulk request
+BULK_OK = "ok"
+BULK_FAILED = "failed"
+BULK_SKIPPED = "skipped"
+
+
+def _bulk_item_error(err: UserInputError | OutputFormatError | DBError | ConflictError):
+    """
+    Internal helper function that makes the result of a failed bulk item, with
+    the error in the same format as the error responses of the endpoints
+    """
+    return {
+        "status": BULK_FAILED,
+        "error": {
+            "error": err.description,
+            "message": err.args[0] if err.args else None,
+            "code": err.code,
+        },
+    }
+
+
+def _check_bulk_items(items: Any):
+    if not isinstance(items, list) or not items:
+        raise UserInputError("Bulk requests need a non empty list of items")
+
+    if len(items) > BULK_MAX_BATCH:
+        raise UserInputError(f"Bulk requests can have at most {BULK_MAX_BATCH} items")
+
+
+def _run_bulk_write(
+    ops: list[Any], op_items: list[int], results: list[dict[str, Any]], ordered: bool
+):
+    """
+    Internal helper function that runs ops in one bulk_write, where op_items
+    has the index (in results) of the item of every op. Marks the items of
+    failed ops as failed, and (if ordered) the items of the ops after the
+    first failure as skipped. Returns the set of items whose ops were written.
+    """
+    if configs.pymongo is None or configs.pymongo.db is None:
+        raise DBError()
+
+    errors: dict[int, str] = {}
+    if ops:
+        try:
+            with timed_query("assessments.bulk_write"):
+                configs.pymongo.db.assessments.bulk_write(ops, ordered=ordered)
+        except BulkWriteError as err:
+            for write_error in err.details.get("writeErrors", []):
+                errors[write_error["index"]] = write_error.get("errmsg", "")
+
+    written = set()
+    for op_index, item in enumerate(op_items):
+        if op_index in errors:
+            results[item].update(_bulk_item_error(DBError(errors[op_index])))
+        elif ordered and errors and op_index > min(errors):
+            results[item]["status"] = BULK_SKIPPED
+        else:
+            written.add(item)
+
+    return written
+
+
+def bulk_save_assessments(request_jsons: Any, ordered: bool = True):
+    """
+    Saves a list of assessments (in the format taken by from_request_json)
+    with a single bulk_write: like Assessment.save, assessments without an
+    '_id' are inserted and the others are updated. The stored versions of the
+    updated assessments are fetched with a single query.
+
+    Returns a list with the result of every item: its 'status' ('ok', 'failed'
+    or 'skipped') and either its '_id', 'last_modified' and 'version', or its
+    'error'.
+    If ordered is true, the items after the first failed one are skipped.
+    """
+    if configs.pymongo is None or configs.pymongo.db is None:
+        raise DBError()
+
+    _check_bulk_items(request_jsons)
+    collection = configs.pymongo.db.assessments
+    results: list[dict[str, Any]] = [{"index": i} for i in range(len(request_jsons))]
+    assessments: dict[int, Assessment] = {}
+    for i, request_json in enumerate(request_jsons):
+        try:
+            assessments[i] = Assessment.from_request_json(request_json)
+        except (UserInputError, OutputFormatError) as err:
+            results[i].update(_bulk_item_error(err))
+
+    query = {"_id": {"$in": [i._id for i in assessments.values() if i._id]}}
+    saved: dict[ObjectId, dict[str, Any]] = {}
+    if query["_id"]["$in"]:
+        with timed_query(
+            "assessments.find (bulk save)", lambda: collection.find(query).explain()
+        ):
+            saved = {doc.pop("_id"): doc for doc in collection.find(query)}
+
+    ops: list[InsertOne | UpdateOne] = []
+    op_items: list[int] = []
+    docs: dict[int, dict[str, Any]] = {}
+    save_ids: dict[int, str] = {}
+    stopped = False
+    for i in range(len(request_jsons)):
+        if stopped:
+            results[i]["status"] = BULK_SKIPPED
+            continue
+
+        if i not in assessments:
+            stopped = ordered
+            continue
+
+        assessment = assessments[i]
+        try:
+            if assessment._id is None:
+                assessment.version = 1
+                docs[i] = assessment.to_dict(with_id=False)
+                ops.append(InsertOne(docs[i]))
+            elif assessment._id not in saved:
+                raise UserInputError("Assessment not found or already deleted.")
+            else:
+                update_query, update, docs[i] = assessment._make_update(
+                    saved[assessment._id]
+                )
+                if not update:
+                    continue
+
+                save_ids[i] = uuid.uuid4().hex
+                update.setdefault("$set", {})[SAVE_ID_FIELD] = save_ids[i]
+                ops.append(UpdateOne(update_query, update))
+        except (UserInputError, ConflictError) as err:
+            results[i].update(_bulk_item_error(err))
+            stopped = ordered
+            continue
+
+        op_items.append(i)
+
+    written = _run_bulk_write(ops, op_items, results, ordered)
+
+    # an update that did not match (its save_id was not stored) was saved by
+    # someone else in the meantime
+    updated = {i: assessments[i] for i in written if i in save_ids}
+    if updated:
+        query = {"_id": {"$in": [i._id for i in updated.values()]}}
+        stored = {
+            doc["_id"]: doc.get(SAVE_ID_FIELD)
+            for doc in collection.find(query, {SAVE_ID_FIELD: 1})
+        }
+        for i, assessment in updated.items():
+            if stored.get(assessment._id) != save_ids[i]:
+                results[i].update(_bulk_item_error(ConflictError(CONFLICT_MESSAGE)))
+                docs.pop(i)
+
+    for i, doc in docs.items():
+        assessment = assessments[i]
+        if assessment._id is None:
+            assessment._id = doc.pop("_id")
+
+        assessment._saved = doc
+        assessment._base_version = assessment.version
+        results[i].update(
+            status=BULK_OK,
+            _id=assessment._id,
+            last_modified=assessment.last_modified,
+            version=assessment.version,
+        )
+
+    add_assessments(docs.values())
+    return results
+
+
+def bulk_delete_assessments(assessment_ids: Any, ordered: bool = True):
+    """
+    Deletes a list of assessments (given by their IDs, as strings or in the
+    '$oid' format) with a single bulk_write. Returns a list with the result of
+    every item, like bulk_save_assessments. An ID that is repeated is only
+    deleted by its first item, the others fail as already deleted.
+    """
+    if configs.pymongo is None or configs.pymongo.db is None:
+        raise DBError()
+
+    _check_bulk_items(assessment_ids)
+    collection = configs.pymongo.db.assessments
+    results: list[dict[str, Any]] = [{"index": i} for i in range(len(assessment_ids))]
+    ids: dict[int, ObjectId] = {}
+    for i, assessment_id in enumerate(assessment_ids):
+        if isinstance(assessment_id, dict):
+            assessment_id = assessment_id.get("$oid")
+
+        try:
+            ids[i] = ObjectId(assessment_id)
+        except (InvalidId, TypeError):
+            results[i].update(_bulk_item_error(UserInputError("Invalid assessment ID")))
+
+    query = {"_id": {"$in": list(ids.values())}}
+    with timed_query(
+        "assessments.find (bulk delete)", lambda: collection.find(query).explain()
+    ):
+        existing = {doc["_id"] for doc in collection.find(query, {"_id": 1})}
+
+    ops: list[DeleteOne] = []
+    op_items: list[int] = []
+    stopped = False
+    for i in range(len(assessment_ids)):
+        if stopped:
+            results[i]["status"] = BULK_SKIPPED
+        elif i not in ids:
+            stopped = ordered
+        elif ids[i] not in existing:
+            results[i].update(
+                _bulk_item_error(
+                    UserInputError("Assessment not found or already deleted.")
+                )
+            )
+            stopped = ordered
+        else:
+            ops.append(DeleteOne({"_id": ids[i]}))
+            op_items.append(i)
+            existing.discard(ids[i])
+
+    for i in _run_bulk_write(ops, op_items, results, ordered):
+        results[i].update(status=BULK_OK, _id=ids[i])
+
+    return results
+
+
 def get_all_assessments():
     """
     Helper function to return a list of assessments as a dictionary, as stored
@@ -395,4 +1121,127 @@ def get_all_assessments():
     if configs.pymongo is None or configs.pymongo.db is None:
         raise DBError()
 
-    return list(configs.pymongo.db.assessments.find())
+    collection = configs.pymongo.db.assessments
+    with timed_query("assessments.find", lambda: collection.find().explain()):
+        return list(collection.find())
+
+
+def iter_all_assessments(batch_size: int):
+    """
+    Like get_all_assessments, but returns a cursor that fetches the
+    assessments from the database lazily, batch_size documents at a time.
+    """
+    if configs.pymongo is None or configs.pymongo.db is None:
+        raise DBError()
+
+    # this is not timed, because a streamed full collection scan is expected
+    return configs.pymongo.db.assessments.find().batch_size(batch_size)
+
+
+# Only these fields are needed to display an assessment in the history list
+HISTORY_PROJECTION = {
+    "user_input.topic": 1,
+    "user_input.question_type": 1,
+    "user_input.num_questions": 1,
+    "last_modified": 1,
+}
+
+# The index used to page through the history, in both directions
+HISTORY_INDEX = [("last_modified", DESCENDING), ("_id", DESCENDING)]
+
+# All the indexes of the assessments collection
+ASSESSMENT_INDEXES = [
+    IndexModel(HISTORY_INDEX, name="history"),
+    IndexModel(
+        [("user_input.topic", ASCENDING), ("last_modified", DESCENDING)],
+        name="topic",
+    ),
+    IndexModel([("user_input.question_type", ASCENDING)], name="question_type"),
+]
+
+
+def ensure_assessment_indexes():
+    """
+    Creates the indexes in ASSESSMENT_INDEXES, if they do not exist yet
+    """
+    if configs.pymongo is None or configs.pymongo.db is None:
+        raise DBError()
+
+    ensure_indexes(configs.pymongo.db.assessments, ASSESSMENT_INDEXES)
+
+
+def encode_history_cursor(assessment: dict[str, Any]):
+    """
+    Makes an opaque cursor string that points just after the given assessment
+    """
+    key = [assessment["last_modified"], str(assessment["_id"])]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_history_cursor(cursor: str):
+    """
+    Inverse of encode_history_cursor, returns the (last_modified, _id) pair
+    """
+    try:
+        last_modified, _id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(last_modified, str):
+            raise ValueError()
+
+        return last_modified, ObjectId(_id)
+    except (binascii.Error, InvalidId, TypeError, ValueError):
+        raise UserInputError("Invalid history cursor") from None
+
+
+def get_assessment_summaries(
+    limit: int, cursor: str | None = None, order: str = "desc"
+):
+    """
+    Helper function to return a page of assessment summaries, sorted by
+    'last_modified' (and '_id' to break ties).
+
+    Pages are fetched with keyset pagination: the returned 'next_cursor' can be
+    passed back to get the next page, and is None on the last page. The
+    summaries only have the fields listed in HISTORY_PROJECTION.
+    """
+    if configs.pymongo is None or configs.pymongo.db is None:
+        raise DBError()
+
+    if not 0 < limit <= HISTORY_MAX_PAGE_SIZE:
+        raise UserInputError(f"'limit' must be between 1 and {HISTORY_MAX_PAGE_SIZE}")
+
+    if order not in ("asc", "desc"):
+        raise UserInputError("'order' must be one of 'asc' or 'desc'")
+
+    direction = ASCENDING if order == "asc" else DESCENDING
+    query: dict[str, Any] = {}
+    if cursor:
+        last_modified, _id = decode_history_cursor(cursor)
+        compare = "$gt" if order == "asc" else "$lt"
+        query = {
+            "$or": [
+                {"last_modified": {compare: last_modified}},
+                {"last_modified": last_modified, "_id": {compare: _id}},
+            ]
+        }
+
+    # fetch one extra document to know if there is a next page
+    collection = configs.pymongo.db.assessments
+
+    def make_cursor():
+        return (
+            collection.find(query, HISTORY_PROJECTION)
+            .sort([("last_modified", direction), ("_id", direction)])
+            .limit(limit + 1)
+        )
+
+    with timed_query(
+        "assessments.find (history page)", lambda: make_cursor().explain()
+    ):
+        assessments = list(make_cursor())
+
+    next_cursor = None
+    if len(assessments) > limit:
+        assessments = assessments[:limit]
+        next_cursor = encode_history_cursor(assessments[-1])
+
+    return {"assessments": assessments, "next_cursor": next_cursor}
@@ -0,0 +1,3 @@
+"""
+Benchmark scripts for the backend. See README.md in this folder.
+"""
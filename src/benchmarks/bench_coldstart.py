@@ -0,0 +1,109 @@
+"""
+Benchmark of the cold start of a worker process.
+
+This measures, in fresh interpreters:
+- the import time of every module when importing the app (like
+  `python -X importtime`), showing the modules with the largest cumulative
+  import time
+- the time from interpreter start to the first served request (what a new or
+  restarted gunicorn worker costs), as the median of several runs
+
+The frontend check is skipped (it runs once per deploy, see bench_frontend).
+
+Usage (from the src folder):
+$ BENCH_MONGO_URI=mongodb://localhost:27017/bench python -m benchmarks.bench_coldstart
+"""
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks import common  # sets up the environment for the app
+
+from frontend import CHECKED_ENV_VAR
+
+FIRST_REQUEST_SCRIPT = """
+import time
+from app import app
+response = app.test_client().get({path!r})
+assert response.status_code == 200, response.status_code
+print(time.time())
+"""
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|\s+(\S+)")
+
+
+def _env():
+    return {**os.environ, CHECKED_ENV_VAR: "1"}
+
+
+def import_times(module: str):
+    """
+    Imports module in a fresh interpreter with -X importtime, and returns a
+    list of (cumulative us, self us, module name)
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=_env(),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    ret = []
+    for line in result.stderr.splitlines():
+        if match := IMPORTTIME_LINE.match(line):
+            self_us, cumulative_us, name = match.groups()
+            ret.append((int(cumulative_us), int(self_us), name))
+
+    return ret
+
+
+def time_to_first_request(path: str):
+    """
+    Returns the seconds from starting a fresh interpreter until it has served
+    its first request to path
+    """
+    start = time.time()
+    result = subprocess.run(
+        [sys.executable, "-c", FIRST_REQUEST_SCRIPT.format(path=path)],
+        env=_env(),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return float(result.stdout.split()[-1]) - start
+
+
+def main():
+    """
+    Entry point of the benchmark
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-m", "--module", default="app")
+    parser.add_argument("-t", "--top", type=int, default=15)
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    parser.add_argument("-p", "--path", default="/api/v1/stats")
+    args = parser.parse_args()
+
+    common.connect_db()  # checks that the benchmark URI names a database
+    times = import_times(args.module)
+    total = max(times)[0] if times else 0
+    print(f"importing {args.module}: {total / 1000:.1f} ms")
+    print(f"{'cumulative':>12}{'self':>10}  module")
+    for cumulative, self_us, name in sorted(times, reverse=True)[: args.top]:
+        print(f"{cumulative / 1000:>9.1f} ms{self_us / 1000:>7.1f} ms  {name}")
+
+    runs = [time_to_first_request(args.path) for _ in range(args.repeat)]
+    print(
+        f"time to first request ({args.path}): median "
+        f"{statistics.median(runs) * 1000:.1f} ms over {args.repeat} runs "
+        f"(min {min(runs) * 1000:.1f} ms, max {max(runs) * 1000:.1f} ms)"
+    )
+
+
+if __name__ == "__main__":
+    main()
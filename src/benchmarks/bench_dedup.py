@@ -0,0 +1,257 @@
+"""
+Benchmark of near-duplicate question detection (see dedup.py) on a large
+synthetic question history.
+
+Generates --questions synthetic questions, of which --duplicate-fraction are
+near-duplicates (a word inserted, removed or changed) of earlier ones, and
+reports the throughput of computing their MinHash signatures and band keys.
+Then looks up the near-duplicates (with a similarity of at least --threshold)
+of --queries questions, with an LSH index
+(the sorted band keys, searched in O(log n)) and with a brute force
+comparison against every signature, and reports the latency and the recall
+of the planted duplicates of both. With --db, the questions are also stored
+in the question bank of the benchmark database, and the time to add
+assessments to it (which looks up the near-duplicates in the db) is reported.
+
+Usage (from the src folder):
+$ python -m benchmarks.bench_dedup --questions 1000000
+"""
+
+import argparse
+import random
+import string
+import time
+from datetime import datetime
+from unittest import mock
+
+import numpy as np
+from bson import Binary
+
+from benchmarks import common  # sets up the environment for the app
+import dedup
+import question_bank
+from dedup import band_keys, exact_tokens, signatures
+
+STARTS = ["What is", "Explain", "Describe", "Why does", "How does", "Compare"]
+
+
+def make_questions(num: int, duplicate_fraction: float, rng: random.Random):
+    """
+    Returns num synthetic questions, and a dict of the planted near-duplicates
+    to the index of the question they were made from
+    """
+    # words without digits, so the exact tokens (see dedup.py) of all
+    # questions are the same
+    vocabulary = [
+        "".join(rng.choices(string.ascii_lowercase, k=8)) for _ in range(20000)
+    ]
+    questions: list[str] = []
+    duplicates: dict[int, int] = {}
+    for i in range(num):
+        if questions and rng.random() < duplicate_fraction:
+            original = rng.randrange(len(questions))
+            words = questions[original].rstrip("?").split()
+            position = rng.randrange(2, len(words))
+            edit = rng.choice(["insert", "remove", "change"])
+            if edit == "insert":
+                words.insert(position, "the")
+            elif edit == "remove":
+                del words[position]
+            else:
+                words[position] = rng.choice(vocabulary)
+
+            questions.append(" ".join(words) + "?")
+            duplicates[i] = original
+        else:
+            words = rng.choices(vocabulary, k=rng.randint(8, 16))
+            questions.append(f"{rng.choice(STARTS)} {' '.join(words)}?")
+
+    return questions, duplicates
+
+
+class SortedIndex:
+    """
+    An in memory LSH index: the band keys of all signatures, sorted, so the
+    questions sharing a band key are found with a binary search
+    """
+
+    def __init__(self, keys: np.ndarray):
+        flat = keys.ravel()
+        self.order = np.argsort(flat, kind="stable")
+        self.keys = flat[self.order]
+        self.ids = self.order // dedup.BANDS
+
+    def candidates(self, row: np.ndarray):
+        """
+        Returns the indexes of the questions sharing a band key with row
+        """
+        starts = np.searchsorted(self.keys, row, side="left")
+        ends = np.searchsorted(self.keys, row, side="right")
+        return np.unique(np.concatenate([self.ids[s:e] for s, e in zip(starts, ends)]))
+
+
+def lsh_lookup(index: SortedIndex, sigs: np.ndarray, keys: np.ndarray, i: int):
+    """
+    Returns the questions (other than i) that are near-duplicates of question
+    i, and the number of candidates compared
+    """
+    candidates = index.candidates(keys[i])
+    candidates = candidates[candidates != i]
+    matches = (sigs[candidates] == sigs[i]).mean(axis=1) >= dedup.DEDUP_THRESHOLD
+    return set(candidates[matches].tolist()), len(candidates)
+
+
+def brute_force_lookup(sigs: np.ndarray, i: int):
+    """
+    Returns the questions (other than i) that are near-duplicates of question
+    i, by comparing with every signature
+    """
+    matches = np.flatnonzero((sigs == sigs[i]).mean(axis=1) >= dedup.DEDUP_THRESHOLD)
+    return set(matches.tolist()) - {i}
+
+
+def bench_lookups(sigs, keys, duplicates, num_queries, rng):
+    """
+    Prints the latency and recall of LSH and brute force lookups
+    """
+    start = time.perf_counter()
+    index = SortedIndex(keys)
+    print(f"LSH index build: {time.perf_counter() - start:.2f} s")
+
+    queries = rng.sample(sorted(duplicates), min(num_queries, len(duplicates)))
+    results = {}
+    for name, lookup in (
+        ("LSH", lambda i: lsh_lookup(index, sigs, keys, i)[0]),
+        ("brute force", lambda i: brute_force_lookup(sigs, i)),
+    ):
+        start = time.perf_counter()
+        found = [duplicates[i] in lookup(i) for i in queries]
+        seconds = (time.perf_counter() - start) / len(queries)
+        results[name] = seconds
+        print(
+            f"{name:<12} lookup: {seconds * 1000:8.3f} ms/question, "
+            f"recall {sum(found) / len(found):.3f}"
+        )
+
+    num_candidates = [lsh_lookup(index, sigs, keys, i)[1] for i in queries[:100]]
+    print(
+        f"LSH compared {np.mean(num_candidates):.1f} candidates/question, "
+        f"{results['brute force'] / results['LSH']:.0f}x faster than brute force"
+    )
+
+
+def bench_db(questions, sigs, keys, num_queries, rng):
+    """
+    Stores the questions in the question bank of the benchmark database, and
+    prints the time to add assessments with near-duplicate questions to it
+    """
+    collection = common.connect_db().question_bank
+    collection.drop()
+    now = datetime.now()
+    start = time.perf_counter()
+    for chunk in range(0, len(questions), 10000):
+        collection.insert_many(
+            {
+                "_id": f"bench{i}",
+                "topic": "bench",
+                "question_type": "Short Answer",
+                "keywords": [],
+                "question": {
+                    "question_type": "Short Answer",
+                    "question": questions[i],
+                    "sample_answer": "a",
+                },
+                "exact": exact_tokens(questions[i]),
+                "lsh": keys[i].tolist(),
+                "minhash": Binary(sigs[i].tobytes()),
+                "created": now,
+            }
+            for i in range(chunk, min(chunk + 10000, len(questions)))
+        )
+
+    with mock.patch("question_bank.QUESTION_BANK", 1):
+        question_bank.ensure_question_bank_indexes()
+        print(
+            f"db: stored {len(questions)} questions in "
+            f"{time.perf_counter() - start:.1f} s"
+        )
+
+        assessments = [
+            {
+                "user_input": {
+                    "topic": "bench",
+                    "question_type": "Short Answer",
+                    "context_keywords": "",
+                    "pdfs": [],
+                },
+                "questions": [
+                    {
+                        "question_type": "Short Answer",
+                        "question": questions[i] + " now",
+                        "sample_answer": "a",
+                    }
+                    for i in rng.sample(range(len(questions)), 10)
+                ],
+            }
+            for _ in range(max(num_queries // 10, 1))
+        ]
+        before = collection.estimated_document_count()
+        start = time.perf_counter()
+        for assessment in assessments:
+            question_bank.add_assessments([assessment])
+        seconds = (time.perf_counter() - start) / len(assessments)
+
+    added = collection.estimated_document_count() - before
+    print(
+        f"db: added assessments of 10 questions in {seconds * 1000:.1f} ms each, "
+        f"{added} of {len(assessments) * 10} near-duplicates were added as new"
+    )
+
+
+def main():
+    """
+    Entry point of the benchmark
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--questions", type=int, default=1000000)
+    parser.add_argument("--duplicate-fraction", type=float, default=0.1)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--db", action="store_true")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--threshold", type=float, default=0.9)
+    args = parser.parse_args()
+    dedup.DEDUP_THRESHOLD = args.threshold
+    rng = random.Random(args.seed)
+
+    questions, duplicates = make_questions(args.questions, args.duplicate_fraction, rng)
+    print(
+        f"{len(questions)} questions, {len(duplicates)} near-duplicates, "
+        f"threshold {dedup.DEDUP_THRESHOLD}"
+    )
+
+    start = time.perf_counter()
+    sigs = signatures(questions)
+    sig_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    keys = band_keys(sigs)
+    key_seconds = time.perf_counter() - start
+    print(
+        f"signatures: {sig_seconds:.1f} s ({len(questions) / sig_seconds:,.0f} "
+        f"questions/s), band keys: {key_seconds:.2f} s"
+    )
+
+    start = time.perf_counter()
+    matches = dedup.find_duplicates(questions[:100000])
+    seconds = time.perf_counter() - start
+    print(
+        f"find_duplicates of {len(matches)} questions: {seconds:.1f} s, "
+        f"{sum(i is not None for i in matches)} near-duplicates found"
+    )
+
+    bench_lookups(sigs, keys, duplicates, args.queries, rng)
+    if args.db:
+        bench_db(questions, sigs, keys, args.queries, rng)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark of the frontend staleness check done at startup.
+
+This compares the old check (the newest modification time of the whole
+frontend folder, including node_modules, done in every worker) with the
+manifest check of frontend.py (done once in the gunicorn master), and reports
+the startup time saved per deploy.
+
+Usage (from the src folder):
+$ python -m benchmarks.bench_frontend --workers 9 --synthetic 30000
+
+With --synthetic N, a copy of the frontend inputs is made in a temporary
+folder along with N fake node_modules files, so that the benchmark does not
+need an installed frontend.
+"""
+
+import argparse
+import shutil
+import tempfile
+from pathlib import Path
+
+from benchmarks.common import measure
+import frontend
+from configs import FRONTEND_BASE
+
+
+def newest_mtime(path: Path):
+    """
+    The old check: the newest modification time of everything under path
+    """
+    ret = path.stat().st_mtime_ns
+    if path.is_dir():
+        for child in path.iterdir():
+            ret = max(ret, newest_mtime(child))
+
+    return ret
+
+
+def make_synthetic(base: Path, num_files: int):
+    """
+    Copies the frontend inputs to base, and adds num_files fake node_modules
+    files in packages of 50 files
+    """
+    for name in frontend.FRONTEND_INPUTS:
+        path = FRONTEND_BASE / name
+        if path.is_dir():
+            shutil.copytree(path, base / name)
+        elif path.is_file():
+            shutil.copy2(path, base / name)
+
+    for i in range(num_files):
+        package = base / "node_modules" / f"package{i // 50}"
+        package.mkdir(parents=True, exist_ok=True)
+        (package / f"file{i % 50}.js").write_text("module.exports = {};")
+
+    (base / "build").mkdir()
+
+
+def main():
+    """
+    Entry point of the benchmark
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-w", "--workers", type=int, default=9)
+    parser.add_argument("-s", "--synthetic", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        base = FRONTEND_BASE
+        if args.synthetic:
+            base = Path(temp_dir)
+            make_synthetic(base, args.synthetic)
+            frontend.FRONTEND_BASE = base
+            frontend.FRONTEND_BUILD = base / "build"
+            frontend.MANIFEST_PATH = base / "build" / ".inputs-manifest.json"
+            frontend.save_manifest()
+
+        old, _ = measure(lambda: newest_mtime(base))
+        new, _ = measure(frontend.is_stale)
+
+    print(f"old check: {old * 1000:8.1f} ms per worker, {args.workers} workers")
+    print(f"new check: {new * 1000:8.1f} ms once per deploy")
+    print(f"saved:     {(old * args.workers - new) * 1000:8.1f} ms per deploy")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Benchmark comparing the full history dump (/api/v1/get_history) with the
+paginated summaries (/api/v1/get_history_page).
+
+The database is seeded with synthetic assessments, and both are measured the
+same way their endpoints use them: query, then serialize with json_util.
+
+Usage (from the src folder):
+$ BENCH_MONGO_URI=mongodb://localhost:27017/bench python -m benchmarks.bench_history
+"""
+
+import argparse
+
+from bson import json_util
+
+from benchmarks.common import connect_db, make_assessment_doc, measure
+from assessment import (
+    ensure_assessment_indexes,
+    get_all_assessments,
+    get_assessment_summaries,
+)
+from configs import HISTORY_PAGE_SIZE
+
+
+def seed(db, num_docs: int, num_questions: int):
+    """
+    Replaces the assessments collection with num_docs synthetic documents
+    """
+    db.assessments.drop()
+    batch = []
+    for i in range(num_docs):
+        batch.append(make_assessment_doc(i, num_questions))
+        if len(batch) == 1000:
+            db.assessments.insert_many(batch)
+            batch = []
+
+    if batch:
+        db.assessments.insert_many(batch)
+
+    ensure_assessment_indexes()
+
+
+def walk_all_pages(limit: int):
+    """
+    Fetches every page of summaries, returns the number of pages
+    """
+    pages = 0
+    cursor = None
+    while True:
+        page = get_assessment_summaries(limit, cursor)
+        json_util.dumps(page)
+        pages += 1
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return pages
+
+
+def main():
+    """
+    Entry point of the benchmark
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--num-docs", type=int, default=20000)
+    parser.add_argument("-q", "--num-questions", type=int, default=10)
+    parser.add_argument("--limit", type=int, default=HISTORY_PAGE_SIZE)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    db = connect_db()
+    print(f"Seeding {args.num_docs} assessments...")
+    seed(db, args.num_docs, args.num_questions)
+
+    full_time, full_body = measure(
+        lambda: json_util.dumps(get_all_assessments()), args.repeat
+    )
+    page_time, page_body = measure(
+        lambda: json_util.dumps(get_assessment_summaries(args.limit)), args.repeat
+    )
+
+    # a page deep into the history must be as cheap as the first one
+    deep = get_assessment_summaries(args.limit)
+    for _ in range(min(50, args.num_docs // args.limit - 1)):
+        deep = get_assessment_summaries(args.limit, deep["next_cursor"])
+    deep_time, deep_body = measure(
+        lambda: json_util.dumps(
+            get_assessment_summaries(args.limit, deep["next_cursor"])
+        ),
+        args.repeat,
+    )
+    walk_time, pages = measure(lambda: walk_all_pages(args.limit), 1)
+
+    explain = (
+        db.assessments.find({}, {"last_modified": 1})
+        .sort([("last_modified", -1), ("_id", -1)])
+        .limit(args.limit)
+        .explain()
+    )
+    winning_plan = explain["queryPlanner"]["winningPlan"]
+
+    print(f"{'variant':<28}{'median time':>14}{'response size':>16}")
+    for name, seconds, body in (
+        ("get_history (full dump)", full_time, full_body),
+        ("get_history_page (first)", page_time, page_body),
+        ("get_history_page (deep)", deep_time, deep_body),
+    ):
+        print(f"{name:<28}{seconds * 1000:>11.1f} ms{len(body) / 1024:>12.1f} KiB")
+    print(f"All {pages} pages walked in {walk_time:.2f} s")
+    print(f"History query plan: {winning_plan}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+End to end load test of the app, for capacity planning without the real LLM.
+
+Requests to /api/v1/generate_assessment, /api/v1/get_history and
+/api/v1/save_assessment are sent in a weighted mix at a fixed target rate
+(open loop: a request is sent on schedule even if earlier ones have not
+finished, and its latency is measured from when it was scheduled, so a slow
+server cannot hide its queueing delay by slowing down the clients). This
+reports the throughput, the errors and the p50/p95/p99 latency per endpoint.
+
+By default, gunicorn is started on the benchmark database with the LLM
+pointed at the stub inference server (see stub_llm.py, whose options are
+accepted here). The assessments collection is replaced with --history-docs
+synthetic documents first. Pass --url to load test an already running server
+instead (its database is not touched, other than the saved assessments).
+
+Usage (from the src folder, with gunicorn installed):
+$ BENCH_MONGO_URI=mongodb://localhost:27017/bench python -m benchmarks.bench_load --rps 20 --latency lognormal:2,0.5
+"""
+
+import argparse
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+import requests
+
+from benchmarks import common  # sets up the environment for the app
+from benchmarks.bench_history import seed
+from benchmarks.stub_llm import add_arguments, settings_from_args, start_stub
+
+ENDPOINTS = {
+    "generate": "/api/v1/generate_assessment",
+    "history": "/api/v1/get_history",
+    "save": "/api/v1/save_assessment",
+}
+
+
+def parse_mix(spec: str):
+    """
+    Parses a mix like 'generate=1,history=4,save=2' into a dict of weights
+    """
+    ret = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint '{name}' in mix")
+
+        ret[name] = float(weight or 1)
+
+    return ret
+
+
+class LoadClient:
+    """
+    Sends the requests of the load test, and records their outcomes. Every
+    thread has its own session.
+    """
+
+    def __init__(self, base: str, args: argparse.Namespace):
+        self.base = base
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.results: dict[str, list[tuple[float, int]]] = {i: [] for i in ENDPOINTS}
+        self.saved: list[dict] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._index = 0
+
+    def session(self):
+        """
+        Returns the session of the current thread
+        """
+        if (session := getattr(self._local, "session", None)) is None:
+            session = self._local.session = requests.Session()
+
+        return session
+
+    def _next_doc(self):
+        with self._lock:
+            self._index += 1
+            return common.make_assessment_doc(
+                self._index, self.args.assessment_questions
+            )
+
+    def generate(self):
+        """
+        Generates an assessment
+        """
+        return self.session().post(
+            self.base + ENDPOINTS["generate"],
+            data={
+                "topic": self.rng.choice(common.TOPICS),
+                "question_type": self.rng.choice(["MCQ", "SA", "LA"]),
+                "num_questions": self.args.assessment_questions,
+                "fresh": "true",
+            },
+            timeout=self.args.timeout,
+        )
+
+    def history(self):
+        """
+        Fetches the whole history
+        """
+        return self.session().get(
+            self.base + ENDPOINTS["history"], timeout=self.args.timeout
+        )
+
+    def save(self):
+        """
+        Saves a new copy of an assessment, or (with --overwrite-fraction
+        probability) edits one that was saved before
+        """
+        saved = None
+        if self.saved and self.rng.random() < self.args.overwrite_fraction:
+            with self._lock:
+                saved = self.rng.choice(self.saved)
+                doc = {**saved, "questions": [dict(i) for i in saved["questions"]]}
+            doc["questions"][0]["question"] += " (edited)"
+        else:
+            doc = self._next_doc()
+
+        response = self.session().post(
+            self.base + ENDPOINTS["save"], json=doc, timeout=self.args.timeout
+        )
+        if response.ok:
+            doc.update(response.json())
+            with self._lock:
+                if saved is not None:
+                    # the next edit of this assessment is based on this save
+                    saved.update(doc)
+                elif len(self.saved) < 1000:
+                    self.saved.append(doc)
+
+        return response
+
+    def run(self, name: str, scheduled: float):
+        """
+        Sends one request to the endpoint name, and records its latency from
+        scheduled (a time.perf_counter value) and its status (0 when there was
+        no response)
+        """
+        try:
+            status = getattr(self, name)().status_code
+        except requests.RequestException:
+            status = 0
+
+        latency = time.perf_counter() - scheduled
+        with self._lock:
+            self.results[name].append((latency, status))
+
+
+def run_load(client: LoadClient, mix: dict[str, float], rps: float, duration: float):
+    """
+    Sends requests at rps requests per second for duration seconds, and
+    returns the seconds until the last one finished
+    """
+    names = list(mix)
+    weights = [mix[i] for i in names]
+    rng = random.Random(client.args.seed)
+    with ThreadPoolExecutor(client.args.max_inflight) as executor:
+        start = time.perf_counter()
+        for i in range(int(rps * duration)):
+            scheduled = start + i / rps
+            if (delay := scheduled - time.perf_counter()) > 0:
+                time.sleep(delay)
+            executor.submit(client.run, rng.choices(names, weights)[0], scheduled)
+
+    return time.perf_counter() - start
+
+
+def report(client: LoadClient, elapsed: float):
+    """
+    Prints the results of the load test
+    """
+    print(
+        f"{'endpoint':<10}{'sent':>7}{'ok':>7}{'errors':>8}{'req/s':>8}"
+        f"{'p50':>10}{'p95':>10}{'p99':>10}"
+    )
+    rows = {**client.results, "total": sum(client.results.values(), [])}
+    for name, results in rows.items():
+        if not results:
+            continue
+
+        ok = [latency for latency, status in results if 200 <= status < 300]
+        print(
+            f"{name:<10}{len(results):>7}{len(ok):>7}{len(results) - len(ok):>8}"
+            f"{len(ok) / elapsed:>8.1f}"
+            + "".join(
+                f"{common.percentile(ok, i) * 1000:>7.0f} ms" for i in (50, 95, 99)
+            )
+        )
+
+    errors: dict[int, int] = {}
+    for _, status in rows["total"]:
+        if not 200 <= status < 300:
+            errors[status] = errors.get(status, 0) + 1
+
+    if errors:
+        print(
+            "errors by status (0 is no response): "
+            + ", ".join(f"{k}: {v}" for k, v in sorted(errors.items()))
+        )
+
+
+def main():
+    """
+    Entry point of the benchmark
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-u", "--url", default=None)
+    parser.add_argument("-r", "--rps", type=float, default=10)
+    parser.add_argument("-d", "--duration", type=float, default=60)
+    parser.add_argument("-m", "--mix", default="generate=1,history=4,save=2")
+    parser.add_argument("-p", "--profile", default="sync")
+    parser.add_argument("--max-inflight", type=int, default=256)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--assessment-questions", type=int, default=5)
+    parser.add_argument("--history-docs", type=int, default=1000)
+    parser.add_argument("--overwrite-fraction", type=float, default=0.5)
+    parser.add_argument("--warmup", type=int, default=20)
+    add_arguments(parser)
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+
+    llm = None
+    if args.url is None:
+        seed(common.connect_db(), args.history_docs, args.assessment_questions)
+        llm = start_stub(settings_from_args(args))
+        server = common.run_gunicorn(
+            WORKER_PROFILE=args.profile, API_URL=llm.url, LLM_CACHE_TTL="0"
+        )
+    else:
+        server = nullcontext((args.url.rstrip("/"), None))
+
+    with server as (base, _):
+        client = LoadClient(base, args)
+        for _ in range(args.warmup):
+            client.save()
+
+        elapsed = run_load(client, mix, args.rps, args.duration)
+
+    print(
+        f"target {args.rps:.1f} req/s for {args.duration:.0f} s, "
+        f"finished in {elapsed:.1f} s"
+    )
+    report(client, elapsed)
+    if llm is not None:
+        print(f"stub LLM: {llm.stats}")
+        llm.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Load test of the gunicorn worker profiles (see gunicorn.conf.py) under a slow
+LLM.
+
+For every profile, gunicorn is started with the LLM pointed at a local stub
+(see stub_llm.py) that answers after a fixed delay, and closed loop clients call
+/api/v1/generate_assessment for a fixed time. This reports the throughput,
+the median latency and the peak RSS of all gunicorn processes.
+
+Usage (from the src folder, with gunicorn installed):
+$ BENCH_MONGO_URI=mongodb://localhost:27017/bench python -m benchmarks.bench_profiles
+"""
+
+import argparse
+import re
+import statistics
+import threading
+import time
+from pathlib import Path
+
+import requests
+
+from benchmarks import common  # sets up the environment for the app
+from benchmarks.stub_llm import StubSettings, start_stub
+
+
+def tree_rss(pid: int):
+    """
+    Returns the total RSS (in bytes) of the process pid and its children
+    """
+    children: dict[int, list[int]] = {}
+    for stat_file in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            fields = stat_file.read_text().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        children.setdefault(int(fields[1]), []).append(int(stat_file.parent.name))
+
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        pending.extend(children.get(current, []))
+        try:
+            status = Path(f"/proc/{current}/status").read_text()
+        except OSError:
+            continue
+        if match := re.search(r"VmRSS:\s+(\d+) kB", status):
+            total += int(match[1]) * 1024
+
+    return total
+
+
+def run_profile(profile: str, llm_url: str, concurrency: int, duration: float):
+    """
+    Runs the load test against a gunicorn with the given profile, and returns
+    (successful requests, failed requests, latencies, peak RSS)
+    """
+    with common.run_gunicorn(
+        WORKER_PROFILE=profile, API_URL=llm_url, LLM_CACHE_TTL="0"
+    ) as (base, server):
+        latencies: list[float] = []
+        failures = []
+        peak_rss = 0
+        end = time.monotonic() + duration
+
+        def client():
+            session = requests.Session()
+            while time.monotonic() < end:
+                start = time.perf_counter()
+                response = session.post(
+                    f"{base}/api/v1/generate_assessment",
+                    data={
+                        "topic": "Physics",
+                        "question_type": "SA",
+                        "num_questions": 5,
+                    },
+                    timeout=600,
+                )
+                if response.ok:
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    failures.append(response.status_code)
+
+        threads = [threading.Thread(target=client) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        while any(i.is_alive() for i in threads):
+            peak_rss = max(peak_rss, tree_rss(server.pid))
+            time.sleep(0.5)
+
+        return len(latencies), len(failures), latencies, peak_rss
+
+
+def main():
+    """
+    Entry point of the benchmark
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-p", "--profiles", nargs="+", default=["sync", "gthread"])
+    parser.add_argument("-c", "--concurrency", type=int, default=32)
+    parser.add_argument("-d", "--duration", type=float, default=30)
+    parser.add_argument("-l", "--llm-latency", type=float, default=2.0)
+    args = parser.parse_args()
+
+    common.connect_db()  # checks that the benchmark URI names a database
+    llm = start_stub(StubSettings(latency=f"fixed:{args.llm_latency}"))
+
+    print(
+        f"{'profile':<10}{'ok':>6}{'failed':>8}{'req/s':>8}"
+        f"{'median':>10}{'peak RSS':>12}"
+    )
+    for profile in args.profiles:
+        num_ok, num_failed, latencies, peak_rss = run_profile(
+            profile, llm.url, args.concurrency, args.duration
+        )
+        median = statistics.median(latencies) if latencies else float("nan")
+        print(
+            f"{profile:<10}{num_ok:>6}{num_failed:>8}{num_ok / args.duration:>8.1f}"
+            f"{median:>8.2f} s{peak_rss / 2**20:>8.0f} MiB"
+        )
+
+    llm.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark of constructing question objects in bulk, like loading many
+assessments for a report does.
+
+This compares make_questions on the (slotted) question classes with the same
+classes when they have a per-instance dict, in construction time and in the
+growth of the process RSS. Every variant runs in a fresh process, so that
+memory freed by one variant does not hide the usage of the next.
+
+Usage (from the src folder):
+$ python -m benchmarks.bench_questions -n 100000
+"""
+
+import argparse
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from benchmarks.common import make_assessment_doc
+import assessment
+
+
+def rss_bytes():
+    """
+    Returns the current RSS of this process (the peak RSS where /proc is not
+    available)
+    """
+    try:
+        with open("/proc/self/statm", encoding="ascii") as file:
+            return int(file.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def make_question_dicts(num_questions: int):
+    """
+    Returns num_questions question dicts, half MCQ and half subjective
+    """
+    ret = []
+    for i, question in enumerate(
+        make_assessment_doc(0, num_questions // 2)["questions"]
+    ):
+        ret.append(question)
+        ret.append(
+            {
+                "question_type": "Short Answer" if i % 2 else "Long Answer",
+                "question": f"Explain concept number {i}.",
+                "sample_answer": f"Concept number {i} is explained here.",
+            }
+        )
+
+    return ret
+
+
+def run(variant: str, num_questions: int):
+    """
+    Constructs the questions with the given variant, and returns the time
+    taken and the RSS growth
+    """
+    if variant == "dict":
+        # subclasses without __slots__ get a per-instance dict again
+        for name in ("QuestionMCQ", "QuestionShortAnswer", "QuestionLongAnswer"):
+            cls = getattr(assessment, name)
+            setattr(assessment, name, type(name, (cls,), {}))
+        assessment._question_class.cache_clear()
+
+    dicts = make_question_dicts(num_questions)
+    before = rss_bytes()
+    start = time.perf_counter()
+    questions = assessment.make_questions(dicts)
+    elapsed = time.perf_counter() - start
+    growth = rss_bytes() - before
+    assert len(questions) == len(dicts)
+    return elapsed, growth
+
+
+def main():
+    """
+    Entry point of the benchmark
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--num-questions", type=int, default=100000)
+    args = parser.parse_args()
+
+    print(f"{'questions':>10} {'variant':<8}{'time':>11}{'RSS growth':>14}")
+    for variant in ("dict", "slots"):
+        with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as executor:
+            elapsed, growth = executor.submit(run, variant, args.num_questions).result()
+
+        print(
+            f"{args.num_questions:>10} {variant:<8}{elapsed * 1000:>8.1f} ms"
+            f"{growth / 2**20:>10.1f} MiB"
+        )
+
+
+if __name__ == "__main__":
+    main()
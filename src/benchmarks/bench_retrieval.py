@@ -0,0 +1,102 @@
+"""
+Benchmark of the prompt size and latency with and without retrieval of the
+relevant PDF context.
+
+Uses the text of the given PDF (or a synthetic textbook), and compares the
+prompt built with the whole text against the prompt built from the selected
+chunks. With --llm, both prompts are also sent to the LLM to measure the end
+to end latency (this needs API_TOKEN, and costs two LLM calls per repeat).
+
+Usage (from the src folder):
+$ python -m benchmarks.bench_retrieval --pdf uploads/textbook.pdf
+"""
+
+import argparse
+import random
+from pathlib import Path
+from unittest import mock
+
+from benchmarks.common import measure
+import retrieval
+from configs import PDF_CONTEXT_TOKEN_BUDGET
+from extraction import extract_text
+from llm_interface import get_prompt_response
+from retrieval import estimate_tokens
+from userinput import UserInput
+
+SECTION_TOPICS = ["thermodynamics", "optics", "electrostatics", "kinematics", "waves"]
+
+
+def synthetic_textbook(num_words: int):
+    """
+    Returns text made of sections on different physics topics
+    """
+    vocabulary = [f"word{i}" for i in range(5000)]
+    words = []
+    while len(words) < num_words:
+        topic = random.choice(SECTION_TOPICS)
+        for _ in range(400):
+            words.append(topic if random.random() < 0.02 else random.choice(vocabulary))
+
+    return " ".join(words[:num_words])
+
+
+def make_prompt(text: str, token_budget: int):
+    """
+    Builds the prompt for a thermodynamics assessment with the given PDF text
+    """
+    user_input = UserInput("Thermodynamics", "MCQ", 10, ["textbook.pdf"])
+    with mock.patch("userinput.get_upload_texts", return_value=[text]), mock.patch(
+        "userinput.PDF_CONTEXT_TOKEN_BUDGET", token_budget
+    ):
+        return user_input.make_prompt()
+
+
+def main():
+    """
+    Entry point of the benchmark
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pdf", type=Path)
+    parser.add_argument("--words", type=int, default=200000)
+    parser.add_argument("--budget", type=int, default=PDF_CONTEXT_TOKEN_BUDGET)
+    parser.add_argument("--llm", action="store_true")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    text = extract_text(args.pdf) if args.pdf else synthetic_textbook(args.words)
+
+    retrieval.get_index.cache_clear()
+    cold_time, selected_prompt = measure(lambda: make_prompt(text, args.budget), 1)
+    warm_time, _ = measure(lambda: make_prompt(text, args.budget), args.repeat)
+    full_time, full_prompt = measure(lambda: make_prompt(text, 0), args.repeat)
+
+    print(f"PDF text: {len(text.split())} words, ~{estimate_tokens(text)} tokens")
+    print(f"{'prompt':<22}{'chars':>10}{'~tokens':>10}{'build time':>14}")
+    print(
+        f"{'whole PDF':<22}{len(full_prompt):>10}{estimate_tokens(full_prompt):>10}"
+        f"{full_time * 1000:>11.1f} ms"
+    )
+    for name, seconds in (("retrieval (cold)", cold_time), ("retrieval", warm_time)):
+        print(
+            f"{name:<22}{len(selected_prompt):>10}"
+            f"{estimate_tokens(selected_prompt):>10}{seconds * 1000:>11.1f} ms"
+        )
+
+    if args.llm:
+        for name, prompt in (
+            ("whole PDF", full_prompt),
+            ("retrieval", selected_prompt),
+        ):
+            try:
+                seconds, _ = measure(
+                    lambda p=prompt: get_prompt_response(p, use_cache=False),
+                    args.repeat,
+                )
+                print(f"LLM latency with {name}: {seconds:.2f} s")
+            except Exception as err:  # the whole PDF may not fit the model
+                print(f"LLM call with {name} failed: {err}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark comparing the full history dump (what bsonify does) with the
+streamed history (what /api/v1/get_history?stream=ndjson does).
+
+For both, this measures the time until the first byte is ready, the total
+time, and the peak Python heap allocated while encoding.
+
+Usage (from the src folder):
+$ BENCH_MONGO_URI=mongodb://localhost:27017/bench python -m benchmarks.bench_stream
+"""
+
+import argparse
+import time
+import tracemalloc
+
+from bson import json_util
+
+from benchmarks.bench_history import seed
+from benchmarks.common import connect_db
+from assessment import get_all_assessments, iter_all_assessments
+from configs import STREAM_BATCH_SIZE
+from streaming import iter_json_array, iter_ndjson
+
+
+def run(make_chunks):
+    """
+    Consumes the chunks returned by make_chunks(), and returns the time to the
+    first chunk, the total time, the response size and the peak heap usage
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    first = None
+    size = 0
+    for chunk in make_chunks():
+        if first is None:
+            first = time.perf_counter() - start
+        size += len(chunk)
+
+    total = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return first, total, size, peak
+
+
+def main():
+    """
+    Entry point of the benchmark
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--num-docs", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("-q", "--num-questions", type=int, default=10)
+    args = parser.parse_args()
+
+    db = connect_db()
+    variants = {
+        "full dump": lambda: [json_util.dumps(get_all_assessments())],
+        "ndjson stream": lambda: iter_ndjson(
+            iter_all_assessments(STREAM_BATCH_SIZE), STREAM_BATCH_SIZE
+        ),
+        "json array stream": lambda: iter_json_array(
+            iter_all_assessments(STREAM_BATCH_SIZE), STREAM_BATCH_SIZE
+        ),
+    }
+
+    print(
+        f"{'docs':>7} {'variant':<18}{'first byte':>12}{'total':>11}"
+        f"{'size':>12}{'peak heap':>12}"
+    )
+    for num_docs in args.num_docs:
+        seed(db, num_docs, args.num_questions)
+        for name, make_chunks in variants.items():
+            first, total, size, peak = run(make_chunks)
+            print(
+                f"{num_docs:>7} {name:<18}{first * 1000:>9.1f} ms{total * 1000:>8.1f} ms"
+                f"{size / 2**20:>8.1f} MiB{peak / 2**20:>8.1f} MiB"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Helpers shared by the benchmark scripts
+"""
+
+import math
+import os
+import random
+import socket
+import statistics
+import subprocess
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Any, Callable
+
+# configs needs these to be set, but most benchmarks don't talk to the LLM
+os.environ.setdefault("API_TOKEN", "unused")
+if "BENCH_MONGO_URI" in os.environ:
+    os.environ["MONGO_URI"] = os.environ["BENCH_MONGO_URI"]
+else:
+    os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/bench")
+
+import requests
+from flask import Flask
+from flask_pymongo import PyMongo
+
+import configs
+from frontend import CHECKED_ENV_VAR
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TOPICS = ["Thermodynamics", "Organic Chemistry", "Algebra", "World War II", "Cells"]
+
+
+def connect_db():
+    """
+    Sets configs.pymongo to the benchmark database, just like app.py does
+    for the real one. Make sure BENCH_MONGO_URI points to a scratch database,
+    because benchmarks can drop its collections.
+    """
+    configs.pymongo = PyMongo(Flask(__name__), os.environ["MONGO_URI"])
+    if configs.pymongo.db is None:
+        raise RuntimeError("The benchmark Mongo URI must include a database name")
+
+    return configs.pymongo.db
+
+
+def make_assessment_doc(index: int, num_questions: int = 10):
+    """
+    Returns a synthetic assessment document, in the format stored in the db
+    """
+    topic = TOPICS[index % len(TOPICS)]
+    last_modified = datetime(2024, 1, 1) + timedelta(minutes=index)
+    return {
+        "user_input": {
+            "topic": topic,
+            "question_type": "MCQ",
+            "num_questions": num_questions,
+            "context_keywords": "",
+            "pdfs": [],
+        },
+        "questions": [
+            {
+                "question_type": "MCQ",
+                "question": f"Question {i} of assessment {index} on {topic}?",
+                "options": [f"Option {j} " * random.randint(1, 8) for j in range(4)],
+                "correct_answer": random.randrange(4),
+            }
+            for i in range(num_questions)
+        ],
+        "last_modified": last_modified.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def measure(func: Callable[[], Any], repeat: int = 5):
+    """
+    Calls func repeat times, and returns (median seconds, last return value)
+    """
+    times = []
+    ret = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ret = func()
+        times.append(time.perf_counter() - start)
+
+    return statistics.median(times), ret
+
+
+def percentile(values: list[float], percent: float):
+    """
+    Returns the nearest-rank percentile of values, or nan if there are none
+    """
+    if not values:
+        return float("nan")
+
+    ordered = sorted(values)
+    return ordered[max(math.ceil(len(ordered) * percent / 100) - 1, 0)]
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def run_gunicorn(**env: str):
+    """
+    Starts the app under gunicorn (with gunicorn.conf.py) on a free local port,
+    with the extra environment variables env, and yields (base URL, process)
+    once it serves requests. The frontend check is skipped.
+    """
+    port = _free_port()
+    server = subprocess.Popen(
+        ["gunicorn", "--access-logfile", "/dev/null"],
+        cwd=SRC,
+        env={
+            **os.environ,
+            "BIND": f"127.0.0.1:{port}",
+            CHECKED_ENV_VAR: "1",
+            **env,
+        },
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    base = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                requests.get(f"{base}/api/v1/stats", timeout=5)
+                break
+            except requests.ConnectionError:
+                if time.monotonic() > deadline or server.poll() is not None:
+                    raise
+                time.sleep(0.5)
+
+        yield base, server
+    finally:
+        server.terminate()
+        server.wait()
@@ -0,0 +1,301 @@
+"""
+A local stand-in for the inference API, for load testing the app offline.
+
+It implements the same contract as the hugging face inference API that
+llm_interface.py uses: a POST with {"inputs": prompt, ...} is answered with
+[{"generated_text": text}], or (when the payload has "stream": true) with a
+server-sent events stream of tokens. The generated text is a JSON list of as
+many questions as the prompt asks for, of the type it asks for.
+
+The latency, error rate and response size are configurable. Latencies are
+given as a distribution spec, one of:
+- fixed:SECONDS
+- uniform:LOW,HIGH
+- normal:MEAN,STDDEV
+- lognormal:MEDIAN,SIGMA
+- exponential:MEAN
+
+Usage (from the src folder), then start the app with API_URL set to the
+printed URL:
+$ python -m benchmarks.stub_llm --port 8080 --latency lognormal:2,0.5 --error-rate 0.05
+"""
+
+import argparse
+import itertools
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+LATENCY_DISTRIBUTIONS: dict[str, Callable[..., float]] = {
+    "fixed": lambda rng, value: value,
+    "uniform": lambda rng, low, high: rng.uniform(low, high),
+    "normal": lambda rng, mean, stddev: max(rng.gauss(mean, stddev), 0.0),
+    "lognormal": lambda rng, median, sigma: median * math.exp(rng.gauss(0, sigma)),
+    "exponential": lambda rng, mean: rng.expovariate(1 / mean),
+}
+
+PROMPT_REGEX = re.compile(r"Generate (\d+) (.+?) style")
+
+
+def parse_latency(spec: str, rng: random.Random):
+    """
+    Returns a function that samples latencies (in seconds) from the
+    distribution described by spec (like 'lognormal:2,0.5')
+    """
+    name, _, params = spec.partition(":")
+    if name not in LATENCY_DISTRIBUTIONS:
+        raise ValueError(
+            f"Unknown latency distribution '{name}', must be one of "
+            f"{', '.join(LATENCY_DISTRIBUTIONS)}"
+        )
+
+    try:
+        args = [float(i) for i in params.split(",")] if params else []
+        sample = LATENCY_DISTRIBUTIONS[name]
+        sample(rng, *args)
+    except (TypeError, ValueError, ZeroDivisionError):
+        raise ValueError(f"Invalid parameters for latency '{spec}'") from None
+
+    return lambda: sample(rng, *args)
+
+
+class StubSettings:
+    """
+    The behaviour of the stub inference server.
+
+    - latency: the distribution spec of the time taken by a response
+    - error_rate: the fraction of requests answered with one of error_statuses
+    - bad_output_rate: the fraction of responses whose generated text is cut
+      off in the middle (like a model that ran out of tokens)
+    - num_questions: the number of questions in every response, by default
+      the number the prompt asks for
+    - answer_words: the number of words in every answer and option, which
+      controls the response size
+    - stream_chunks: the number of chunks a streamed response is split into
+    """
+
+    def __init__(
+        self,
+        latency: str = "fixed:1",
+        error_rate: float = 0.0,
+        error_statuses: tuple[int, ...] = (503,),
+        bad_output_rate: float = 0.0,
+        num_questions: int | None = None,
+        answer_words: int = 5,
+        stream_chunks: int = 20,
+        seed: int | None = None,
+    ):
+        self.rng = random.Random(seed)
+        self.latency = parse_latency(latency, self.rng)
+        self.error_rate = error_rate
+        self.error_statuses = error_statuses
+        self.bad_output_rate = bad_output_rate
+        self.num_questions = num_questions
+        self.answer_words = answer_words
+        self.stream_chunks = max(stream_chunks, 1)
+
+
+class StubLLMServer(ThreadingHTTPServer):
+    """
+    The stub inference server. Counts the requests it gets and the errors it
+    sends, by status.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], settings: StubSettings):
+        super().__init__(address, StubLLMHandler)
+        self.settings = settings
+        self.stats = {"requests": 0, "streamed": 0, "errors": {}}
+        self._stats_lock = threading.Lock()
+        self._counter = itertools.count()
+
+    @property
+    def url(self):
+        """
+        The URL to set as API_URL
+        """
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def count(self, key: str, status: int | None = None):
+        """
+        Increments a counter of stats
+        """
+        with self._stats_lock:
+            if status is None:
+                self.stats[key] += 1
+            else:
+                self.stats[key][status] = self.stats[key].get(status, 0) + 1
+
+    def make_questions(self, prompt: str):
+        """
+        Returns the list of questions the prompt asks for
+        """
+        settings = self.settings
+        num, question_type = 1, "Short Answer"
+        if match := PROMPT_REGEX.search(prompt):
+            num, question_type = int(match[1]), match[2]
+
+        if settings.num_questions is not None:
+            num = settings.num_questions
+
+        words = " ".join(["word"] * settings.answer_words)
+        ret = []
+        for _ in range(num):
+            # unique questions, so that nothing downstream dedupes them
+            question = {
+                "question_type": question_type,
+                "question": f"Stub question {next(self._counter)}?",
+            }
+            if question_type == "MCQ":
+                question["options"] = [f"{i}: {words}" for i in "ABCD"]
+                question["correct_answer"] = settings.rng.randrange(4)
+            else:
+                question["sample_answer"] = words
+
+            ret.append(question)
+
+        return ret
+
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    """
+    Handles the requests of StubLLMServer
+    """
+
+    server: StubLLMServer
+
+    def _send_json(self, status: int, obj):
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, text: str, latency: float):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        num_chunks = self.server.settings.stream_chunks
+        size = math.ceil(len(text) / num_chunks) or 1
+        for start in range(0, len(text), size):
+            time.sleep(latency / num_chunks)
+            token = {"text": text[start : start + size], "special": False}
+            self.wfile.write(f"data:{json.dumps({'token': token})}\n\n".encode())
+            self.wfile.flush()
+
+        event = {"token": {"text": "</s>", "special": True}, "generated_text": text}
+        self.wfile.write(f"data:{json.dumps(event)}\n\n".encode())
+
+    def do_POST(self):
+        """
+        Handles a generation request
+        """
+        server = self.server
+        settings = server.settings
+        server.count("requests")
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            prompt = payload["inputs"]
+        except (KeyError, TypeError, ValueError):
+            server.count("errors", 400)
+            self._send_json(400, {"error": "Invalid payload"})
+            return
+
+        latency = settings.latency()
+        if settings.rng.random() < settings.error_rate:
+            status = settings.rng.choice(settings.error_statuses)
+            time.sleep(latency)
+            server.count("errors", status)
+            self._send_json(status, {"error": "Stub error"})
+            return
+
+        text = json.dumps(server.make_questions(prompt))
+        if settings.rng.random() < settings.bad_output_rate:
+            text = text[: len(text) // 2]
+
+        if payload.get("stream"):
+            server.count("streamed")
+            self._send_stream(text, latency)
+        else:
+            time.sleep(latency)
+            self._send_json(200, [{"generated_text": text}])
+
+    def log_message(self, *_):
+        pass
+
+
+def start_stub(settings: StubSettings, host: str = "127.0.0.1", port: int = 0):
+    """
+    Starts a stub inference server in a background thread, and returns it.
+    Call shutdown() on it to stop it.
+    """
+    server = StubLLMServer((host, port), settings)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """
+    Adds the arguments that configure the stub to parser
+    """
+    parser.add_argument("--latency", default="fixed:1")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--error-statuses", type=int, nargs="+", default=[503], metavar="STATUS"
+    )
+    parser.add_argument("--bad-output-rate", type=float, default=0.0)
+    parser.add_argument("--num-questions", type=int, default=None)
+    parser.add_argument("--answer-words", type=int, default=5)
+    parser.add_argument("--stream-chunks", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def settings_from_args(args: argparse.Namespace):
+    """
+    Returns the StubSettings for the arguments added by add_arguments
+    """
+    return StubSettings(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        error_statuses=tuple(args.error_statuses),
+        bad_output_rate=args.bad_output_rate,
+        num_questions=args.num_questions,
+        answer_words=args.answer_words,
+        stream_chunks=args.stream_chunks,
+        seed=args.seed,
+    )
+
+
+def main():
+    """
+    Entry point of the stub server
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = StubLLMServer((args.host, args.port), settings_from_args(args))
+    print(f"Stub inference server listening, set API_URL={server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(server.stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+Implements single-flight coalescing of identical LLM calls.
+
+When several requests need the same LLM response at once (like a class of
+students generating the same assessment), only one of them (the leader) calls
+the LLM, and the others (the followers) wait for its result:
+- within a process, followers wait on the leader's future
+- across gunicorn workers, the leader holds a lease document in MongoDB,
+  that followers poll until it has the result. A lease that is not finished
+  within LLM_COALESCE_LEASE seconds (like when the leader's worker died) is
+  taken over by a follower.
+
+Only calls that are in flight are shared. A finished result is never reused
+by a later call, that is what the LLM cache is for.
+"""
+
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable
+
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.collection import Collection
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+import configs
+from configs import LLM_COALESCE_LEASE, LLM_COALESCE_POLL_MS
+from exceptions import OutputFormatError
+from metrics import stage
+
+logger = logging.getLogger(__name__)
+
+# lease status values
+LEASE_RUNNING = "running"
+LEASE_DONE = "done"
+LEASE_FAILED = "failed"
+
+# how long a finished lease is kept, so that slow followers still see it
+LEASE_RESULT_TTL = 60
+
+_flights: dict[str, Future] = {}
+_flights_lock = threading.Lock()
+
+
+def is_enabled():
+    """
+    Returns whether LLM calls are coalesced across processes
+    """
+    return (
+        LLM_COALESCE_LEASE > 0
+        and configs.pymongo is not None
+        and configs.pymongo.db is not None
+    )
+
+
+def ensure_coalesce_indexes():
+    """
+    Creates the index that removes finished and abandoned leases
+    """
+    if not is_enabled():
+        return
+
+    configs.pymongo.db.llm_inflight.create_index(
+        [("expire_at", ASCENDING)], expireAfterSeconds=0, name="ttl"
+    )
+
+
+def _as_utc(value: datetime):
+    """
+    Internal helper function that returns value (a datetime from the db, which
+    is naive unless the client is timezone aware) as an aware UTC datetime
+    """
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def _acquire(collection: Collection, key: str, owner: str):
+    """
+    Internal helper function that takes the lease of key for owner, unless
+    another caller holds a lease that has not expired. Returns the lease
+    document, which has owner set to the leader.
+    """
+    now = datetime.now(timezone.utc)
+    lease_until = now + timedelta(seconds=LLM_COALESCE_LEASE)
+    try:
+        return collection.find_one_and_update(
+            {
+                "_id": key,
+                "$or": [
+                    {"status": {"$ne": LEASE_RUNNING}},
+                    {"lease_until": {"$lt": now}},
+                ],
+            },
+            {
+                "$set": {
+                    "status": LEASE_RUNNING,
+                    "owner": owner,
+                    "lease_until": lease_until,
+                    "expire_at": lease_until,
+                    "response": None,
+                    "error": None,
+                }
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # the filter did not match, so there is a running lease to follow
+        return collection.find_one({"_id": key})
+
+
+def _lead(collection: Collection, key: str, owner: str, call: Callable[[], str]):
+    """
+    Internal helper function that makes the call as the leader, and stores
+    its result (or error) in the lease for the followers
+    """
+    fields: dict[str, Any] = {}
+    try:
+        ret = call()
+        fields.update(status=LEASE_DONE, response=ret)
+        return ret
+    except OutputFormatError as err:
+        fields.update(status=LEASE_FAILED, error=err.args[0] if err.args else None)
+        raise
+    except BaseException:
+        fields.update(status=LEASE_FAILED, error="Could not get LLM response")
+        raise
+    finally:
+        fields["expire_at"] = datetime.now(timezone.utc) + timedelta(
+            seconds=LEASE_RESULT_TTL
+        )
+        try:
+            collection.update_one({"_id": key, "owner": owner}, {"$set": fields})
+        except PyMongoError as err:
+            logger.warning("Could not store coalesced LLM response: %s", err)
+
+
+def _follow(collection: Collection, lease: dict[str, Any]):
+    """
+    Internal helper function that waits for the leader of lease to finish,
+    and returns its response (or raises its error). Returns None if the lease
+    expired or was taken over, so that the caller tries to lead instead.
+    """
+    while True:
+        if lease["status"] == LEASE_DONE:
+            return lease["response"]
+
+        if lease["status"] == LEASE_FAILED:
+            raise OutputFormatError(lease["error"] or "Could not get LLM response")
+
+        if _as_utc(lease["lease_until"]) < datetime.now(timezone.utc):
+            return None
+
+        time.sleep(LLM_COALESCE_POLL_MS / 1000)
+        owner = lease["owner"]
+        lease = collection.find_one({"_id": lease["_id"]})
+        if lease is None or lease["owner"] != owner:
+            return None
+
+
+def _coalesce_processes(key: str, call: Callable[[], str]):
+    """
+    Internal helper function that makes the call, or waits for an identical
+    call in flight in another process (see the module docstring)
+    """
+    if not is_enabled():
+        return call()
+
+    collection = configs.pymongo.db.llm_inflight
+    owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+    while True:
+        try:
+            lease = _acquire(collection, key, owner)
+            if lease is None:
+                continue
+
+            if lease["owner"] != owner:
+                with stage("llm_coalesced"):
+                    ret = _follow(collection, lease)
+                if ret is None:
+                    continue
+                return ret
+        except PyMongoError as err:
+            logger.warning("LLM call coalescing failed, calling directly: %s", err)
+            return call()
+
+        return _lead(collection, key, owner, call)
+
+
+def coalesce(key: str, call: Callable[[], str]):
+    """
+    Returns call(), but concurrent calls with the same key (in this process
+    or in other processes sharing the db) share the result of a single call.
+    An OutputFormatError raised by the shared call is raised in all callers.
+    """
+    with _flights_lock:
+        future = _flights.get(key)
+        leader = future is None
+        if leader:
+            future = _flights[key] = Future()
+
+    if not leader:
+        with stage("llm_coalesced"):
+            return future.result()
+
+    try:
+        ret = _coalesce_processes(key, call)
+        future.set_result(ret)
+        return ret
+    except BaseException as err:
+        future.set_exception(err)
+        raise
+    finally:
+        with _flights_lock:
+            del _flights[key]
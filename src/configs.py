@@ -18,13 +18,65 @@ UPLOADS_BASE = CODE_BASE / "uploads"
 ALLOWED_EXTENSIONS = {".pdf"}
 ALLOWED_MIMETYPES = {"application/pdf"}
 
+EXTRACTION_CACHE_DIR = Path(
+    os.environ.get("EXTRACTION_CACHE_DIR", CODE_BASE / "cache" / "extraction")
+)
+EXTRACTION_CACHE_MAX_BYTES = int(os.environ.get("EXTRACTION_CACHE_MAX_MB", "256")) << 20
+PDF_CONTEXT_TOKEN_BUDGET = int(os.environ.get("PDF_CONTEXT_TOKEN_BUDGET", "3000"))
+PDF_CONTEXT_TOP_K = int(os.environ.get("PDF_CONTEXT_TOP_K", "12"))
+PDF_CHUNK_WORDS = int(os.environ.get("PDF_CHUNK_WORDS", "150"))
+PDF_CHUNK_OVERLAP = int(os.environ.get("PDF_CHUNK_OVERLAP", "30"))
+EXTRACTION_PROCESSES = int(os.environ.get("EXTRACTION_PROCESSES", "2"))
+EXTRACTION_TIMEOUT = int(os.environ.get("EXTRACTION_TIMEOUT", "60"))
+EXTRACTION_WORKERS = int(os.environ.get("EXTRACTION_WORKERS", "2"))
+EXTRACTION_QUEUE_SIZE = int(os.environ.get("EXTRACTION_QUEUE_SIZE", "16"))
+EXTRACTION_WAIT_TIMEOUT = int(os.environ.get("EXTRACTION_WAIT_TIMEOUT", "120"))
+
 LLM_TIMEOUT = int(os.environ.get("LLM_TIMEOUT", "300"))
+LLM_CONNECT_TIMEOUT = float(os.environ.get("LLM_CONNECT_TIMEOUT", "10"))
+LLM_POOL_SIZE = int(os.environ.get("LLM_POOL_SIZE", "4"))
+LLM_RETRIES = int(os.environ.get("LLM_RETRIES", "3"))
+LLM_BACKOFF_FACTOR = float(os.environ.get("LLM_BACKOFF_FACTOR", "2"))
+LLM_BACKOFF_JITTER = float(os.environ.get("LLM_BACKOFF_JITTER", "1"))
+GENERATION_BATCH_SIZE = int(os.environ.get("GENERATION_BATCH_SIZE", "10"))
+GENERATION_PARALLELISM = int(os.environ.get("GENERATION_PARALLELISM", "4"))
+GENERATION_BATCH_RETRIES = int(os.environ.get("GENERATION_BATCH_RETRIES", "1"))
+GENERATION_TOPUP_RETRIES = int(os.environ.get("GENERATION_TOPUP_RETRIES", "1"))
+
+LLM_CACHE_TTL = int(os.environ.get("LLM_CACHE_TTL", "0"))
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "10000"))
+LLM_COALESCE_LEASE = int(
+    os.environ.get("LLM_COALESCE_LEASE", str(2 * LLM_TIMEOUT + 60))
+)
+LLM_COALESCE_POLL_MS = int(os.environ.get("LLM_COALESCE_POLL_MS", "250"))
+LLM_RATE_LIMIT = int(os.environ.get("LLM_RATE_LIMIT", "0"))
+LLM_TOKEN_LIMIT = int(os.environ.get("LLM_TOKEN_LIMIT", "0"))
+LLM_RATE_BURST = float(os.environ.get("LLM_RATE_BURST", "10"))
+LLM_BATCH_RESERVE = float(os.environ.get("LLM_BATCH_RESERVE", "0.5"))
+LLM_OUTPUT_TOKENS_ESTIMATE = int(os.environ.get("LLM_OUTPUT_TOKENS_ESTIMATE", "1000"))
+LLM_QUEUE_SIZE = int(os.environ.get("LLM_QUEUE_SIZE", "64"))
+LLM_QUEUE_TIMEOUT = int(os.environ.get("LLM_QUEUE_TIMEOUT", "120"))
+QUESTION_BANK = int(os.environ.get("QUESTION_BANK", "0"))
+DEDUP_THRESHOLD = float(os.environ.get("DEDUP_THRESHOLD", "0"))
 API_TOKEN = os.environ["API_TOKEN"]
-API_URL = (
-    "https://api-inference.huggingface.co/models/mistralai/Mixtral-8x7B-Instruct-v0.1"
+API_URL = os.environ.get(
+    "API_URL",
+    "https://api-inference.huggingface.co/models/mistralai/Mixtral-8x7B-Instruct-v0.1",
 )
 
 MONGO_URI = os.environ["MONGO_URI"]
 
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+JOB_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE", "16"))
+JOB_MAX_WAIT = int(os.environ.get("JOB_MAX_WAIT", "0"))
+JOB_STALE_TIMEOUT = int(os.environ.get("JOB_STALE_TIMEOUT", str(2 * LLM_TIMEOUT + 60)))
+JOB_TTL = int(os.environ.get("JOB_TTL", "86400"))
+
+BULK_MAX_BATCH = int(os.environ.get("BULK_MAX_BATCH", "100"))
+SLOW_QUERY_MS = int(os.environ.get("SLOW_QUERY_MS", "100"))
+HISTORY_PAGE_SIZE = int(os.environ.get("HISTORY_PAGE_SIZE", "20"))
+HISTORY_MAX_PAGE_SIZE = int(os.environ.get("HISTORY_MAX_PAGE_SIZE", "100"))
+STREAM_BATCH_SIZE = int(os.environ.get("STREAM_BATCH_SIZE", "100"))
+
 # app.py sets this parameter so that they can be used across the codebase
 pymongo: PyMongo | None = None
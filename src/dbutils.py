@@ -0,0 +1,89 @@
+"""
+Implements helpers for the MongoDB collections of the app: idempotent index
+creation, and timing of queries that logs slow queries with their plans
+"""
+
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Callable
+
+from pymongo import IndexModel
+from pymongo.collection import Collection
+from pymongo.errors import PyMongoError
+
+from configs import SLOW_QUERY_MS
+from metrics import observe_query
+
+logger = logging.getLogger(__name__)
+
+
+def ensure_indexes(collection: Collection, indexes: list[IndexModel]):
+    """
+    Creates the given indexes on collection. Indexes that already exist (with
+    the same name and keys) are left as they are, so this is safe to call on
+    every startup.
+    """
+    collection.create_indexes(indexes)
+
+
+def _plan_summary(plan: dict[str, Any]) -> str:
+    """
+    Internal helper function that formats a query plan tree in one line, for
+    example 'LIMIT <- FETCH <- IXSCAN(history)'
+    """
+    ret = plan.get("stage", "?")
+    if "indexName" in plan:
+        ret += f"({plan['indexName']})"
+
+    children = plan.get("inputStages") or (
+        [plan["inputStage"]] if "inputStage" in plan else []
+    )
+    if children:
+        ret += " <- " + ", ".join(_plan_summary(i) for i in children)
+
+    return ret
+
+
+def explain_summary(explained: dict[str, Any]):
+    """
+    Returns a one line summary of the output of explain(), with the winning
+    plan and the number of documents examined
+    """
+    plan = explained.get("queryPlanner", {}).get("winningPlan", {})
+
+    # newer servers nest the plan one level deeper
+    ret = _plan_summary(plan.get("queryPlan", plan))
+    if stats := explained.get("executionStats"):
+        ret += (
+            f", examined {stats.get('totalDocsExamined')} documents for "
+            f"{stats.get('nReturned')} results"
+        )
+
+    return ret
+
+
+@contextmanager
+def timed_query(name: str, explain: Callable[[], dict[str, Any]] | None = None):
+    """
+    Times the query made in the with block, and records it in the query
+    metrics. A query that takes at least SLOW_QUERY_MS milliseconds is
+    logged, along with its plan if explain is passed (a function that returns
+    the explain() output of the same query, so that a full collection scan
+    shows up in the logs).
+    """
+    start = time.perf_counter()
+    yield
+    elapsed = (time.perf_counter() - start) * 1000
+    observe_query(name, elapsed / 1000)
+    if SLOW_QUERY_MS < 0 or elapsed < SLOW_QUERY_MS:
+        return
+
+    plan = "not available"
+    if explain is not None:
+        try:
+            plan = explain_summary(explain())
+        except PyMongoError as err:
+            plan = f"explain failed ({err})"
+
+    logger.warning("Slow query %s took %.1f ms, plan: %s", name, elapsed, plan)
@@ -0,0 +1,212 @@
+"""
+Implements near-duplicate detection of questions, with MinHash signatures
+and locality sensitive hashing (LSH).
+
+Questions are compared by their whole text (see question_text): the question,
+its options and correct answer, or its sample answer. The text is normalized
+and split into overlapping character shingles (SHINGLE_SIZE characters long).
+Its MinHash signature is the minimum of NUM_PERM hash functions over its
+shingles, so two signatures agree in about the fraction of positions that is
+the Jaccard similarity of the two shingle sets. The signature is split into
+BANDS bands, and the hash of every band is a band key: questions that share a
+band key are candidates, which are then compared by their signatures. This
+finds the near-duplicates of a question by looking up its BANDS keys, instead
+of comparing it with every other question.
+
+Character shingles cannot tell 'x^2' from 'x^3', or 1914 from 1939, so
+questions are only near-duplicates if their numbers and symbols (see
+exact_tokens) are also the same. Detection is off unless DEDUP_THRESHOLD is
+set, since even then short questions that differ in one word can be similar.
+
+Signatures of many texts are computed together with NumPy, in chunks of
+SIGNATURE_CHUNK texts. The hash functions are seeded with a constant, since
+band keys and signatures are stored in the db (see question_bank.py) and must
+be the same in every process.
+"""
+
+import re
+from typing import Any
+
+import numpy as np
+
+from configs import DEDUP_THRESHOLD
+
+SHINGLE_SIZE = 5
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+
+# the number of texts hashed at once, small enough for the hashes of a chunk
+# to stay in the CPU cache
+SIGNATURE_CHUNK = 100
+
+# the tokens of a text: numbers (with their decimal points), words and single
+# symbols
+_TOKEN_REGEX = re.compile(r"\d+(?:[.,]\d+)*|\w+|[^\w\s]")
+# punctuation that does not change what a question asks
+_PUNCTUATION = set(".,;:!?'\"`")
+
+# tokens with a digit or a symbol, which must be the same in near-duplicates
+_EXACT_TOKEN_REGEX = re.compile(r"\d|[^\w\s]")
+
+_rng = np.random.default_rng(20240601)
+# multiply-shift hash functions, the multipliers must be odd
+_MULTIPLIERS = _rng.integers(1, 2**64, NUM_PERM, dtype=np.uint64) | 1
+_OFFSETS = _rng.integers(0, 2**64, NUM_PERM, dtype=np.uint64)
+_BAND_MULTIPLIERS = _rng.integers(1, 2**64, (BANDS, ROWS), dtype=np.uint64) | 1
+_BAND_OFFSETS = _rng.integers(0, 2**64, BANDS, dtype=np.uint64)
+
+
+def normalize_text(text: str):
+    """
+    Normalizes text, so that texts that only differ in case, whitespace or
+    punctuation are the same. Other symbols (like the operators of a formula)
+    are kept, so 'What is 2+2?' and 'What is 2*2?' differ.
+    """
+    return " ".join(
+        i for i in _TOKEN_REGEX.findall(text.lower()) if i not in _PUNCTUATION
+    )
+
+
+def question_key(question: dict[str, Any]):
+    """
+    Returns a key that is the same for questions (question dicts) that only
+    differ in the case, whitespace or punctuation of their text and options,
+    or in the order of their options
+    """
+    parts = [question["question_type"], normalize_text(question["question"])]
+    parts.extend(sorted(normalize_text(i) for i in question.get("options", [])))
+    return "\n".join(parts)
+
+
+def is_enabled():
+    """
+    Returns whether near-duplicates are detected (otherwise, only exact
+    duplicates are)
+    """
+    return DEDUP_THRESHOLD > 0
+
+
+def question_text(question: dict[str, Any]):
+    """
+    Returns the text that question (a question dict) is compared by: the
+    question, and its options and correct answer, or its sample answer
+    """
+    parts = [question["question"], *question.get("options", [])]
+    if "options" in question:
+        try:
+            parts.append(question["options"][question["correct_answer"]])
+        except (IndexError, KeyError, TypeError):
+            pass
+
+    if "sample_answer" in question:
+        parts.append(question["sample_answer"])
+
+    return "\n".join(parts)
+
+
+def exact_tokens(text: str):
+    """
+    Returns the tokens of text with a digit or a symbol (sorted, as a
+    string), which near-duplicates must have in common
+    """
+    return " ".join(
+        sorted(i for i in normalize_text(text).split() if _EXACT_TOKEN_REGEX.search(i))
+    )
+
+
+def _shingle_hashes(texts: list[str]):
+    """
+    Internal helper function that returns the hashes of the shingles of all
+    texts (concatenated), and the index of the first shingle of every text.
+    Every text has at least one shingle, since short texts are padded.
+    """
+    encoded = [normalize_text(text).encode().ljust(SHINGLE_SIZE) for text in texts]
+    counts = np.array([len(i) - SHINGLE_SIZE + 1 for i in encoded])
+    text_starts = np.concatenate(([0], np.cumsum([len(i) for i in encoded])[:-1]))
+
+    data = np.frombuffer(b"".join(encoded), dtype=np.uint8).astype(np.uint64)
+    # the shingle starting at every position, as a number (shingles that cross
+    # two texts are computed too, but not used)
+    num_positions = len(data) - SHINGLE_SIZE + 1
+    shingles = np.zeros(num_positions, dtype=np.uint64)
+    for i in range(SHINGLE_SIZE):
+        shingles = (shingles << np.uint64(8)) | data[i : i + num_positions]
+
+    first = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    positions = np.repeat(text_starts - first, counts) + np.arange(counts.sum())
+    return shingles[positions], first
+
+
+def signatures(texts: list[str]):
+    """
+    Returns the MinHash signatures of texts, as an array of shape
+    (len(texts), NUM_PERM)
+    """
+    ret = np.empty((len(texts), NUM_PERM), dtype=np.uint32)
+    for start in range(0, len(texts), SIGNATURE_CHUNK):
+        chunk = texts[start : start + SIGNATURE_CHUNK]
+        shingles, first = _shingle_hashes(chunk)
+        # a multiply-shift hash of every shingle, with every hash function (a
+        # row per function, so the minimum of every text is over contiguous
+        # memory). The shift to the top 32 bits is monotonic, so it is only
+        # done on the minimums.
+        hashes = np.multiply(_MULTIPLIERS[:, None], shingles[None, :])
+        hashes += _OFFSETS[:, None]
+        minimums = np.minimum.reduceat(hashes, first, axis=1) >> np.uint64(32)
+        ret[start : start + len(chunk)] = minimums.T
+
+    return ret
+
+
+def band_keys(sigs: np.ndarray):
+    """
+    Returns the LSH band keys of signatures sigs, as an array of shape
+    (len(sigs), BANDS) of 64 bit ints (which MongoDB can store). Keys of
+    different bands differ, so the keys of all bands can be looked up
+    together.
+    """
+    bands = sigs.astype(np.uint64).reshape(len(sigs), BANDS, ROWS)
+    keys = (bands * _BAND_MULTIPLIERS).sum(axis=2, dtype=np.uint64) + _BAND_OFFSETS
+    return keys.view(np.int64)
+
+
+def similarity(sig1: np.ndarray, sig2: np.ndarray):
+    """
+    Returns the estimated Jaccard similarity of the texts with signatures
+    sig1 and sig2
+    """
+    return float(np.mean(sig1 == sig2))
+
+
+def find_duplicates(texts: list[str], threshold: float | None = None):
+    """
+    Returns, for every text of texts, the index of an earlier text it is a
+    near-duplicate of (with the same exact_tokens, and an estimated
+    similarity of at least threshold, DEDUP_THRESHOLD by default), or None if
+    it is not a near-duplicate
+    """
+    if threshold is None:
+        threshold = DEDUP_THRESHOLD
+
+    sigs = signatures(texts)
+    exact = [exact_tokens(i) for i in texts]
+    buckets: dict[int, list[int]] = {}
+    ret: list[int | None] = []
+    for i, keys in enumerate(band_keys(sigs).tolist()):
+        match = None
+        candidates = sorted(
+            {j for key in keys for j in buckets.get(key, []) if exact[j] == exact[i]}
+        )
+        if candidates:
+            similarities = (sigs[candidates] == sigs[i]).mean(axis=1)
+            if (matches := np.flatnonzero(similarities >= threshold)).size:
+                match = candidates[matches[0]]
+
+        ret.append(match)
+        if match is None:
+            # duplicates are not indexed, so a match is always a first copy
+            for key in keys:
+                buckets.setdefault(key, []).append(i)
+
+    return ret
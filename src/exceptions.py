@@ -28,3 +28,23 @@ class DBError(Exception):
 
     code = 500
     description = "Could not connect to database"
+
+
+class ServiceBusyError(Exception):
+    """
+    Python exception raised when the server has too much queued work to accept
+    a request.
+    """
+
+    code = 503
+    description = "Server busy"
+
+
+class ConflictError(Exception):
+    """
+    Python exception raised when a document was changed by someone else since
+    the client loaded it.
+    """
+
+    code = 409
+    description = "Conflicting change"
@@ -0,0 +1,397 @@
+"""
+Implements text extraction from uploaded PDF files, along with a persistent
+content-addressed cache of the extracted text.
+
+Extraction of uploads is started in the background as soon as the file is
+uploaded, so that it overlaps with the user filling in the rest of the form.
+"""
+
+import hashlib
+import importlib.metadata
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import (
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    TimeoutError as FuturesTimeoutError,
+    wait,
+)
+from datetime import datetime, timezone
+from pathlib import Path
+
+import configs
+from configs import (
+    EXTRACTION_CACHE_DIR,
+    EXTRACTION_CACHE_MAX_BYTES,
+    EXTRACTION_PROCESSES,
+    EXTRACTION_QUEUE_SIZE,
+    EXTRACTION_TIMEOUT,
+    EXTRACTION_WAIT_TIMEOUT,
+    EXTRACTION_WORKERS,
+    UPLOADS_BASE,
+)
+
+logger = logging.getLogger(__name__)
+
+# Everything that can change the output of the extractor must be listed here,
+# because this is a part of the cache key. The version is read from the package
+# metadata, because textract itself is only imported by extractor processes.
+EXTRACTOR_SETTINGS = {
+    "extractor": "textract",
+    "version": importlib.metadata.version("textract"),
+}
+
+# extraction status values recorded for every upload
+STATUS_PENDING = "pending"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+
+def file_digest(path: Path):
+    """
+    Returns the SHA-256 hex digest of the contents of the file at path
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(1 << 20):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def cache_key(path: Path):
+    """
+    Returns the cache key of a file, which depends on the file contents and
+    the extractor settings (but not on the file name)
+    """
+    settings = json.dumps(EXTRACTOR_SETTINGS, sort_keys=True)
+    return hashlib.sha256(f"{file_digest(path)}:{settings}".encode()).hexdigest()
+
+
+class ExtractionCache:
+    """
+    A size-bounded on-disk LRU cache of extracted text.
+
+    Every entry is stored as a single file, so the cache is shared by all
+    processes using the same directory. The modification time of an entry is
+    bumped on every hit, and the least recently used entries are evicted when
+    the total size exceeds max_bytes.
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _entry_path(self, key: str):
+        return self.cache_dir / f"{key}.txt"
+
+    def get(self, key: str):
+        """
+        Returns the cached text for key, or None if it is not cached
+        """
+        path = self._entry_path(key)
+        try:
+            text = path.read_text(encoding="utf-8")
+            os.utime(path, ns=(time.time_ns(), time.time_ns()))
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return text
+
+    def put(self, key: str, text: str):
+        """
+        Stores text under key, and evicts old entries if needed
+        """
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self._entry_path(key)
+
+        # write to a temporary file first and then rename it, so that other
+        # processes never read a partially written entry
+        temp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        temp_path.write_text(text, encoding="utf-8")
+        os.utime(temp_path, ns=(time.time_ns(), time.time_ns()))
+        os.replace(temp_path, path)
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for path in self.cache_dir.glob("*.txt"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def stats(self):
+        """
+        Returns a dict of cache statistics. The hits and misses are counted
+        per process.
+        """
+        entries = list(self.cache_dir.glob("*.txt"))
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(entries),
+            "bytes": sum(i.stat().st_size for i in entries if i.exists()),
+        }
+
+
+extraction_cache = ExtractionCache(EXTRACTION_CACHE_DIR, EXTRACTION_CACHE_MAX_BYTES)
+
+
+_process_pool: ProcessPoolExecutor | None = None
+_process_pool_pid: int | None = None
+_process_pool_lock = threading.Lock()
+# the extractions in flight in the process pool, by cache key
+_extracting: dict[str, Future] = {}
+_extracting_lock = threading.Lock()
+
+
+def _get_process_pool():
+    """
+    Returns the pool of extractor processes of the current process. Processes
+    are spawned (not forked), because forking a multithreaded gunicorn worker
+    is not safe. This is called with _extracting_lock held.
+    """
+    global _process_pool, _process_pool_pid
+
+    with _process_pool_lock:
+        if _process_pool is None or _process_pool_pid != os.getpid():
+            _process_pool = ProcessPoolExecutor(
+                max_workers=EXTRACTION_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            _process_pool_pid = os.getpid()
+            _extracting.clear()
+
+        return _process_pool
+
+
+def _textract_process(path: str):
+    """
+    Extracts the text of the file at path. This runs in an extractor process.
+    """
+    import textract
+
+    return textract.process(path).decode()
+
+
+def _run_extractor(path: Path, key: str):
+    """
+    Extracts the text of the file at path in the process pool, and caches it
+    under key. If the same contents are already being extracted (like after
+    an earlier call timed out), this waits for that extraction instead of
+    starting another one. If this times out, the text is still cached once
+    the extraction finishes.
+    """
+
+    def finished(future: Future):
+        # the text is cached before the extraction is removed, so that it is
+        # never missing from both
+        if not future.cancelled() and future.exception() is None:
+            extraction_cache.put(key, future.result())
+
+        with _extracting_lock:
+            if _extracting.get(key) is future:
+                del _extracting[key]
+
+    with _extracting_lock:
+        pool = _get_process_pool()
+        future = _extracting.get(key)
+        submitted = future is None
+        if submitted:
+            future = _extracting[key] = pool.submit(_textract_process, str(path))
+
+    if submitted:
+        future.add_done_callback(finished)
+
+    try:
+        return future.result(timeout=EXTRACTION_TIMEOUT)
+    except FuturesTimeoutError:
+        raise TimeoutError(f"Text extraction of '{path.name}' timed out") from None
+
+
+def extract_text(path: Path):
+    """
+    Returns the text in the file at path. The text is extracted only if the
+    same file contents were not extracted before.
+
+    Extraction runs in a separate process, and raises TimeoutError if it takes
+    longer than EXTRACTION_TIMEOUT seconds.
+    """
+    key = cache_key(path)
+    text = extraction_cache.get(key)
+    if text is None:
+        text = _run_extractor(path, key)
+
+    return text
+
+
+_executor: ThreadPoolExecutor | None = None
+_executor_pid: int | None = None
+_queue_slots = threading.BoundedSemaphore(EXTRACTION_QUEUE_SIZE)
+_running: dict[str, Future] = {}
+_running_lock = threading.Lock()
+
+
+def _get_executor():
+    """
+    Returns the background extraction pool of the current process. The pool
+    is created lazily so that every gunicorn worker gets its own threads.
+    """
+    global _executor, _executor_pid
+
+    with _running_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(
+                max_workers=EXTRACTION_WORKERS, thread_name_prefix="extraction"
+            )
+            _executor_pid = os.getpid()
+            _running.clear()
+
+        return _executor
+
+
+def _uploads_collection():
+    """
+    Returns the collection where extraction status of uploads is recorded.
+    If there is no database (for example in scripts), status is not tracked
+    and None is returned.
+    """
+    if configs.pymongo is None or configs.pymongo.db is None:
+        return None
+
+    return configs.pymongo.db.uploads
+
+
+def _set_status(name: str, status: str, error: str | None = None):
+    collection = _uploads_collection()
+    if collection is not None:
+        collection.update_one(
+            {"_id": name},
+            {
+                "$set": {
+                    "status": status,
+                    "error": error,
+                    "updated": datetime.now(timezone.utc),
+                }
+            },
+            upsert=True,
+        )
+
+
+def get_upload_status(name: str):
+    """
+    Returns the extraction status of an upload, one of 'pending', 'done' or
+    'failed'. None is returned if no status was recorded.
+    """
+    collection = _uploads_collection()
+    if collection is None:
+        return None
+
+    doc = collection.find_one({"_id": name}, {"status": 1})
+    return None if doc is None else doc["status"]
+
+
+def _extract_upload(name: str):
+    try:
+        extract_text(UPLOADS_BASE / name)
+    except Exception as err:
+        _set_status(name, STATUS_FAILED, str(err))
+    else:
+        _set_status(name, STATUS_DONE)
+    finally:
+        with _running_lock:
+            _running.pop(name, None)
+        _queue_slots.release()
+
+
+def queue_extraction(name: str):
+    """
+    Queues extraction of an uploaded file on the background pool, so that
+    the text is ready by the time the assessment is generated. If the queue
+    is full, nothing is queued and the text will be extracted on first use.
+    """
+    if not _queue_slots.acquire(blocking=False):
+        return False
+
+    executor = _get_executor()
+    try:
+        _set_status(name, STATUS_PENDING)
+
+        # the task removes itself from _running when done, so it must only
+        # be able to do that after it is added
+        with _running_lock:
+            _running[name] = executor.submit(_extract_upload, name)
+    except Exception:
+        _queue_slots.release()
+        raise
+
+    return True
+
+
+def get_upload_text(name: str):
+    """
+    Returns the text of an uploaded file. If its extraction was queued and is
+    still running, this waits for it to finish (for at most
+    EXTRACTION_WAIT_TIMEOUT seconds). Otherwise, the text is read from the
+    extraction cache, or extracted right away.
+    """
+    with _running_lock:
+        future = _running.get(name)
+
+    if future is not None:
+        # the extraction is running in this process, so just wait for it
+        wait([future], timeout=EXTRACTION_WAIT_TIMEOUT)
+    else:
+        # the extraction may be running in some other worker process
+        deadline = time.monotonic() + EXTRACTION_WAIT_TIMEOUT
+        while get_upload_status(name) == STATUS_PENDING and time.monotonic() < deadline:
+            time.sleep(0.25)
+
+    # if the background extraction has failed, this retries it so that the
+    # user sees the actual error
+    return extract_text(UPLOADS_BASE / name)
+
+
+def get_upload_texts(names: list[str]):
+    """
+    Returns the texts of the given uploaded files, like get_upload_text, but
+    with all files extracted concurrently. If a file could not be extracted,
+    its text is None, so that one bad file does not fail the others.
+    """
+    if not names:
+        return []
+
+    with ThreadPoolExecutor(max_workers=len(names)) as executor:
+        futures = [executor.submit(get_upload_text, i) for i in names]
+
+    ret: list[str | None] = []
+    for name, future in zip(names, futures):
+        try:
+            ret.append(future.result())
+        except Exception as err:
+            logger.warning("Could not extract text of '%s': %s", name, err)
+            ret.append(None)
+
+    return ret
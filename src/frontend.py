@@ -0,0 +1,161 @@
+"""
+Implements rebuilding of the React frontend when it is outdated.
+
+Whether the build is outdated is decided from a manifest of the build inputs
+(the source files, not node_modules), which is saved along with the build.
+Under gunicorn, this check runs once in the master process (see
+gunicorn.conf.py), instead of once in every worker.
+"""
+
+import hashlib
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+from configs import FRONTEND_BASE, FRONTEND_BUILD
+
+# The files and folders (relative to FRONTEND_BASE) that the build depends on
+FRONTEND_INPUTS = ["src", "public", "package.json", "package-lock.json"]
+
+MANIFEST_PATH = FRONTEND_BUILD / ".inputs-manifest.json"
+
+# When this environment variable is set, the frontend was already checked by
+# the parent process, so app.py does not check it again
+CHECKED_ENV_VAR = "FRONTEND_CHECKED"
+
+
+def _hash_file(path: Path):
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def _iter_input_files():
+    for name in FRONTEND_INPUTS:
+        path = FRONTEND_BASE / name
+        if path.is_dir():
+            yield from (i for i in path.rglob("*") if i.is_file())
+        elif path.is_file():
+            yield path
+
+
+def make_manifest():
+    """
+    Returns the manifest of the current build inputs, that maps the path of
+    every input file to its modification time, size and SHA-256 hash
+    """
+    ret = {}
+    for path in _iter_input_files():
+        stat = path.stat()
+        ret[path.relative_to(FRONTEND_BASE).as_posix()] = [
+            stat.st_mtime_ns,
+            stat.st_size,
+            _hash_file(path),
+        ]
+
+    return ret
+
+
+def load_manifest():
+    """
+    Returns the manifest saved with the build, or None if there is none
+    """
+    try:
+        return json.loads(MANIFEST_PATH.read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def changed_inputs(manifest: dict[str, list]):
+    """
+    Returns the list of input files that were added, removed or changed since
+    manifest was made. Only files whose modification time or size changed are
+    hashed, so this costs one stat per input file plus one read per changed
+    file.
+    """
+    ret = []
+    seen = set()
+    for path in _iter_input_files():
+        name = path.relative_to(FRONTEND_BASE).as_posix()
+        seen.add(name)
+        if name not in manifest:
+            ret.append(name)
+            continue
+
+        stat = path.stat()
+        mtime_ns, size, digest = manifest[name]
+        if stat.st_mtime_ns == mtime_ns and stat.st_size == size:
+            continue
+
+        # touched, but possibly not changed (like after a git checkout)
+        if stat.st_size != size or _hash_file(path) != digest:
+            ret.append(name)
+
+    ret.extend(sorted(manifest.keys() - seen))
+    return ret
+
+
+def is_stale():
+    """
+    Returns True if the frontend build is missing or older than its inputs
+    """
+    manifest = load_manifest()
+    if manifest is not None:
+        return bool(changed_inputs(manifest))
+
+    # a build made before manifests were used is adopted if it is newer than
+    # all its inputs, so that upgrading does not need a rebuild
+    if not FRONTEND_BUILD.is_dir():
+        return True
+
+    build_time = FRONTEND_BUILD.stat().st_mtime_ns
+    if any(i.stat().st_mtime_ns > build_time for i in _iter_input_files()):
+        return True
+
+    save_manifest()
+    return False
+
+
+def save_manifest():
+    """
+    Saves the manifest of the current build inputs along with the build
+    """
+    MANIFEST_PATH.write_text(json.dumps(make_manifest()), encoding="utf-8")
+
+
+def rebuild_frontend():
+    """
+    Function to rebuild frontend (if it is outdated)
+    """
+    # This block of code is needed to ensure that this function is running only
+    # once, even when there are multiple processes
+    lock_file = Path("temp.lock")
+    try:
+        lock_file.touch(exist_ok=False)
+    except FileExistsError:
+        return
+
+    try:
+        start = time.perf_counter()
+        if is_stale():
+            print("Rebuilding frontend build...")
+
+            # pynpm is only needed (and imported) when a rebuild is needed
+            from pynpm import NPMPackage
+
+            pkg = NPMPackage(str(FRONTEND_BASE / "package.json"))
+            if ret := pkg.run_script("build", "--report"):
+                if isinstance(ret, int):
+                    sys.exit(ret)
+
+            # the build clears its folder, so the manifest is saved after it
+            save_manifest()
+        else:
+            print(
+                "Frontend build is up to date "
+                f"(checked in {(time.perf_counter() - start) * 1000:.1f} ms)"
+            )
+    finally:
+        lock_file.unlink()
+
+    os.environ[CHECKED_ENV_VAR] = "1"
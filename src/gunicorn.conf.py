@@ -1,10 +1,23 @@
 """
 A gunicorn conf file, so that the app can be launched by running
 $ gunicorn
+
+Two worker profiles are supported, selected with WORKER_PROFILE:
+- 'sync' (the default): one request at a time per worker process, with
+  workers sized for CPU bound work
+- 'gthread': every worker process serves requests on many threads. Most of
+  the time of a request is spent waiting on the LLM, so this serves the same
+  number of concurrent requests with far less memory. The workers and
+  threads are sized from a memory budget and the expected LLM concurrency.
 """
 
+import math
 import multiprocessing
+import os
+import shutil
 import socket
+import tempfile
+from pathlib import Path
 
 
 def _get_local_private_ip():
@@ -15,13 +28,105 @@ def _get_local_private_ip():
     return ret
 
 
-# bind to both local host and local network
-bind = ["127.0.0.1", _get_local_private_ip()]
-wsgi_app = "app:app"
+def gthread_size(
+    memory_budget_mb: int, worker_mb: int, thread_mb: int, concurrency: int, cpus: int
+):
+    """
+    Returns the (workers, threads per worker) needed to have concurrency
+    requests waiting on the LLM at once within memory_budget_mb, where every
+    worker process costs worker_mb and every thread costs thread_mb. There is
+    at most one worker per CPU, because more processes only cost memory.
+    """
+    workers = (memory_budget_mb - concurrency * thread_mb) // worker_mb
+    workers = max(1, min(cpus, workers))
+    threads = math.ceil(concurrency / workers)
+
+    # if the budget is too small, concurrency is lowered to fit in it
+    fitting = (memory_budget_mb - workers * worker_mb) // (workers * thread_mb)
+    return workers, max(1, min(threads, fitting))
+
+
+WORKER_PROFILE = os.environ.get("WORKER_PROFILE", "sync")
+if WORKER_PROFILE == "gthread":
+    worker_class = "gthread"
+    workers, threads = gthread_size(
+        int(os.environ.get("WORKER_MEMORY_BUDGET_MB", "2048")),
+        int(os.environ.get("WORKER_RSS_MB", "150")),
+        int(os.environ.get("THREAD_RSS_MB", "10")),
+        int(os.environ.get("LLM_CONCURRENCY", "32")),
+        multiprocessing.cpu_count(),
+    )
 
-# use many workers to handle requests concurrently
-workers = multiprocessing.cpu_count() * 2 + 1
+    # all threads of a worker may be waiting on the LLM at once, so they must
+    # all fit in the connection pool. This must be set before configs is
+    # imported (in on_starting), because the workers are forked from this
+    # process.
+    os.environ.setdefault("LLM_POOL_SIZE", str(threads))
+
+    # a long-poll of a job only ties up one of many threads, so it is allowed
+    # (a sync worker would be blocked for the whole wait)
+    os.environ.setdefault("JOB_MAX_WAIT", "30")
+elif WORKER_PROFILE == "sync":
+    # use many workers to handle requests concurrently
+    workers = multiprocessing.cpu_count() * 2 + 1
+else:
+    raise ValueError(f"Unknown WORKER_PROFILE '{WORKER_PROFILE}'")
+
+# bind to both local host and local network by default. BIND can be set to a
+# comma separated list of addresses to override this.
+if "BIND" in os.environ:
+    bind = os.environ["BIND"].split(",")
+else:
+    bind = ["127.0.0.1", _get_local_private_ip()]
+wsgi_app = "app:app"
 
 accesslog = "-"  # write to stdout
 
 timeout = 0
+
+# temporary folders made by on_starting, that are removed on exit
+_temp_dirs: list[str] = []
+
+
+def on_starting(_server):
+    """
+    Checks (and if needed rebuilds) the frontend once in the master process,
+    before the workers are started. The workers inherit the environment
+    variable that tells app.py to skip the check (the check is also skipped
+    if it is already set, for example by a deploy script).
+
+    Also sets up the folder where the workers write their metrics (see
+    metrics.py), a new temporary folder unless PROMETHEUS_MULTIPROC_DIR is
+    set. The metrics of a previous run are removed from it.
+    """
+    from frontend import CHECKED_ENV_VAR, rebuild_frontend
+
+    if CHECKED_ENV_VAR not in os.environ:
+        rebuild_frontend()
+
+    metrics_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if metrics_dir:
+        Path(metrics_dir).mkdir(parents=True, exist_ok=True)
+        for path in Path(metrics_dir).glob("*.db"):
+            path.unlink()
+    else:
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="metrics-")
+        _temp_dirs.append(os.environ["PROMETHEUS_MULTIPROC_DIR"])
+
+
+def child_exit(_server, worker):
+    """
+    Tells the metrics of the workers that a worker has exited (its
+    histograms are still counted, since they are totals over all workers)
+    """
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def on_exit(_server):
+    """
+    Removes the temporary metrics folder (if on_starting made one)
+    """
+    for path in _temp_dirs:
+        shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,281 @@
+"""
+Implements asynchronous assessment generation jobs.
+
+A job is submitted by a web request and then runs on a bounded thread pool of
+the worker process that accepted it, so that the request returns right away.
+The job state is stored in MongoDB, so that any worker can answer a poll.
+While a job is queued or running, a heartbeat thread of its process keeps
+refreshing it, so that a poll can tell a slow job from one whose worker died.
+"""
+
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from bson.objectid import ObjectId
+from pymongo import ASCENDING
+
+import configs
+from assessment import Assessment
+from configs import (
+    JOB_QUEUE_SIZE,
+    JOB_STALE_TIMEOUT,
+    JOB_TTL,
+    JOB_WORKERS,
+)
+from exceptions import DBError, OutputFormatError, ServiceBusyError, UserInputError
+from ratelimit import priority, PRIORITY_BATCH
+from userinput import UserInput
+
+logger = logging.getLogger(__name__)
+
+# job status values
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+FINISHED_STATUSES = (JOB_DONE, JOB_FAILED)
+
+# how often (in seconds) the unfinished jobs of a process are refreshed, often
+# enough that a job is never stale while its process is alive
+HEARTBEAT_INTERVAL = JOB_STALE_TIMEOUT / 4
+
+_executor: ThreadPoolExecutor | None = None
+_executor_pid: int | None = None
+_executor_lock = threading.Lock()
+_queue_slots = threading.BoundedSemaphore(JOB_QUEUE_SIZE)
+
+# the IDs of the unfinished jobs of this process
+_live_jobs: set[ObjectId] = set()
+_live_jobs_lock = threading.Lock()
+
+
+def _get_executor():
+    """
+    Returns the job pool of the current process, and starts its heartbeat
+    thread. The pool is created lazily so that every gunicorn worker gets its
+    own threads.
+    """
+    global _executor, _executor_pid
+
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(
+                max_workers=JOB_WORKERS, thread_name_prefix="job"
+            )
+            _executor_pid = os.getpid()
+            threading.Thread(
+                target=_heartbeat_loop, name="job-heartbeat", daemon=True
+            ).start()
+
+        return _executor
+
+
+def _jobs_collection():
+    if configs.pymongo is None or configs.pymongo.db is None:
+        raise DBError()
+
+    return configs.pymongo.db.jobs
+
+
+def ensure_job_indexes():
+    """
+    Creates the index that removes old jobs, if it does not exist yet
+    """
+    _jobs_collection().create_index(
+        [("created", ASCENDING)], expireAfterSeconds=JOB_TTL, name="ttl"
+    )
+
+
+def _as_utc(value: datetime):
+    """
+    Internal helper function that returns value (a datetime from the db, which
+    is naive unless the client is timezone aware) as an aware UTC datetime
+    """
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def _update_job(job_id: ObjectId, **fields):
+    """
+    Internal helper function that sets fields of the job, unless it is
+    finished already (like a job that was reported lost), and returns whether
+    it did
+    """
+    fields["updated"] = datetime.now(timezone.utc)
+    result = _jobs_collection().update_one(
+        {"_id": job_id, "status": {"$nin": list(FINISHED_STATUSES)}},
+        {"$set": fields},
+    )
+    return result.matched_count > 0
+
+
+def _heartbeat():
+    """
+    Refreshes the 'updated' time of the unfinished jobs of this process, so
+    that a job waiting in the queue or on a slow LLM is not reported lost
+    """
+    with _live_jobs_lock:
+        job_ids = list(_live_jobs)
+
+    if job_ids:
+        _jobs_collection().update_many(
+            {"_id": {"$in": job_ids}, "status": {"$nin": list(FINISHED_STATUSES)}},
+            {"$set": {"updated": datetime.now(timezone.utc)}},
+        )
+
+
+def _heartbeat_loop():
+    while True:
+        time.sleep(HEARTBEAT_INTERVAL)
+        try:
+            _heartbeat()
+        except Exception:
+            logger.exception("Could not refresh the generation jobs")
+
+
+def _run_generation(job_id: ObjectId, user_input: UserInput, use_cache: bool):
+    try:
+        _update_job(job_id, status=JOB_RUNNING, stage="starting")
+
+        # nobody is waiting on the response, so interactive requests go first
+        with priority(PRIORITY_BATCH):
+            assessment = Assessment.from_user_input(
+                user_input, use_cache, lambda stage: _update_job(job_id, stage=stage)
+            )
+
+        _update_job(job_id, stage="saving")
+        assessment.save()
+        if not _update_job(
+            job_id,
+            status=JOB_DONE,
+            stage=JOB_DONE,
+            assessment_id=assessment.get_id(),
+            last_modified=assessment.last_modified,
+            version=assessment.version,
+        ):
+            logger.warning("Generation job %s finished after it was failed", job_id)
+    except (UserInputError, OutputFormatError, DBError, ServiceBusyError) as err:
+        # report errors in the same format as the synchronous endpoints do
+        _update_job(
+            job_id,
+            status=JOB_FAILED,
+            error={
+                "error": err.description,
+                "message": err.args[0] if err.args else None,
+                "code": err.code,
+            },
+        )
+    except Exception:
+        logger.exception("Generation job %s failed", job_id)
+        _update_job(
+            job_id,
+            status=JOB_FAILED,
+            error={"error": "Internal server error", "message": None, "code": 500},
+        )
+    finally:
+        with _live_jobs_lock:
+            _live_jobs.discard(job_id)
+
+        _queue_slots.release()
+
+
+def submit_generation(user_input: UserInput, use_cache: bool = True):
+    """
+    Queues generation (and saving) of an assessment for user_input, and
+    returns the job ID right away. Raises ServiceBusyError if this process
+    already has JOB_QUEUE_SIZE unfinished jobs.
+    """
+    if not _queue_slots.acquire(blocking=False):
+        raise ServiceBusyError("Too many generation jobs queued, try again later")
+
+    job_id = None
+    try:
+        now = datetime.now(timezone.utc)
+        job_id = (
+            _jobs_collection()
+            .insert_one(
+                {
+                    "status": JOB_QUEUED,
+                    "stage": JOB_QUEUED,
+                    "user_input": user_input.to_dict(),
+                    "worker": f"{socket.gethostname()}:{os.getpid()}",
+                    "created": now,
+                    "updated": now,
+                }
+            )
+            .inserted_id
+        )
+        with _live_jobs_lock:
+            _live_jobs.add(job_id)
+
+        _get_executor().submit(_run_generation, job_id, user_input, use_cache)
+    except Exception:
+        with _live_jobs_lock:
+            _live_jobs.discard(job_id)
+
+        _queue_slots.release()
+        raise
+
+    return job_id
+
+
+def _fail_if_stale(job: dict):
+    """
+    A job that is not finished and has not been updated for a long time was
+    most likely running in a worker that died, so it is marked failed.
+    """
+    if job["status"] in FINISHED_STATUSES:
+        return job
+
+    stale_before = datetime.now(timezone.utc) - timedelta(seconds=JOB_STALE_TIMEOUT)
+    if _as_utc(job["updated"]) >= stale_before:
+        return job
+
+    error = {"error": "Job lost", "message": "The job stopped responding", "code": 500}
+    _jobs_collection().update_one(
+        {"_id": job["_id"], "updated": job["updated"]},
+        {
+            "$set": {
+                "status": JOB_FAILED,
+                "error": error,
+                "updated": datetime.now(timezone.utc),
+            }
+        },
+    )
+    return _jobs_collection().find_one(job["_id"])
+
+
+def get_job(job_id: ObjectId, wait: float = 0):
+    """
+    Returns the job document. If wait is positive and the job is unfinished,
+    this waits (for at most wait seconds) for the job to finish, so that
+    clients can long-poll instead of polling often.
+    """
+    collection = _jobs_collection()
+    deadline = time.monotonic() + wait
+    job = _fail_if_stale(collection.find_one_or_404(job_id))
+    while job["status"] not in FINISHED_STATUSES and time.monotonic() < deadline:
+        time.sleep(0.5)
+        job = _fail_if_stale(collection.find_one_or_404(job_id))
+
+    return job
+
+
+def job_response(job: dict):
+    """
+    Returns the fields of job (a job document) that a poll responds with
+    """
+    return {
+        "job_id": job["_id"],
+        "status": job["status"],
+        "stage": job["stage"],
+        "assessment_id": job.get("assessment_id"),
+        "last_modified": job.get("last_modified"),
+        "version": job.get("version"),
+        "error": job.get("error"),
+    }
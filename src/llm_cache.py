@@ -0,0 +1,202 @@
+"""
+Implements an optional cache of LLM responses. The cache is stored in a
+MongoDB collection, so that it is shared by all gunicorn workers.
+
+Hit and miss counts are added to the shared stats in the db in batches (every
+STATS_FLUSH_COUNT lookups or STATS_FLUSH_SECONDS seconds, and when the stats
+are read), so that a lookup does not write them every time.
+"""
+
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure, PyMongoError
+
+import configs
+from configs import LLM_CACHE_MAX_ENTRIES, LLM_CACHE_TTL
+
+logger = logging.getLogger(__name__)
+
+# how many lookups, or how long, the counts of this process are kept before
+# they are added to the shared stats
+STATS_FLUSH_COUNT = 100
+STATS_FLUSH_SECONDS = 10
+
+_local_stats = {"hits": 0, "misses": 0}
+# the counts not yet added to the shared stats
+_pending_stats = {"hits": 0, "misses": 0}
+_last_flush = time.monotonic()
+_local_stats_lock = threading.Lock()
+
+
+def is_enabled():
+    """
+    Returns whether the LLM cache is enabled and usable
+    """
+    return (
+        LLM_CACHE_TTL > 0
+        and configs.pymongo is not None
+        and configs.pymongo.db is not None
+    )
+
+
+def make_key(api_url: str, payload: dict[str, Any]):
+    """
+    Returns the cache key for a request to the LLM. Whitespace differences in
+    the prompt do not change the key, but any change in the generation
+    parameters does.
+    """
+    normalized = dict(payload)
+    normalized["inputs"] = re.sub(r"\s+", " ", payload["inputs"]).strip()
+    return hashlib.sha256(
+        json.dumps([api_url, normalized], sort_keys=True).encode()
+    ).hexdigest()
+
+
+def _flush_stats(force: bool = False):
+    """
+    Internal helper function that adds the pending counts of this process to
+    the shared stats, if there are STATS_FLUSH_COUNT of them or they are older
+    than STATS_FLUSH_SECONDS (or force is set)
+    """
+    global _last_flush
+
+    with _local_stats_lock:
+        num_pending = sum(_pending_stats.values())
+        if not num_pending or (
+            not force
+            and num_pending < STATS_FLUSH_COUNT
+            and time.monotonic() - _last_flush < STATS_FLUSH_SECONDS
+        ):
+            return
+
+        pending = dict(_pending_stats)
+        for stat in _pending_stats:
+            _pending_stats[stat] = 0
+        _last_flush = time.monotonic()
+
+    try:
+        configs.pymongo.db.llm_cache_stats.update_one(
+            {"_id": "stats"}, {"$inc": pending}, upsert=True
+        )
+    except PyMongoError as err:
+        logger.warning("LLM cache stats update failed: %s", err)
+        with _local_stats_lock:
+            for stat, count in pending.items():
+                _pending_stats[stat] += count
+
+
+def _count(stat: str):
+    with _local_stats_lock:
+        _local_stats[stat] += 1
+        _pending_stats[stat] += 1
+
+    _flush_stats()
+
+
+def ensure_cache_indexes():
+    """
+    Creates the indexes used for expiring and evicting cached responses
+    """
+    if not is_enabled():
+        return
+
+    collection = configs.pymongo.db.llm_cache
+    try:
+        collection.create_index(
+            [("created", ASCENDING)], expireAfterSeconds=LLM_CACHE_TTL, name="ttl"
+        )
+    except OperationFailure:
+        # the index exists with an older TTL, so just update the TTL
+        configs.pymongo.db.command(
+            "collMod",
+            "llm_cache",
+            index={"name": "ttl", "expireAfterSeconds": LLM_CACHE_TTL},
+        )
+    collection.create_index([("last_used", ASCENDING)], name="lru")
+
+
+def get(key: str):
+    """
+    Returns the cached response for key, or None if there is none
+    """
+    if not is_enabled():
+        return None
+
+    now = datetime.now(timezone.utc)
+    try:
+        # mongo removes expired documents only once a minute, so the age is
+        # checked here too
+        doc = configs.pymongo.db.llm_cache.find_one_and_update(
+            {"_id": key, "created": {"$gt": now - timedelta(seconds=LLM_CACHE_TTL)}},
+            {"$set": {"last_used": now}, "$inc": {"hits": 1}},
+            projection={"response": 1},
+        )
+    except PyMongoError as err:
+        logger.warning("LLM cache lookup failed: %s", err)
+        return None
+
+    _count("misses" if doc is None else "hits")
+    return None if doc is None else doc["response"]
+
+
+def put(key: str, response: str):
+    """
+    Stores response under key, and evicts the least recently used responses
+    if there are more than LLM_CACHE_MAX_ENTRIES
+    """
+    if not is_enabled():
+        return
+
+    now = datetime.now(timezone.utc)
+    collection = configs.pymongo.db.llm_cache
+    try:
+        collection.update_one(
+            {"_id": key},
+            {
+                "$set": {"response": response, "created": now, "last_used": now},
+                "$setOnInsert": {"hits": 0},
+            },
+            upsert=True,
+        )
+
+        excess = collection.estimated_document_count() - LLM_CACHE_MAX_ENTRIES
+        if excess > 0:
+            evicted = [
+                i["_id"]
+                for i in collection.find({}, {"_id": 1})
+                .sort("last_used", ASCENDING)
+                .limit(excess)
+            ]
+            collection.delete_many({"_id": {"$in": evicted}})
+    except PyMongoError as err:
+        logger.warning("LLM cache update failed: %s", err)
+
+
+def stats():
+    """
+    Returns a dict of cache statistics, both for this process and for all
+    processes sharing the cache
+    """
+    with _local_stats_lock:
+        ret: dict[str, Any] = {"enabled": is_enabled(), "process": dict(_local_stats)}
+
+    if is_enabled():
+        _flush_stats(force=True)
+        shared = configs.pymongo.db.llm_cache_stats.find_one({"_id": "stats"}) or {}
+        ret["shared"] = {i: shared.get(i, 0) for i in ("hits", "misses")}
+        ret["entries"] = configs.pymongo.db.llm_cache.estimated_document_count()
+
+    for counts in (ret["process"], ret.get("shared")):
+        if counts is not None:
+            total = counts["hits"] + counts["misses"]
+            counts["hit_rate"] = counts["hits"] / total if total else 0.0
+
+    return ret
@@ -3,28 +3,136 @@ This file defines the 'get_prompt_response' function that is responsible
 for sending a prompt string to the LLM and getting the response as a string
 """
 
+import json
+import os
+import threading
+from typing import Any
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 
-from configs import API_TOKEN, API_URL, LLM_TIMEOUT
+import llm_cache
+from coalesce import coalesce
+from configs import (
+    API_TOKEN,
+    API_URL,
+    LLM_BACKOFF_FACTOR,
+    LLM_BACKOFF_JITTER,
+    LLM_CONNECT_TIMEOUT,
+    LLM_POOL_SIZE,
+    LLM_RETRIES,
+    LLM_TIMEOUT,
+)
 from exceptions import OutputFormatError
+from metrics import stage
+from ratelimit import acquire
+
+# The inference API responds with 503 while the model is loading, and with
+# 429 when we are rate limited. Both are worth retrying after a backoff.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_adapter: HTTPAdapter | None = None
+_adapter_pid: int | None = None
+_adapter_lock = threading.Lock()
+_local = threading.local()
+
+
+def _make_adapter():
+    retry = Retry(
+        total=LLM_RETRIES,
+        connect=LLM_RETRIES,
+        # a read timeout means the LLM was generating for LLM_TIMEOUT seconds,
+        # don't make the user wait that long again
+        read=0,
+        status=LLM_RETRIES,
+        allowed_methods=None,
+        status_forcelist=RETRY_STATUSES,
+        backoff_factor=LLM_BACKOFF_FACTOR,
+        backoff_jitter=LLM_BACKOFF_JITTER,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    return HTTPAdapter(
+        pool_connections=1, pool_maxsize=LLM_POOL_SIZE, max_retries=retry
+    )
+
+
+def _get_adapter():
+    """
+    Returns the connection pool of the current process. Every process has its
+    own pool, created on first use, so that connections are never shared by
+    gunicorn workers forked from the same parent.
+    """
+    global _adapter, _adapter_pid
+
+    with _adapter_lock:
+        if _adapter is None or _adapter_pid != os.getpid():
+            _adapter = _make_adapter()
+            _adapter_pid = os.getpid()
+
+        return _adapter
+
+
+def get_session():
+    """
+    Returns the HTTP session used to talk to the LLM.
 
+    requests.Session is not thread safe (it has mutable cookies and
+    settings), so every thread (like the threads of a gthread worker) gets its
+    own session. All sessions of a process share its thread safe connection
+    pool, so connections are still reused across threads.
+    """
+    adapter = _get_adapter()
+    session = getattr(_local, "session", None)
+    if session is None or session.get_adapter(API_URL) is not adapter:
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers["Authorization"] = f"Bearer {API_TOKEN}"
+        _local.session = session
+
+    return session
 
-def get_prompt_response(prompt: str):
+
+def session_stats():
     """
-    Function to get response from LLM
+    Returns connection reuse statistics of the session of this process. If
+    connections are reused, 'requests' grows faster than 'connections'.
     """
-    payload = {
+    ret = {"pid": os.getpid(), "connections": 0, "requests": 0, "reused": 0}
+    if _adapter is None or _adapter_pid != os.getpid():
+        return ret
+
+    pools = _adapter.poolmanager.pools
+    for key in pools.keys():
+        pool = pools.get(key)
+        if pool is not None:
+            ret["connections"] += pool.num_connections
+            ret["requests"] += pool.num_requests
+
+    ret["reused"] = max(ret["requests"] - ret["connections"], 0)
+    return ret
+
+
+def _make_payload(prompt: str):
+    return {
         "inputs": f"[INST]{prompt}[/INST]",
         "parameters": {"return_full_text": False, "max_new_tokens": 10000},
     }
 
+
+def _call_llm(payload: dict[str, Any]):
+    """
+    Internal helper function that sends payload to the LLM (once the rate
+    limits allow it), and returns the generated text
+    """
+    acquire(payload["inputs"])
     try:
-        response = requests.post(
-            API_URL,
-            headers={"Authorization": f"Bearer {API_TOKEN}"},
-            json=payload,
-            timeout=LLM_TIMEOUT,
-        )
+        with stage("llm"):
+            response = get_session().post(
+                API_URL, json=payload, timeout=(LLM_CONNECT_TIMEOUT, LLM_TIMEOUT)
+            )
     except requests.RequestException:
         raise OutputFormatError("Could not get LLM response") from None
 
@@ -39,3 +147,98 @@ def get_prompt_response(prompt: str):
         ) from None
 
     return ret
+
+
+def get_prompt_response(prompt: str, use_cache: bool = True):
+    """
+    Function to get response from LLM.
+
+    If the LLM cache is enabled, a cached response to an identical request is
+    returned when available. Pass use_cache=False to always get a fresh
+    response (which still updates the cache).
+
+    Identical requests that are in flight at the same time (in any worker)
+    share one LLM call (see coalesce.py), even with use_cache=False.
+    """
+    payload = _make_payload(prompt)
+    cache_key = llm_cache.make_key(API_URL, payload)
+    if use_cache:
+        with stage("llm_cache"):
+            cached = llm_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    def call():
+        ret = _call_llm(payload)
+        with stage("llm_cache"):
+            llm_cache.put(cache_key, ret)
+        return ret
+
+    return coalesce(cache_key, call)
+
+
+def _parse_stream_event(line: str):
+    """
+    Returns the token text of a line of the server-sent events stream of the
+    inference API, or None if the line has no token
+    """
+    if not line.startswith("data:"):
+        return None
+
+    try:
+        event = json.loads(line[len("data:") :])
+    except ValueError:
+        raise OutputFormatError("LLM sent an invalid stream event") from None
+
+    if not isinstance(event, dict):
+        raise OutputFormatError("LLM sent an invalid stream event")
+
+    if "error" in event:
+        raise OutputFormatError(f"LLM stream failed: {event['error']}")
+
+    token = event.get("token")
+    if not isinstance(token, dict) or token.get("special"):
+        return None
+
+    text = token.get("text")
+    if not isinstance(text, str):
+        raise OutputFormatError("LLM sent an invalid token, must be string")
+
+    return text
+
+
+def stream_prompt_response(prompt: str, use_cache: bool = True):
+    """
+    Like get_prompt_response, but yields the response text in chunks as the
+    LLM generates it. A cached response is yielded as a single chunk, and a
+    streamed response is cached once it is complete.
+    """
+    payload = _make_payload(prompt)
+    cache_key = llm_cache.make_key(API_URL, payload)
+    if use_cache and (cached := llm_cache.get(cache_key)) is not None:
+        yield cached
+        return
+
+    acquire(payload["inputs"])
+    chunks: list[str] = []
+    try:
+        with get_session().post(
+            API_URL,
+            json={**payload, "stream": True},
+            timeout=(LLM_CONNECT_TIMEOUT, LLM_TIMEOUT),
+            stream=True,
+        ) as response:
+            if not response.ok:
+                raise OutputFormatError(
+                    f"LLM responded with status {response.status_code}"
+                )
+
+            response.encoding = "utf-8"
+            for line in response.iter_lines(decode_unicode=True):
+                if line and (text := _parse_stream_event(line)) is not None:
+                    chunks.append(text)
+                    yield text
+    except requests.RequestException:
+        raise OutputFormatError("Could not get LLM response") from None
+
+    llm_cache.put(cache_key, "".join(chunks))
@@ -0,0 +1,138 @@
+"""
+Implements latency metrics of the stages of handling a request (like PDF
+extraction, the LLM call or a db query), exported in the Prometheus text
+format by the /metrics endpoint.
+
+A stage may run more than once in a request (like the LLM call of every batch
+of a large assessment), and every run is one observation of its histogram.
+
+Under gunicorn, every worker process writes its metrics to files in the
+PROMETHEUS_MULTIPROC_DIR folder (set up by gunicorn.conf.py), and the
+metrics of all workers are aggregated when they are exported, so /metrics
+shows the same totals whichever worker serves it.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CollectorRegistry,
+    CONTENT_TYPE_LATEST,
+    Counter,
+    Gauge,
+    generate_latest,
+    Histogram,
+    multiprocess,
+    REGISTRY,
+)
+
+# The environment variable prometheus_client reads the metrics folder from
+MULTIPROC_DIR_ENV_VAR = "PROMETHEUS_MULTIPROC_DIR"
+
+# From a millisecond db query to a slow LLM generation
+BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    120,
+    float("inf"),
+)
+
+STAGE_SECONDS = Histogram(
+    "stage_duration_seconds",
+    "Time taken by a stage of handling a request",
+    ["stage"],
+    buckets=BUCKETS,
+)
+
+QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds",
+    "Time taken by a MongoDB query",
+    ["query"],
+    buckets=BUCKETS,
+)
+
+REQUEST_SECONDS = Histogram(
+    "request_duration_seconds",
+    "Time taken to handle a request, until the response body starts",
+    ["endpoint", "status"],
+    buckets=BUCKETS,
+)
+
+
+# summed over the live worker processes
+LLM_QUEUE_DEPTH = Gauge(
+    "llm_queue_depth",
+    "Number of LLM calls waiting for the rate limiter",
+    ["priority"],
+    multiprocess_mode="livesum",
+)
+
+LLM_QUEUE_WAIT = Histogram(
+    "llm_queue_wait_seconds",
+    "Time an LLM call waited for the rate limiter",
+    ["priority"],
+    buckets=BUCKETS,
+)
+
+LLM_QUEUE_REJECTED = Counter(
+    "llm_queue_rejected",
+    "Number of LLM calls rejected by the rate limiter",
+    ["priority", "reason"],
+)
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Times the with block as one run of the stage name. Runs that raise an
+    exception are timed too.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(name).observe(time.perf_counter() - start)
+
+
+def observe_query(name: str, seconds: float):
+    """
+    Records that the db query name took seconds
+    """
+    QUERY_SECONDS.labels(name).observe(seconds)
+
+
+def observe_request(endpoint: str, status: int, seconds: float):
+    """
+    Records that a request to endpoint, answered with status, took seconds
+    """
+    REQUEST_SECONDS.labels(endpoint, str(status)).observe(seconds)
+
+
+def render_metrics(path: str | None = None):
+    """
+    Returns (body, content type) of the metrics in the Prometheus text
+    format. If there is a metrics folder (path, or PROMETHEUS_MULTIPROC_DIR),
+    the metrics of all processes that wrote to it are aggregated. Otherwise,
+    only the metrics of this process are returned.
+    """
+    path = path or os.environ.get(MULTIPROC_DIR_ENV_VAR)
+    if path:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, path=path)
+    else:
+        registry = REGISTRY
+
+    return generate_latest(registry), CONTENT_TYPE_LATEST
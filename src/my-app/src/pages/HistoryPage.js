@@ -7,12 +7,12 @@ import {
   Empty,
   Typography,
   Card,
-  Pagination,
+  Button,
 } from "antd";
 import axios from "axios";
 import React, { useState, useEffect } from "react";
 import { FaTrash } from "react-icons/fa";
-import { useLocation, useNavigate } from "react-router-dom";
+import { useNavigate } from "react-router-dom";
 
 import Navbar from "../components/Navbar";
 
@@ -20,57 +20,74 @@ const { Option } = Select;
 const { Search } = Input;
 const { Title, Text } = Typography;
 
+// the number of assessment summaries loaded at a time
+const PAGE_SIZE = 20;
+
+// load one page of assessment summaries (sorted by the backend) after
+// cursor, or the first page if cursor is null.
+const fetchPage = (sortOrder, cursor) =>
+  axios
+    .get("/get_history_page", {
+      params: {
+        limit: PAGE_SIZE,
+        order: sortOrder === "oldestToRecent" ? "asc" : "desc",
+        ...(cursor && { cursor }),
+      },
+    })
+    .then((response) => {
+      if (response.headers["content-type"] !== "application/json") {
+        throw new Error("Did not get JSON data");
+      }
+      return response.data;
+    });
+
 const HistoryPage = () => {
-  const location = useLocation();
-  const [historyData, setHistoryData] = useState(null);
   const [originalData, setOriginalData] = useState(null);
+  const [nextCursor, setNextCursor] = useState(null);
   const [sortOrder, setSortOrder] = useState("recentToOldest");
   const [searchKeyword, setSearchKeyword] = useState("");
   const [loading, setLoading] = useState(false);
-  const [currentPage, setCurrentPage] = useState(1);
-  const [pageSize, setPageSize] = useState(10);
+  const [loadingMore, setLoadingMore] = useState(false);
 
-  // load all assessment dictionaries from backend.
+  // reload from the first page whenever the sort order changes.
   useEffect(() => {
     setLoading(true);
-    axios
-      .get(location.pathname)
-      .then((response) => {
+    fetchPage(sortOrder, null)
+      .then((data) => {
         setLoading(false);
-        if (response.headers["content-type"] !== "application/json") {
-          throw new Error("Did not get JSON data");
-        }
-        setHistoryData(response.data);
-        setOriginalData(response.data);
+        setOriginalData(data.assessments);
+        setNextCursor(data.next_cursor);
       })
       .catch((error) => {
         setLoading(false);
         console.error("Error fetching history: ", error);
         message.error("Failed to load history data!");
       });
-  }, [location.pathname]);
+  }, [sortOrder]);
 
-  useEffect(() => {
-    if (originalData) {
-      // Ensure original data is available
-      let sortedData = [...originalData]; // Use original data for sorting and filtering
-      if (sortOrder === "recentToOldest") {
-        sortedData = sortedData.sort(
-          (a, b) => new Date(b.last_modified) - new Date(a.last_modified),
-        );
-      } else if (sortOrder === "oldestToRecent") {
-        sortedData = sortedData.sort(
-          (a, b) => new Date(a.last_modified) - new Date(b.last_modified),
-        );
-      }
-      const filteredData = sortedData.filter((assessment) =>
-        assessment.user_input.topic
-          .toLowerCase()
-          .includes(searchKeyword.toLowerCase()),
-      );
-      setHistoryData(filteredData);
-    }
-  }, [sortOrder, searchKeyword, originalData]);
+  const handleLoadMore = () => {
+    setLoadingMore(true);
+    fetchPage(sortOrder, nextCursor)
+      .then((data) => {
+        setLoadingMore(false);
+        setOriginalData((prevData) => [...prevData, ...data.assessments]);
+        setNextCursor(data.next_cursor);
+      })
+      .catch((error) => {
+        setLoadingMore(false);
+        console.error("Error fetching history: ", error);
+        message.error("Failed to load history data!");
+      });
+  };
+
+  // the search only filters the assessments loaded so far.
+  const historyData =
+    originalData &&
+    originalData.filter((assessment) =>
+      assessment.user_input.topic
+        .toLowerCase()
+        .includes(searchKeyword.toLowerCase()),
+    );
 
   const navigate = useNavigate();
   const handleAssessmentClick = (assessmentId) => {
@@ -85,9 +102,6 @@ const HistoryPage = () => {
         setOriginalData((prevData) =>
           prevData.filter((assessment) => assessment._id !== assessmentId),
         );
-        setHistoryData((prevData) =>
-          prevData.filter((assessment) => assessment._id !== assessmentId),
-        );
       })
       .catch((error) => {
         console.error("Error deleting assessment: ", error);
@@ -103,19 +117,6 @@ const HistoryPage = () => {
     setSearchKeyword(value.trim());
   };
 
-  const handlePageChange = (page) => {
-    setCurrentPage(page);
-  };
-
-  const handlePageSizeChange = (current, value) => {
-    setPageSize(value);
-    setCurrentPage(current); // Reset to first page when changing page size
-  };
-
-  const paginatedData =
-    historyData &&
-    historyData.slice((currentPage - 1) * pageSize, currentPage * pageSize);
-
   return (
     <>
       <Navbar />
@@ -149,7 +150,7 @@ const HistoryPage = () => {
           <Spin size="large" />
         ) : (
           <>
-            {historyData && historyData.length > 0 ? (
+            {historyData && (historyData.length > 0 || nextCursor) ? (
               <>
                 <div
                   style={{
@@ -159,7 +160,7 @@ const HistoryPage = () => {
                     gap: "20px",
                   }}
                 >
-                  {paginatedData.map((assessment, index) => (
+                  {historyData.map((assessment, index) => (
                     <Card
                       key={`history-item-${index}`}
                       hoverable
@@ -191,16 +192,13 @@ const HistoryPage = () => {
                     </Card>
                   ))}
                 </div>
-                <Pagination
-                  style={{ textAlign: "center", marginTop: "20px" }}
-                  current={currentPage}
-                  pageSize={pageSize}
-                  total={historyData.length}
-                  onChange={handlePageChange}
-                  onShowSizeChange={(current, size) =>
-                    handlePageSizeChange(current, size)
-                  }
-                />
+                {nextCursor && (
+                  <div style={{ textAlign: "center", marginTop: "20px" }}>
+                    <Button loading={loadingMore} onClick={handleLoadMore}>
+                      Load more
+                    </Button>
+                  </div>
+                )}
               </>
             ) : (
               <Empty />
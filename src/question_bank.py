@@ -0,0 +1,257 @@
+"""
+Implements the question bank: every saved question is indexed by the topic,
+question type and context keywords it was generated for, so that later
+generations for the same input can reuse questions instead of asking the LLM
+for all of them.
+
+Questions are deduplicated by a hash of the topic and question type they are
+banked under and of their type and normalized text, so saving the same
+question again for the same input (like saving an edited copy of an
+assessment) does not add it twice, while saving it for another topic indexes
+it under that topic too. If near-duplicate detection is enabled, a
+near-duplicate (see dedup.py) of a question of the same topic and type is not
+added either, it only adds its keywords to the question in the bank. Every
+question is stored with its MinHash signature and LSH band keys, and the band
+keys are indexed, so the near-duplicates are found without comparing with the
+whole bank. Inputs with PDFs do not use the bank, since their questions
+depend on the PDFs.
+"""
+
+import hashlib
+import logging
+from datetime import datetime
+from typing import Any, Iterable
+
+import numpy as np
+from bson import Binary
+from pymongo import ASCENDING, IndexModel, UpdateOne
+from pymongo.errors import PyMongoError
+
+import configs
+import dedup
+from configs import QUESTION_BANK
+from dbutils import ensure_indexes, timed_query
+from dedup import normalize_text, question_key
+from metrics import stage
+from retrieval import tokenize
+from userinput import UserInput
+
+logger = logging.getLogger(__name__)
+
+QUESTION_BANK_INDEXES = [
+    IndexModel(
+        [("topic", ASCENDING), ("question_type", ASCENDING), ("keywords", ASCENDING)],
+        name="lookup",
+    ),
+    IndexModel([("lsh", ASCENDING)], name="lsh"),
+]
+
+
+def is_enabled():
+    """
+    Returns whether the question bank is enabled and usable
+    """
+    return (
+        QUESTION_BANK and configs.pymongo is not None and configs.pymongo.db is not None
+    )
+
+
+def content_hash(question: dict[str, Any], topic: str, question_type: str):
+    """
+    Returns the hash that identifies question (a question dict) banked under
+    the (normalized) topic and question type in the bank, the same for the
+    questions that are duplicates (see dedup.question_key)
+    """
+    key = "\n".join([topic, question_type, question_key(question)])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _bank_fields(user_input: dict[str, Any]):
+    """
+    Internal helper function that returns the normalized topic, question type
+    and keywords a question generated for user_input (a dict like
+    UserInput.to_dict returns) is indexed by
+    """
+    return {
+        "topic": normalize_text(user_input["topic"]),
+        "question_type": user_input["question_type"],
+        "keywords": sorted(set(tokenize(user_input.get("context_keywords", "")))),
+    }
+
+
+def ensure_question_bank_indexes():
+    """
+    Creates the indexes in QUESTION_BANK_INDEXES, if they do not exist yet
+    """
+    if is_enabled():
+        ensure_indexes(configs.pymongo.db.question_bank, QUESTION_BANK_INDEXES)
+
+
+def _merge_near_duplicates(
+    ids: list[str],
+    groups: list[tuple[str, str]],
+    exact: list[str],
+    sigs: np.ndarray,
+    keys: list,
+):
+    """
+    Internal helper function that returns the _id every question (with _id
+    ids, (topic, question type) groups, exact tokens exact, signature sigs and
+    band keys keys) is stored as: the _id of a question of the same group it
+    is a near-duplicate of (in the bank, or earlier in the list), otherwise
+    its own
+    """
+    if not dedup.is_enabled():
+        return ids
+
+    collection = configs.pymongo.db.question_bank
+    query = {"lsh": {"$in": sorted({key for row in keys for key in row})}}
+    with timed_query(
+        "question_bank.find_lsh", lambda: collection.find(query).explain()
+    ):
+        docs = list(
+            collection.find(
+                query,
+                {"topic": 1, "question_type": 1, "exact": 1, "lsh": 1, "minhash": 1},
+            )
+        )
+
+    # the candidates of every band key: (_id, (topic, type, exact), signature)
+    buckets: dict[int, list[tuple[str, tuple[str, str, str], np.ndarray]]] = {}
+    for doc in docs:
+        sig = np.frombuffer(doc["minhash"], dtype=np.uint32)
+        group = (doc["topic"], doc["question_type"], doc.get("exact"))
+        for key in doc["lsh"]:
+            buckets.setdefault(key, []).append((doc["_id"], group, sig))
+
+    ret = []
+    for _id, group, tokens, sig, row in zip(ids, groups, exact, sigs, keys):
+        match = next(
+            (
+                other_id
+                for key in row
+                for other_id, other_group, other_sig in buckets.get(key, [])
+                if other_group == (*group, tokens)
+                and dedup.similarity(sig, other_sig) >= dedup.DEDUP_THRESHOLD
+            ),
+            None,
+        )
+        if match is None:
+            match = _id
+            for key in row:
+                buckets.setdefault(key, []).append((_id, (*group, tokens), sig))
+
+        ret.append(match)
+
+    return ret
+
+
+def add_assessments(assessments: Iterable[dict[str, Any]]):
+    """
+    Adds the questions of assessments (dicts like Assessment.to_dict returns)
+    to the bank. Questions already in the bank (or near-duplicates of them)
+    are also indexed by the keywords of these assessments. Failures are
+    logged, since the bank is only an optimization.
+    """
+    if not is_enabled():
+        return
+
+    entries = []
+    for assessment in assessments:
+        if assessment["user_input"].get("pdfs"):
+            continue
+
+        fields = _bank_fields(assessment["user_input"])
+        keywords = fields.pop("keywords")
+        entries.extend((fields, keywords, i) for i in assessment["questions"])
+
+    if not entries:
+        return
+
+    now = datetime.now()
+    try:
+        with stage("question_bank"):
+            texts = [dedup.question_text(question) for *_, question in entries]
+            exact = [dedup.exact_tokens(i) for i in texts]
+            sigs = dedup.signatures(texts)
+            keys = dedup.band_keys(sigs).tolist()
+            ids = _merge_near_duplicates(
+                [
+                    content_hash(question, fields["topic"], fields["question_type"])
+                    for fields, _, question in entries
+                ],
+                [(fields["topic"], fields["question_type"]) for fields, *_ in entries],
+                exact,
+                sigs,
+                keys,
+            )
+            ops = [
+                UpdateOne(
+                    {"_id": _id},
+                    {
+                        "$setOnInsert": {
+                            **fields,
+                            "question": question,
+                            "exact": tokens,
+                            "lsh": row,
+                            "minhash": Binary(sig.tobytes()),
+                            "created": now,
+                        },
+                        "$addToSet": {"keywords": {"$each": keywords}},
+                    },
+                    upsert=True,
+                )
+                for (fields, keywords, question), _id, tokens, sig, row in zip(
+                    entries, ids, exact, sigs, keys
+                )
+            ]
+            with timed_query("question_bank.bulk_write"):
+                configs.pymongo.db.question_bank.bulk_write(ops, ordered=False)
+    except PyMongoError as err:
+        logger.warning("Could not add questions to the question bank: %s", err)
+
+
+def find_questions(user_input: UserInput, num_questions: int):
+    """
+    Returns at most num_questions random question dicts from the bank that
+    were generated for the topic and question type of user_input, and for (at
+    least) its context keywords
+    """
+    if not is_enabled() or user_input.pdfs or num_questions <= 0:
+        return []
+
+    query = _bank_fields(user_input.to_dict())
+    if query["keywords"]:
+        query["keywords"] = {"$all": query["keywords"]}
+    else:
+        del query["keywords"]
+
+    collection = configs.pymongo.db.question_bank
+    try:
+        with stage("question_bank"), timed_query(
+            "question_bank.aggregate", lambda: collection.find(query).explain()
+        ):
+            return [
+                doc["question"]
+                for doc in collection.aggregate(
+                    [
+                        {"$match": query},
+                        {"$sample": {"size": num_questions}},
+                        {"$project": {"question": 1}},
+                    ]
+                )
+            ]
+    except PyMongoError as err:
+        logger.warning("Question bank lookup failed: %s", err)
+        return []
+
+
+def stats():
+    """
+    Returns a dict of question bank statistics
+    """
+    ret: dict[str, Any] = {"enabled": bool(is_enabled())}
+    if is_enabled():
+        ret["questions"] = configs.pymongo.db.question_bank.estimated_document_count()
+
+    return ret
@@ -0,0 +1,111 @@
+"""
+Implements an incremental parser of the question list generated by the LLM,
+so that questions can be used as soon as they are generated
+"""
+
+from typing import Any
+
+# This third party library is used instead of stdlib json is because it accepts
+# trailing commas in json - something that the LLM can incorrectly add
+import jsonc
+
+from exceptions import OutputFormatError
+
+
+class IncrementalQuestionParser:
+    """
+    Scans LLM output in one pass, as it arrives in chunks, and returns every
+    top level JSON object (question dict) as soon as it is complete.
+
+    Everything outside of top level objects (the enclosing list, markdown
+    code fences, any prose) is skipped, and braces inside JSON strings are
+    handled correctly.
+
+    By default, an invalid object raises OutputFormatError. With salvage=True,
+    invalid objects are dropped instead (and the reasons are recorded in
+    dropped), so that the valid questions of a partly broken response can
+    still be used.
+    """
+
+    def __init__(self, salvage: bool = False):
+        self._current: list[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self.salvage = salvage
+        self.num_seen = 0
+        self.num_parsed = 0
+        self.dropped: list[str] = []
+
+    def feed(self, text: str):
+        """
+        Scans the next chunk of the output, and returns the list of question
+        dicts completed by this chunk
+        """
+        ret: list[dict[str, Any]] = []
+        start = 0 if self._depth else None
+        for i, char in enumerate(text):
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = self._depth > 0
+            elif char == "{":
+                if self._depth == 0:
+                    start = i
+                self._depth += 1
+            elif char == "}" and self._depth > 0:
+                self._depth -= 1
+                if self._depth == 0 and start is not None:
+                    self._current.append(text[start : i + 1])
+                    obj = self._parse("".join(self._current))
+                    if obj is not None:
+                        ret.append(obj)
+                    self._current = []
+                    start = None
+
+        if self._depth > 0 and start is not None:
+            self._current.append(text[start:])
+
+        return ret
+
+    def _parse(self, obj_text: str):
+        self.num_seen += 1
+        try:
+            obj = jsonc.loads(obj_text)
+        except jsonc.JSONDecodeError as err:
+            if not self.salvage:
+                raise OutputFormatError("LLM sent invalid json response") from None
+
+            self.drop(f"invalid json ({err.msg})")
+            return None
+
+        self.num_parsed += 1
+        return obj
+
+    def drop(self, reason: str):
+        """
+        Records that the last question seen was dropped, and why
+        """
+        self.dropped.append(f"question {self.num_seen}: {reason}")
+
+    def close(self):
+        """
+        Must be called once all output is fed. Raises OutputFormatError if the
+        output ended in the middle of a question (in salvage mode, the
+        incomplete question is dropped instead).
+        """
+        if self._depth > 0:
+            if not self.salvage:
+                raise OutputFormatError("LLM response ended in an incomplete question")
+
+            self.num_seen += 1
+            self.drop("response ended in the middle of the question")
+            self._current = []
+            self._depth = 0
+            self._in_string = False
+            self._escaped = False
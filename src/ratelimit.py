@@ -0,0 +1,259 @@
+"""
+Implements a limiter of the outbound calls to the LLM, shared by all gunicorn
+workers, so that bursts are paced just under the provider's rate limits
+instead of failing with 429 responses.
+
+The limits are a token bucket of requests (LLM_RATE_LIMIT per minute) and one
+of estimated LLM tokens (LLM_TOKEN_LIMIT per minute). Both buckets hold at
+most LLM_RATE_BURST seconds worth of their rate. They are stored in a MongoDB
+document, and refilled and taken from atomically in one update, using the
+clock of the db server (so that the clocks of the workers do not matter).
+
+Callers that have to wait queue up in their process by priority, so that an
+interactive generation goes ahead of batch work (like generation jobs). Batch
+calls also leave LLM_BATCH_RESERVE of every bucket to the interactive calls
+of all processes. A process queues at most LLM_QUEUE_SIZE calls, and a call
+waits at most LLM_QUEUE_TIMEOUT seconds, otherwise ServiceBusyError is
+raised.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any
+
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+
+import configs
+from configs import (
+    LLM_BATCH_RESERVE,
+    LLM_OUTPUT_TOKENS_ESTIMATE,
+    LLM_QUEUE_SIZE,
+    LLM_QUEUE_TIMEOUT,
+    LLM_RATE_BURST,
+    LLM_RATE_LIMIT,
+    LLM_TOKEN_LIMIT,
+)
+from exceptions import ServiceBusyError
+from metrics import LLM_QUEUE_DEPTH, LLM_QUEUE_REJECTED, LLM_QUEUE_WAIT
+from retrieval import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# priority values, lower values go first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BATCH: "batch"}
+
+# the refill rate (per second) of every bucket, disabled buckets are left out
+RATES = {
+    name: limit / 60
+    for name, limit in (("requests", LLM_RATE_LIMIT), ("tokens", LLM_TOKEN_LIMIT))
+    if limit > 0
+}
+
+BUCKET_ID = "llm"
+
+_priority: ContextVar[int] = ContextVar("llm_priority", default=PRIORITY_INTERACTIVE)
+
+# heap of the (priority, sequence number) of the calls waiting in this process
+_waiting: list[tuple[int, int]] = []
+_waiting_cond = threading.Condition()
+_sequence = itertools.count()
+
+
+@contextmanager
+def priority(value: int):
+    """
+    Makes the LLM calls made in the with block (in this thread, or in threads
+    started with a copy of its context) use the priority value
+    """
+    token = _priority.set(value)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def is_enabled():
+    """
+    Returns whether LLM calls are rate limited
+    """
+    return (
+        bool(RATES) and configs.pymongo is not None and configs.pymongo.db is not None
+    )
+
+
+def capacity(name: str):
+    """
+    Returns the size of the bucket name
+    """
+    return RATES[name] * LLM_RATE_BURST
+
+
+def estimate_costs(prompt: str):
+    """
+    Returns what a call with prompt takes from every bucket. A call never
+    costs more than a full bucket, so that it can always be made eventually
+    (see required).
+    """
+    costs = {
+        "requests": 1,
+        "tokens": estimate_tokens(prompt) + LLM_OUTPUT_TOKENS_ESTIMATE,
+    }
+    return {name: min(costs[name], capacity(name)) for name in RATES}
+
+
+def reserve(name: str, value: int):
+    """
+    Returns how much of the bucket name must be left after a call with
+    priority value
+    """
+    return LLM_BATCH_RESERVE * capacity(name) if value == PRIORITY_BATCH else 0.0
+
+
+def required(name: str, costs: dict[str, float], value: int):
+    """
+    Returns the level the bucket name must have for a call with priority
+    value that costs costs. This includes the reserve of batch calls, but is
+    never more than a full bucket, so that a batch call can always be made
+    eventually (with the reserve cut short when the cost is close to the
+    capacity).
+    """
+    return min(costs[name] + reserve(name, value), capacity(name))
+
+
+def wait_time(levels: dict[str, float], costs: dict[str, float], value: int):
+    """
+    Returns how long (in seconds) a call with priority value must wait until
+    the buckets (that are at levels) have refilled enough for it
+    """
+    return max(
+        (required(name, costs, value) - levels[name]) / RATES[name] for name in RATES
+    )
+
+
+def _take_pipeline(costs: dict[str, float], value: int):
+    """
+    Internal helper function that returns the update pipeline that refills
+    the buckets for the time since their last update, and then takes costs
+    from them if every bucket has enough. 'granted' is set to whether it did.
+    """
+    elapsed = {
+        "$divide": [
+            {"$subtract": ["$$NOW", {"$ifNull": ["$updated", "$$NOW"]}]},
+            1000,
+        ]
+    }
+    refilled: dict[str, Any] = {
+        name: {
+            "$min": [
+                capacity(name),
+                {
+                    "$add": [
+                        {"$ifNull": [f"${name}", capacity(name)]},
+                        {"$multiply": ["$elapsed", RATES[name]]},
+                    ]
+                },
+            ]
+        }
+        for name in RATES
+    }
+    granted = {
+        "$and": [{"$gte": [f"${name}", required(name, costs, value)]} for name in RATES]
+    }
+    taken = {
+        name: {
+            "$cond": ["$granted", {"$subtract": [f"${name}", costs[name]]}, f"${name}"]
+        }
+        for name in RATES
+    }
+    return [
+        {"$set": {"elapsed": elapsed}},
+        {"$set": {**refilled, "updated": "$$NOW"}},
+        {"$set": {"granted": granted}},
+        {"$set": taken},
+        {"$unset": "elapsed"},
+    ]
+
+
+def _take(costs: dict[str, float], value: int):
+    """
+    Internal helper function that takes costs from the shared buckets if they
+    have enough, and returns 0. Otherwise, returns how long to wait before
+    trying again.
+    """
+    try:
+        doc = configs.pymongo.db.rate_limits.find_one_and_update(
+            {"_id": BUCKET_ID},
+            _take_pipeline(costs, value),
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except PyMongoError as err:
+        # the limiter must not make the LLM unusable when the db is not
+        logger.warning("LLM rate limiter failed, not limiting: %s", err)
+        return 0.0
+
+    if doc["granted"]:
+        return 0.0
+
+    return max(wait_time(doc, costs, value), 0.01)
+
+
+def acquire(prompt: str):
+    """
+    Waits until the rate limits allow an LLM call with prompt, and takes it
+    from the limits. Calls of this process wait in the order of their priority
+    (see priority), and then of their arrival. Raises ServiceBusyError if too
+    many calls are waiting, or if the limits will not allow this call within
+    LLM_QUEUE_TIMEOUT seconds.
+    """
+    if not is_enabled():
+        return
+
+    value = _priority.get()
+    label = PRIORITY_NAMES[value]
+    costs = estimate_costs(prompt)
+    entry = (value, next(_sequence))
+    start = time.monotonic()
+    deadline = start + LLM_QUEUE_TIMEOUT
+    with _waiting_cond:
+        if len(_waiting) >= LLM_QUEUE_SIZE:
+            LLM_QUEUE_REJECTED.labels(label, "full").inc()
+            raise ServiceBusyError("Too many LLM calls queued, try again later")
+
+        heapq.heappush(_waiting, entry)
+        # a waiting call of lower priority is no longer first
+        _waiting_cond.notify_all()
+
+    LLM_QUEUE_DEPTH.labels(label).inc()
+    try:
+        with _waiting_cond:
+            while True:
+                wait = None
+                if _waiting[0] == entry:
+                    wait = _take(costs, value)
+                    if wait <= 0:
+                        return
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or (wait is not None and wait > remaining):
+                    LLM_QUEUE_REJECTED.labels(label, "timeout").inc()
+                    raise ServiceBusyError("LLM rate limit reached, try again later")
+
+                _waiting_cond.wait(remaining if wait is None else wait)
+    finally:
+        with _waiting_cond:
+            _waiting.remove(entry)
+            heapq.heapify(_waiting)
+            _waiting_cond.notify_all()
+
+        LLM_QUEUE_DEPTH.labels(label).dec()
+        LLM_QUEUE_WAIT.labels(label).observe(time.monotonic() - start)
@@ -0,0 +1,171 @@
+"""
+Implements lexical retrieval of the parts of a (PDF) text that are relevant to
+the assessment, so that only those parts are added to the prompt
+"""
+
+import functools
+import hashlib
+import json
+import math
+import re
+from collections import Counter
+
+from configs import PDF_CHUNK_OVERLAP, PDF_CHUNK_WORDS
+from extraction import extraction_cache
+
+# The BM25 parameters commonly used as defaults
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the "
+    "this to was were which with".split()
+)
+
+
+def tokenize(text: str):
+    """
+    Splits text into lowercase words, without stopwords
+    """
+    return [i for i in re.findall(r"\w+", text.lower()) if i not in STOPWORDS]
+
+
+def estimate_tokens(text: str):
+    """
+    Roughly estimates the number of LLM tokens in text (a token is about
+    four characters of English text)
+    """
+    return len(text) // 4 + 1
+
+
+def chunk_text(text: str, chunk_words: int, overlap: int):
+    """
+    Splits text into chunks of chunk_words words, where consecutive chunks
+    share overlap words
+    """
+    words = text.split()
+    step = max(chunk_words - overlap, 1)
+    return [
+        " ".join(words[i : i + chunk_words])
+        for i in range(0, max(len(words) - overlap, 1), step)
+    ]
+
+
+class BM25Index:
+    """
+    A BM25 index over the chunks of a text
+    """
+
+    def __init__(self, chunks: list[str], term_freqs: list[dict[str, int]]):
+        self.chunks = chunks
+        self.term_freqs = term_freqs
+        self.lengths = [sum(i.values()) for i in term_freqs]
+        self.avg_length = sum(self.lengths) / len(self.lengths) if chunks else 0
+        self.doc_freqs: Counter[str] = Counter()
+        for freqs in term_freqs:
+            self.doc_freqs.update(freqs.keys())
+
+    @classmethod
+    def from_chunks(cls, chunks: list[str]):
+        """
+        Builds the index of the given chunks
+        """
+        return cls(chunks, [dict(Counter(tokenize(i))) for i in chunks])
+
+    @classmethod
+    def from_json(cls, data: str):
+        """
+        Inverse of to_json
+        """
+        loaded = json.loads(data)
+        return cls(loaded["chunks"], loaded["term_freqs"])
+
+    def to_json(self):
+        """
+        Returns a JSON string of the index, so that it can be cached
+        """
+        return json.dumps({"chunks": self.chunks, "term_freqs": self.term_freqs})
+
+    def scores(self, query: str):
+        """
+        Returns the BM25 score of every chunk for the query
+        """
+        num_chunks = len(self.chunks)
+        ret = [0.0] * num_chunks
+        for term in set(tokenize(query)):
+            doc_freq = self.doc_freqs.get(term, 0)
+            if not doc_freq:
+                continue
+
+            idf = math.log(1 + (num_chunks - doc_freq + 0.5) / (doc_freq + 0.5))
+            for i, freqs in enumerate(self.term_freqs):
+                freq = freqs.get(term, 0)
+                if freq:
+                    norm = 1 - BM25_B + BM25_B * self.lengths[i] / self.avg_length
+                    ret[i] += idf * freq * (BM25_K1 + 1) / (freq + BM25_K1 * norm)
+
+        return ret
+
+    def select(self, query: str, token_budget: int, top_k: int):
+        """
+        Returns the indexes of at most top_k of the best scoring chunks for the
+        query that fit in token_budget, in the order they appear in the text
+        """
+        scores = self.scores(query)
+
+        # sorting is stable, so chunks with equal scores stay in text order
+        ranked = sorted(range(len(self.chunks)), key=lambda i: -scores[i])
+        selected = []
+        used = 0
+        for i in ranked:
+            if len(selected) == top_k:
+                break
+
+            cost = estimate_tokens(self.chunks[i])
+            if used + cost <= token_budget:
+                selected.append(i)
+                used += cost
+
+        return sorted(selected)
+
+
+@functools.lru_cache(maxsize=16)
+def get_index(texts: tuple[str, ...]):
+    """
+    Returns the BM25 index of the chunks of all texts (chunks never span two
+    texts). Indexes are cached on disk along with the extracted text (and in
+    memory for the most recently used ones).
+    """
+    digest = hashlib.sha256(f"bm25:{PDF_CHUNK_WORDS}:{PDF_CHUNK_OVERLAP}".encode())
+    for text in texts:
+        digest.update(hashlib.sha256(text.encode()).digest())
+
+    key = digest.hexdigest()
+    if (cached := extraction_cache.get(key)) is not None:
+        return BM25Index.from_json(cached)
+
+    index = BM25Index.from_chunks(
+        [
+            chunk
+            for text in texts
+            for chunk in chunk_text(text, PDF_CHUNK_WORDS, PDF_CHUNK_OVERLAP)
+        ]
+    )
+    extraction_cache.put(key, index.to_json())
+    return index
+
+
+def select_context(texts: list[str], query: str, token_budget: int, top_k: int):
+    """
+    Returns the parts of texts most relevant to query, that together fit in
+    token_budget (in estimated tokens). Texts that already fit are returned
+    as is, and a non positive token_budget disables selection.
+    """
+    joined = "\n\n".join(texts)
+    if token_budget <= 0 or estimate_tokens(joined) <= token_budget:
+        return joined
+
+    index = get_index(tuple(texts))
+    return "\n...\n".join(
+        index.chunks[i] for i in index.select(query, token_budget, top_k)
+    )
@@ -0,0 +1,52 @@
+"""
+Helpers to encode documents incrementally, so that large responses can be
+streamed to the client instead of being built in memory first
+"""
+
+from itertools import islice
+from typing import Any, Iterable, Iterator
+
+from bson import json_util
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+JSON_MIMETYPE = "application/json"
+SSE_MIMETYPE = "text/event-stream"
+
+
+def _batched(docs: Iterable[Any], batch_size: int):
+    docs = iter(docs)
+    while batch := list(islice(docs, batch_size)):
+        yield batch
+
+
+def iter_ndjson(docs: Iterable[Any], batch_size: int) -> Iterator[str]:
+    """
+    Encodes docs as newline delimited JSON (one document per line). Every
+    yielded chunk has at most batch_size documents.
+    """
+    for batch in _batched(docs, batch_size):
+        yield "".join(f"{json_util.dumps(doc)}\n" for doc in batch)
+
+
+def iter_json_array(docs: Iterable[Any], batch_size: int) -> Iterator[str]:
+    """
+    Encodes docs as a single JSON array, yielded in chunks of at most
+    batch_size documents. The concatenated output is the same as what
+    json_util.dumps(list(docs)) would give.
+    """
+    separator = "["
+    for batch in _batched(docs, batch_size):
+        yield separator + ", ".join(json_util.dumps(doc) for doc in batch)
+        separator = ", "
+
+    yield "[]" if separator == "[" else "]"
+
+
+def sse_event(event: str, data: Any, event_id: str | None = None):
+    """
+    Encodes a server-sent event, with data encoded as (single line) JSON. If
+    event_id is set, a browser EventSource that reconnects after this event
+    sends it in the Last-Event-ID header.
+    """
+    ret = f"event: {event}\ndata: {json_util.dumps(data)}\n\n"
+    return ret if event_id is None else f"id: {event_id}\n{ret}"
@@ -2,11 +2,21 @@
 pytest based unit testing for everything in assessment.py
 """
 
+import json
+import re
 import string
+from types import SimpleNamespace
 
 import pytest
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
 
+import assessment as assessment_module
+import configs
 from assessment import (
+    decode_history_cursor,
+    encode_history_cursor,
+    make_questions,
     option_id_as_int,
     OutputFormatError,
     QuestionBase,
@@ -14,7 +24,10 @@ from assessment import (
     QuestionMCQ,
     QuestionSubjectiveAnswer,
     QuestionShortAnswer,
+    stream_questions,
     Assessment,
+    ConflictError,
+    UserInputError,
 )
 from userinput import UserInput
 
@@ -245,6 +258,59 @@ class TestQuestionLongAnswer:
         }
 
 
+class TestMakeQuestions:
+    """
+    Tests the make_questions bulk constructor
+    """
+
+    def test_bulk(self):
+        """
+        Test that a list of dicts and objects is converted in order, to
+        objects without a per-instance dict
+        """
+        short = QuestionShortAnswer({"question": "Why?", "sample_answer": "a"})
+        questions = make_questions(
+            [
+                {
+                    "question_type": "mcq",
+                    "question": "What is 1+1?",
+                    "options": ["1", "2"],
+                    "correct_answer": 1,
+                },
+                short,
+                {
+                    "question_type": "Long Answer",
+                    "question": "How?",
+                    "sample_answer": "b",
+                },
+            ]
+        )
+        assert [type(i) for i in questions] == [
+            QuestionMCQ,
+            QuestionShortAnswer,
+            QuestionLongAnswer,
+        ]
+        assert questions[1] is short
+        for question in questions:
+            assert not hasattr(question, "__dict__")
+
+    def test_invalid(self):
+        """
+        Test that the index of an invalid question is reported
+        """
+        with pytest.raises(OutputFormatError, match="question 1:"):
+            make_questions(
+                [
+                    {
+                        "question_type": "Short",
+                        "question": "Why?",
+                        "sample_answer": "a",
+                    },
+                    {"question_type": "MCQ", "question": "How?", "options": [1]},
+                ]
+            )
+
+
 class TestAssessment:
     """
     A group of tests that test Assessment.
@@ -331,5 +397,599 @@ class TestAssessment:
             assert left.to_dict() == right.to_dict()
 
 
+class TestSalvage:
+    """
+    A group of tests that test salvaging the valid questions of a partly
+    invalid LLM response, and topping up the missing ones
+    """
+
+    valid = {"question_type": "Short Answer", "question": "Why?", "sample_answer": "a"}
+
+    def test_salvage_from_str(self):
+        """
+        Test that invalid questions are dropped with a reason
+        """
+        response = (
+            f"[{json.dumps(self.valid)}, "
+            '{"question_type": "Essay", "question": "Eh?"}, '
+            '{"question": broken}, '
+            '{"question_type": "MCQ", "question": "How'
+        )
+        assessment = Assessment(questions=response)
+        assert [i.question for i in assessment.questions] == ["Why?"]
+        assert len(assessment.dropped) == 3
+
+    def test_top_up(self, monkeypatch):
+        """
+        Test that only the missing questions are asked for again
+        """
+        prompts = []
+
+        def get_prompt_response(prompt: str, use_cache: bool = True):
+            prompts.append(prompt)
+            if len(prompts) == 1:
+                questions = [dict(self.valid, question=f"Q{i}?") for i in range(3)]
+                return json.dumps(questions)[:-40]
+
+            return json.dumps([dict(self.valid, question="Q3?")])
+
+        monkeypatch.setattr(
+            assessment_module, "get_prompt_response", get_prompt_response
+        )
+        assessment = Assessment.from_user_input(UserInput("History", "SA", 3, []))
+        assert len(prompts) == 2
+        assert "Generate 1 " in prompts[1]
+        assert [i.question for i in assessment.questions] == ["Q0?", "Q1?", "Q3?"]
+        assert len(assessment.dropped) == 1
+
+
+def request_json(**fields):
+    """
+    Returns the request json of an assessment with one question
+    """
+    return {
+        "user_input": {
+            "topic": "Algebra",
+            "question_type": "SA",
+            "num_questions": 1,
+            "pdfs": [],
+        },
+        "questions": [
+            {"question_type": "Short Answer", "question": "Q?", "sample_answer": "a"}
+        ],
+        **fields,
+    }
+
+
+@pytest.fixture(name="assessments_db")
+def fixture_assessments_db(monkeypatch):
+    """
+    Stores assessments in an in memory MongoDB (mongomock, the tests are
+    skipped if it is not installed), and returns the assessments collection
+    """
+    mongomock = pytest.importorskip("mongomock")
+    collection = mongomock.MongoClient().db.assessments
+    bulk_write = collection.bulk_write
+
+    def bulk_write_(ops, ordered=True):
+        # mongomock cannot run the UpdateOne of this pymongo version
+        for op in ops:
+            if isinstance(op, UpdateOne):
+                collection.update_one(op._filter, op._doc)
+            else:
+                bulk_write([op], ordered=ordered)
+
+    collection.bulk_write = bulk_write_
+    monkeypatch.setattr(
+        configs, "pymongo", SimpleNamespace(db=SimpleNamespace(assessments=collection))
+    )
+    return collection
+
+
+class TestDiffUpdate:
+    """
+    Tests the partial update made by Assessment.save
+    """
+
+    old = {
+        "user_input": {"topic": "Algebra", "pdfs": []},
+        "questions": [
+            {"question_type": "MCQ", "options": ["1", "2"], "correct_answer": 0},
+            {"question_type": "Short Answer", "sample_answer": "a", "extra": 1},
+        ],
+        "last_modified": "2024-01-01 00:00:00",
+    }
+
+    def diff(self, new):
+        """
+        Returns the update that turns self.old into new
+        """
+        update = {"$set": {}, "$unset": {}}
+        assessment_module._diff_update(self.old, new, "", update)
+        return update
+
+    def test_targeted_paths(self):
+        """
+        Test that only the changed fields and list elements are set or unset
+        """
+        new = json.loads(json.dumps(self.old))
+        new["questions"][0]["options"][1] = "3"
+        del new["questions"][1]["extra"]
+        new["last_modified"] = "2024-01-02 00:00:00"
+        assert self.diff(new) == {
+            "$set": {
+                "questions.0.options.1": "3",
+                "last_modified": "2024-01-02 00:00:00",
+            },
+            "$unset": {"questions.1.extra": ""},
+        }
+
+    def test_resized_list(self):
+        """
+        Test that a list that changed length is set as a whole
+        """
+        new = json.loads(json.dumps(self.old))
+        new["questions"].pop()
+        new["user_input"]["pdfs"].append("notes.pdf")
+        assert self.diff(new) == {
+            "$set": {
+                "questions": new["questions"],
+                "user_input.pdfs": ["notes.pdf"],
+            },
+            "$unset": {},
+        }
+
+    def test_base_version_from_request(self):
+        """
+        Test that the version the client edited is kept for the conflict check
+        """
+        assessment = Assessment.from_request_json(
+            request_json(_id={"$oid": str(ObjectId())}, version=3)
+        )
+        assert assessment._base_version == 3
+        for version in ("3", True):
+            with pytest.raises(UserInputError):
+                Assessment.from_request_json(request_json(version=version))
+
+    def test_versioned_update(self):
+        """
+        Test that an update matches the version it is based on, and increments
+        it
+        """
+        _id = ObjectId()
+        assessment = Assessment.from_request_json(
+            request_json(_id={"$oid": str(_id)}, version=3)
+        )
+        saved = assessment.to_dict(with_id=False)
+        saved["questions"][0]["sample_answer"] = "b"
+
+        query, update, doc = assessment._make_update(saved)
+        assert query == {"_id": _id, "version": 3}
+        assert update["$set"]["questions.0.sample_answer"] == "a"
+        assert update["$inc"] == {"version": 1}
+        assert assessment.version == doc["version"] == 4
+
+        with pytest.raises(ConflictError):
+            assessment._make_update({**saved, "version": 5})
+
+    def test_save(self, assessments_db):
+        """
+        Test saving and overwriting in the db
+        """
+        collection = assessments_db
+        assessment = Assessment.from_request_json(request_json())
+        assessment.save()
+        assert collection.find_one()["version"] == assessment.version == 1
+
+        edited = request_json(_id={"$oid": str(assessment.get_id())}, version=1)
+        edited["questions"][0]["sample_answer"] = "b"
+        Assessment.from_request_json(edited).save()
+        assert collection.find_one()["version"] == 2
+
+        # the same edit of version 1 again conflicts, since version 2 is stored
+        with pytest.raises(ConflictError):
+            Assessment.from_request_json(edited).save()
+
+        edited["_id"] = {"$oid": str(ObjectId())}
+        with pytest.raises(UserInputError):
+            Assessment.from_request_json(edited).save()
+
+    def test_save_sets_changed_fields(self, assessments_db, monkeypatch):
+        """
+        Test that saving an edit of one option only sets that option, instead
+        of the whole document
+        """
+        collection = assessments_db
+        question = {
+            "question_type": "MCQ",
+            "question": "Pick one",
+            "options": ["A", "B", "C"],
+            "correct_answer": 0,
+        }
+        assessment = Assessment.from_request_json(request_json(questions=[question]))
+        assessment.save()
+
+        updates = []
+        update_one = collection.update_one
+
+        def spy(query, update):
+            updates.append(update)
+            return update_one(query, update)
+
+        monkeypatch.setattr(collection, "update_one", spy)
+        question["options"][1] = "D"
+        edited = request_json(
+            _id={"$oid": str(assessment.get_id())}, version=1, questions=[question]
+        )
+        Assessment.from_request_json(edited).save()
+        # last_modified is also set, unless the save took less than a second
+        assert set(updates[0]["$set"]) - {"last_modified"} == {"questions.0.options.1"}
+        assert updates[0]["$set"]["questions.0.options.1"] == "D"
+        assert collection.find_one()["questions"][0]["options"] == ["A", "D", "C"]
+
+
+class TestBulkHelpers:
+    """
+    Tests the helpers of the bulk save and delete functions, that do not
+    need the DB
+    """
+
+    def test_batch_size(self, monkeypatch):
+        """
+        Test that empty, non list and too large batches are rejected
+        """
+        monkeypatch.setattr(assessment_module, "BULK_MAX_BATCH", 2)
+        assessment_module._check_bulk_items([1, 2])
+        for items in ([], None, {"ids": []}, [1, 2, 3]):
+            with pytest.raises(UserInputError):
+                assessment_module._check_bulk_items(items)
+
+    def test_item_error(self):
+        """
+        Test that item errors have the format of error responses
+        """
+        assert assessment_module._bulk_item_error(UserInputError("bad")) == {
+            "status": "failed",
+            "error": {"error": "Invalid form input", "message": "bad", "code": 400},
+        }
+
+    def test_delete_repeated_id(self, monkeypatch):
+        """
+        Test that a repeated ID is only deleted once, and reported as already
+        deleted after that
+        """
+        _id = ObjectId()
+        collection = SimpleNamespace(find=lambda query, projection: [{"_id": _id}])
+        monkeypatch.setattr(
+            configs,
+            "pymongo",
+            SimpleNamespace(db=SimpleNamespace(assessments=collection)),
+        )
+        deleted = []
+
+        def run_bulk_write(ops, op_items, results, ordered):
+            deleted.extend(i._filter["_id"] for i in ops)
+            return set(op_items)
+
+        monkeypatch.setattr(assessment_module, "_run_bulk_write", run_bulk_write)
+        results = assessment_module.bulk_delete_assessments(
+            [str(_id), {"$oid": str(_id)}], ordered=False
+        )
+
+        assert deleted == [_id]
+        assert results[0] == {"index": 0, "status": "ok", "_id": _id}
+        assert results[1]["status"] == "failed"
+        assert results[1]["error"]["message"] == (
+            "Assessment not found or already deleted."
+        )
+
+
+class TestBulkSave:
+    """
+    Tests bulk_save_assessments function
+    """
+
+    def test_insert_and_update(self, assessments_db):
+        """
+        Test that new assessments are inserted and the others updated
+        """
+        existing = Assessment.from_request_json(request_json())
+        existing.save()
+        edited = request_json(_id={"$oid": str(existing.get_id())}, version=1)
+        edited["questions"][0]["question"] = "Edited?"
+
+        results = assessment_module.bulk_save_assessments([request_json(), edited])
+        assert [(i["status"], i["version"]) for i in results] == [("ok", 1), ("ok", 2)]
+        assert results[1]["_id"] == existing.get_id()
+        stored = assessments_db.find_one({"_id": existing.get_id()})
+        assert stored["questions"][0]["question"] == "Edited?"
+        assert assessments_db.count_documents({}) == 2
+
+    def test_conflict(self, assessments_db, monkeypatch):
+        """
+        Test that an update that someone else saved over between reading the
+        stored assessments and writing them fails, and its edit is not added
+        to the question bank
+        """
+        existing = Assessment.from_request_json(request_json())
+        existing.save()
+        _id = {"$oid": str(existing.get_id())}
+        bulk_write = assessments_db.bulk_write
+
+        def bulk_write_(ops, ordered=True):
+            other = request_json(_id=_id, version=1)
+            other["questions"][0]["question"] = "Other writer?"
+            Assessment.from_request_json(other).save()
+            bulk_write(ops, ordered)
+
+        assessments_db.bulk_write = bulk_write_
+        banked = []
+        monkeypatch.setattr(assessment_module, "add_assessments", banked.extend)
+        edited = request_json(_id=_id, version=1)
+        edited["questions"][0]["question"] = "Lost edit?"
+
+        results = assessment_module.bulk_save_assessments([edited])
+        assert results[0]["status"] == "failed"
+        assert results[0]["error"]["code"] == ConflictError.code
+        stored = assessments_db.find_one({"_id": existing.get_id()})
+        assert stored["questions"][0]["question"] == "Other writer?"
+        assert all(i["questions"][0]["question"] != "Lost edit?" for i in banked)
+
+    def test_not_found_and_ordered(self, assessments_db):
+        """
+        Test that an unknown assessment fails, and that the items after it
+        are only skipped in an ordered request
+        """
+        missing = request_json(_id={"$oid": str(ObjectId())})
+        results = assessment_module.bulk_save_assessments([missing, request_json()])
+        assert results[0]["status"] == "failed"
+        assert results[0]["error"]["message"] == (
+            "Assessment not found or already deleted."
+        )
+        assert results[1] == {"index": 1, "status": "skipped"}
+        assert assessments_db.count_documents({}) == 0
+
+        results = assessment_module.bulk_save_assessments(
+            [missing, request_json()], ordered=False
+        )
+        assert [i["status"] for i in results] == ["failed", "ok"]
+        assert assessments_db.count_documents({}) == 1
+
+
+class TestDedupeQuestions:
+    """
+    A group of tests that test which questions are treated as duplicates
+    """
+
+    @staticmethod
+    def mcq(question: str, options: list[str]):
+        """
+        Returns an MCQ question object
+        """
+        return QuestionMCQ(
+            {"question": question, "options": options, "correct_answer": 0}
+        )
+
+    def test_text(self):
+        """
+        Test that case, whitespace and punctuation are ignored, but other
+        symbols are not
+        """
+        questions = make_questions(
+            [
+                {"question_type": "Short Answer", "question": q, "sample_answer": "a"}
+                for q in ["What is 2+2?", "what is 2 + 2", "What is 2*2?"]
+            ]
+        )
+        deduped = assessment_module._dedupe_questions(questions)
+        assert [i.question for i in deduped] == ["What is 2+2?", "What is 2*2?"]
+
+    def test_mcq_options(self):
+        """
+        Test that MCQs with the same text are only duplicates if they have the
+        same options
+        """
+        questions = [
+            self.mcq("Pick one", ["A", "B"]),
+            self.mcq("Pick one", ["C", "D"]),
+            self.mcq("Pick one.", ["b", "a"]),
+        ]
+        deduped = assessment_module._dedupe_questions(questions)
+        assert deduped == questions[:2]
+
+
+class TestBatchedGeneration:
+    """
+    A group of tests that test generation of many questions in batches, with
+    a fake LLM
+    """
+
+    @staticmethod
+    def fake_llm(calls: list, fail_once: set):
+        """
+        Returns a fake get_prompt_response, that generates as many questions as
+        the prompt asks for. Parts in fail_once fail on their first call. Every
+        part has one question in common with the others, and top ups (part 0)
+        have none.
+        """
+
+        def get_prompt_response(prompt: str, use_cache: bool = True):
+            num = int(re.search(r"Generate (\d+)", prompt)[1])
+            part = (
+                int(match[1]) if (match := re.search(r"part (\d+) of", prompt)) else 0
+            )
+            calls.append((part, use_cache))
+            if part in fail_once:
+                fail_once.remove(part)
+                return "not json"
+
+            if part == 0:
+                return json.dumps(
+                    [
+                        {
+                            "question_type": "Short Answer",
+                            "question": q,
+                            "sample_answer": "a",
+                        }
+                        for q in [f"Top up question {i}?" for i in range(num)]
+                    ]
+                )
+
+            questions = [
+                {"question_type": "Short Answer", "question": q, "sample_answer": "a"}
+                for q in [f"Part {part} question {i}?" for i in range(num - 1)]
+                + ["A common question?"]
+            ]
+            return json.dumps(questions)
+
+        return get_prompt_response
+
+    def test_batches_merged(self, monkeypatch):
+        """
+        Test that batches are merged in order and de-duplicated, and that the
+        removed duplicates are topped up
+        """
+        calls = []
+        monkeypatch.setattr(assessment_module, "GENERATION_BATCH_SIZE", 4)
+        monkeypatch.setattr(
+            assessment_module, "get_prompt_response", self.fake_llm(calls, set())
+        )
+        user_input = UserInput("History", "SA", 10, [])
+        assessment = Assessment.from_user_input(user_input)
+
+        # 3 batches of sizes 4, 3, 3, with one duplicate question each, and a
+        # top up of the 2 duplicates
+        assert sorted(calls) == [(0, True), (1, True), (2, True), (3, True)]
+        questions = [i.question for i in assessment.questions]
+        assert len(questions) == 10
+        assert questions[:4] == [
+            "Part 1 question 0?",
+            "Part 1 question 1?",
+            "Part 1 question 2?",
+            "A common question?",
+        ]
+        assert questions[-2:] == ["Top up question 0?", "Top up question 1?"]
+
+    def test_failed_batch_retried(self, monkeypatch):
+        """
+        Test that only the failed batch is retried, without the cache
+        """
+        calls = []
+        monkeypatch.setattr(assessment_module, "GENERATION_BATCH_SIZE", 4)
+        monkeypatch.setattr(
+            assessment_module, "get_prompt_response", self.fake_llm(calls, {2})
+        )
+        user_input = UserInput("History", "SA", 10, [])
+        assert len(Assessment.from_user_input(user_input).questions) == 10
+        assert sorted(calls) == [(0, True), (1, True), (2, False), (2, True), (3, True)]
+
+    def test_failing_batch(self, monkeypatch):
+        """
+        Test that a batch that keeps failing errors with OutputFormatError
+        """
+        monkeypatch.setattr(assessment_module, "GENERATION_BATCH_SIZE", 4)
+        monkeypatch.setattr(
+            assessment_module,
+            "get_prompt_response",
+            lambda prompt, use_cache=True: "not json",
+        )
+        with pytest.raises(OutputFormatError):
+            Assessment.from_user_input(UserInput("History", "SA", 10, []))
+
+
+class TestStreamQuestions:
+    """
+    A group of tests that test stream_questions function, with a fake LLM
+    """
+
+    @staticmethod
+    def fake_llm(monkeypatch, streamed: list[str], calls: list):
+        """
+        Makes the streamed response hold the short answer questions streamed
+        (sent in small chunks), and top ups return new questions
+        """
+
+        def stream_prompt_response(prompt: str, use_cache: bool = True):
+            text = json.dumps(
+                [
+                    {
+                        "question_type": "Short Answer",
+                        "question": q,
+                        "sample_answer": "a",
+                    }
+                    for q in streamed
+                ]
+            )
+            for i in range(0, len(text), 7):
+                yield text[i : i + 7]
+
+        def get_prompt_response(prompt: str, use_cache: bool = True):
+            num = int(re.search(r"Generate (\d+)", prompt)[1])
+            calls.append(num)
+            return json.dumps(
+                [
+                    {
+                        "question_type": "Short Answer",
+                        "question": q,
+                        "sample_answer": "a",
+                    }
+                    for q in [f"Top up question {i}?" for i in range(num)]
+                ]
+            )
+
+        monkeypatch.setattr(
+            assessment_module, "stream_prompt_response", stream_prompt_response
+        )
+        monkeypatch.setattr(
+            assessment_module, "get_prompt_response", get_prompt_response
+        )
+
+    def test_repeats_and_extra_dropped(self, monkeypatch):
+        """
+        Test that repeated questions are not sent, and that no more than
+        num_questions questions are sent
+        """
+        calls = []
+        self.fake_llm(monkeypatch, ["Why?", "why", "How?", "When?"], calls)
+        questions = stream_questions(UserInput("History", "SA", 2, []))
+        assert [i.question for i in questions] == ["Why?", "How?"]
+        assert not calls
+
+    def test_repeats_topped_up(self, monkeypatch):
+        """
+        Test that repeated questions are topped up once the stream is done
+        """
+        calls = []
+        self.fake_llm(monkeypatch, ["Why?", "why"], calls)
+        questions = stream_questions(UserInput("History", "SA", 2, []))
+        assert [i.question for i in questions] == ["Why?", "Top up question 0?"]
+        assert calls == [1]
+
+
+class TestHistoryCursor:
+    """
+    A group of tests that test encode_history_cursor and decode_history_cursor
+    """
+
+    def test_round_trip(self):
+        """
+        Test that a decoded cursor gives back the sort key of the assessment
+        """
+        _id = ObjectId()
+        cursor = encode_history_cursor(
+            {"_id": _id, "last_modified": "2024-04-20 10:00:00"}
+        )
+        assert isinstance(cursor, str)
+        assert decode_history_cursor(cursor) == ("2024-04-20 10:00:00", _id)
+
+    def test_invalid_cursor(self):
+        """
+        Any invalid cursor should error with UserInputError
+        """
+        for invalid_cursor in ("", "not a cursor", "WzEsIDJd", "WyJhIiwgImIiXQ=="):
+            with pytest.raises(UserInputError):
+                decode_history_cursor(invalid_cursor)
+
+
 if __name__ == "__main__":
     pytest.main()
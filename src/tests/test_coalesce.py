@@ -0,0 +1,152 @@
+"""
+pytest based unit testing for everything in coalesce.py
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+import coalesce as coalesce_module
+import configs
+from coalesce import coalesce, LEASE_DONE, LEASE_RUNNING
+from exceptions import OutputFormatError
+
+
+class TestCoalesce:
+    """
+    Tests coalesce function (within a process, without a db)
+    """
+
+    def test_concurrent_calls_shared(self):
+        """
+        Test that concurrent calls with the same key make one call, and that
+        calls with other keys are not shared
+        """
+        calls = []
+        started = threading.Event()
+
+        def call():
+            calls.append(1)
+            started.set()
+            time.sleep(0.2)
+            return "response"
+
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            leader = executor.submit(coalesce, "key", call)
+            started.wait()
+            followers = [executor.submit(coalesce, "key", call) for _ in range(3)]
+            other = executor.submit(coalesce, "other key", lambda: "other")
+
+            assert leader.result() == "response"
+            assert [i.result() for i in followers] == ["response"] * 3
+            assert other.result() == "other"
+
+        assert len(calls) == 1
+
+    def test_error_shared(self):
+        """
+        Test that an error of the shared call is raised in all callers
+        """
+        started = threading.Event()
+
+        def call():
+            started.set()
+            time.sleep(0.2)
+            raise OutputFormatError("Could not get LLM response")
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            leader = executor.submit(coalesce, "key", call)
+            started.wait()
+            follower = executor.submit(coalesce, "key", call)
+            for future in (leader, follower):
+                with pytest.raises(OutputFormatError):
+                    future.result()
+
+    def test_finished_call_not_reused(self):
+        """
+        Test that a later call with the same key makes a new call
+        """
+        assert coalesce("key", lambda: "first") == "first"
+        assert coalesce("key", lambda: "second") == "second"
+
+
+@pytest.fixture(name="lease_db")
+def fixture_lease_db(monkeypatch):
+    """
+    Enables coalescing across processes with an in memory MongoDB (mongomock,
+    which like MongoDB returns naive UTC datetimes). Returns the collection
+    of leases.
+    """
+    mongomock = pytest.importorskip("mongomock")
+    db = mongomock.MongoClient().db
+    monkeypatch.setattr(configs, "pymongo", SimpleNamespace(db=db))
+    monkeypatch.setattr(coalesce_module, "LLM_COALESCE_POLL_MS", 10)
+    return db.llm_inflight
+
+
+class TestCoalesceProcesses:
+    """
+    Tests coalesce function across processes, with leases in the db
+    """
+
+    def test_leader(self, lease_db):
+        """
+        Test that the leader stores its response, with a UTC expiry
+        """
+        assert coalesce("key", lambda: "response") == "response"
+        lease = lease_db.find_one({"_id": "key"})
+        assert lease["status"] == LEASE_DONE and lease["response"] == "response"
+        expire_at = lease["expire_at"].replace(tzinfo=timezone.utc)
+        ttl = timedelta(seconds=coalesce_module.LEASE_RESULT_TTL)
+        assert abs(expire_at - datetime.now(timezone.utc) - ttl) < timedelta(seconds=5)
+
+    def test_follower(self, lease_db):
+        """
+        Test that a call waits for the lease of another process, and returns
+        its response without calling
+        """
+        lease_until = datetime.now(timezone.utc) + timedelta(seconds=30)
+        lease_db.insert_one(
+            {
+                "_id": "key",
+                "status": LEASE_RUNNING,
+                "owner": "other process",
+                "lease_until": lease_until,
+                "expire_at": lease_until,
+            }
+        )
+
+        def finish():
+            time.sleep(0.1)
+            lease_db.update_one(
+                {"_id": "key"},
+                {"$set": {"status": LEASE_DONE, "response": "shared"}},
+            )
+
+        threading.Thread(target=finish).start()
+        assert coalesce("key", lambda: "own") == "shared"
+
+    def test_expired_lease_taken_over(self, lease_db):
+        """
+        Test that the expired lease of a dead process is taken over
+        """
+        lease_until = datetime.now(timezone.utc) - timedelta(seconds=1)
+        lease_db.insert_one(
+            {
+                "_id": "key",
+                "status": LEASE_RUNNING,
+                "owner": "dead process",
+                "lease_until": lease_until,
+                "expire_at": lease_until,
+            }
+        )
+        assert coalesce("key", lambda: "own") == "own"
+        assert lease_db.find_one({"_id": "key"})["owner"] != "dead process"
+
+
+if __name__ == "__main__":
+    pytest.main()
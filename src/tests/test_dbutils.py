@@ -0,0 +1,95 @@
+"""
+pytest based unit testing for everything in dbutils.py
+"""
+
+import logging
+import time
+
+import pytest
+from prometheus_client import REGISTRY
+
+import dbutils
+from dbutils import explain_summary, timed_query
+
+EXPLAINED = {
+    "queryPlanner": {
+        "winningPlan": {
+            "stage": "LIMIT",
+            "inputStage": {
+                "stage": "FETCH",
+                "inputStage": {"stage": "IXSCAN", "indexName": "history"},
+            },
+        }
+    },
+    "executionStats": {"nReturned": 21, "totalDocsExamined": 21},
+}
+
+
+class TestExplainSummary:
+    """
+    Tests explain_summary function
+    """
+
+    def test_summary(self):
+        """
+        Test that the plan tree and document counts are summarized
+        """
+        assert explain_summary(EXPLAINED) == (
+            "LIMIT <- FETCH <- IXSCAN(history), examined 21 documents for 21 results"
+        )
+
+    def test_nested_plan(self):
+        """
+        Test the plan format of newer servers
+        """
+        explained = {
+            "queryPlanner": {"winningPlan": {"queryPlan": {"stage": "COLLSCAN"}}}
+        }
+        assert explain_summary(explained) == "COLLSCAN"
+
+
+class TestTimedQuery:
+    """
+    Tests timed_query function
+    """
+
+    def test_slow_query_logged(self, monkeypatch, caplog):
+        """
+        Test that a slow query is logged with its plan
+        """
+        monkeypatch.setattr(dbutils, "SLOW_QUERY_MS", 0)
+        with caplog.at_level(logging.WARNING, logger="dbutils"):
+            with timed_query("assessments.find", lambda: EXPLAINED):
+                pass
+
+        assert "Slow query assessments.find" in caplog.text
+        assert "IXSCAN(history)" in caplog.text
+
+    def test_fast_query_not_logged(self, monkeypatch, caplog):
+        """
+        Test that queries under the threshold are not logged or explained
+        """
+        explained = []
+        monkeypatch.setattr(dbutils, "SLOW_QUERY_MS", 1000)
+        with caplog.at_level(logging.WARNING, logger="dbutils"):
+            with timed_query("assessments.find", lambda: explained.append(1) or {}):
+                pass
+
+        assert not caplog.text
+        assert not explained
+
+    def test_query_metrics(self):
+        """
+        Test that every query is recorded in the query metrics
+        """
+        labels = {"query": "jobs.find"}
+        before = REGISTRY.get_sample_value("db_query_duration_seconds_sum", labels)
+        with timed_query("jobs.find"):
+            time.sleep(0.01)
+
+        after = REGISTRY.get_sample_value("db_query_duration_seconds_sum", labels)
+        assert after - (before or 0) >= 0.01
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,138 @@
+"""
+pytest based unit testing for everything in dedup.py
+"""
+
+import numpy as np
+import pytest
+
+import assessment as assessment_module
+import dedup
+from assessment import make_questions
+from dedup import (
+    band_keys,
+    exact_tokens,
+    find_duplicates,
+    question_text,
+    signatures,
+    similarity,
+)
+
+TEXTS = [
+    "Describe the causes of World War II.",
+    "What is the capital of France?",
+    "Describe the main causes of World War II.",
+    "Explain photosynthesis in plants.",
+    "describe the causes of world war ii",
+]
+
+
+class TestQuestionText:
+    """
+    Tests question_text and exact_tokens functions
+    """
+
+    def test_question_text(self):
+        """
+        Test that options, the correct answer and sample answers are compared
+        """
+        mcq = {
+            "question_type": "MCQ",
+            "question": "Pick one",
+            "options": ["A", "B"],
+            "correct_answer": 1,
+        }
+        assert question_text(mcq) == "Pick one\nA\nB\nB"
+        assert question_text({**mcq, "correct_answer": 5}) == "Pick one\nA\nB"
+        short = {
+            "question_type": "Short Answer",
+            "question": "Why?",
+            "sample_answer": "a",
+        }
+        assert question_text(short) == "Why?\na"
+
+    def test_exact_tokens(self):
+        """
+        Test that only the tokens with digits or symbols are kept, sorted
+        """
+        assert exact_tokens("In 1939 (not 1914), why?") == "( ) 1914 1939"
+        assert exact_tokens("Why?") == ""
+
+
+class TestSignatures:
+    """
+    Tests signatures, band_keys and similarity functions
+    """
+
+    def test_batched(self, monkeypatch):
+        """
+        Test that a signature does not depend on the other texts hashed with
+        it, or on the chunk it was hashed in
+        """
+        monkeypatch.setattr(dedup, "SIGNATURE_CHUNK", 2)
+        sigs = signatures(TEXTS + ["", "Q?"])
+        assert sigs.shape == (len(TEXTS) + 2, dedup.NUM_PERM)
+        for i, text in enumerate(TEXTS):
+            assert (signatures([text])[0] == sigs[i]).all()
+
+    def test_similarity(self):
+        """
+        Test that similar texts have similar signatures and share band keys
+        """
+        sigs = signatures(TEXTS)
+        assert similarity(sigs[0], sigs[4]) == 1
+        assert similarity(sigs[0], sigs[2]) > 0.6
+        assert similarity(sigs[0], sigs[3]) < 0.2
+
+        keys = band_keys(sigs)
+        assert keys.dtype == np.int64 and keys.shape == (len(TEXTS), dedup.BANDS)
+        assert set(keys[0]) & set(keys[2])
+        assert not set(keys[0]) & set(keys[3])
+
+
+class TestFindDuplicates:
+    """
+    Tests find_duplicates function, and its use in the Assessment class
+    """
+
+    def test_find_duplicates(self):
+        """
+        Test that near-duplicates point to the first copy
+        """
+        assert find_duplicates(TEXTS, 0.7) == [None, None, 0, None, 0]
+        assert find_duplicates(TEXTS, 1) == [None, None, None, None, 0]
+        assert not find_duplicates([])
+
+    def test_different_numbers(self):
+        """
+        Test that similar questions with different numbers are not
+        near-duplicates
+        """
+        texts = [
+            "What is the derivative of x^2?\n2x",
+            "What is the derivative of x^3?\n3x^2",
+            "When did WWI begin?\n1914",
+            "When did WWII begin?\n1939",
+        ]
+        assert similarity(*signatures(texts[:2])) > 0.5
+        assert find_duplicates(texts, 0.5) == [None] * 4
+
+    def test_dedupe_questions(self, monkeypatch):
+        """
+        Test that near-duplicate questions are only dropped when enabled
+        """
+        questions = make_questions(
+            [
+                {"question_type": "Short Answer", "question": i, "sample_answer": "a"}
+                for i in TEXTS
+            ]
+        )
+        deduped = assessment_module._dedupe_questions(questions)
+        assert len(deduped) == 4
+
+        monkeypatch.setattr(dedup, "DEDUP_THRESHOLD", 0.7)
+        deduped = assessment_module._dedupe_questions(questions)
+        assert [i.question for i in deduped] == [TEXTS[i] for i in (0, 1, 3)]
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -4,7 +4,13 @@ pytest based unit testing for everything in exceptions.py
 
 import pytest
 
-from exceptions import OutputFormatError, UserInputError, DBError
+from exceptions import (
+    ConflictError,
+    DBError,
+    OutputFormatError,
+    ServiceBusyError,
+    UserInputError,
+)
 
 
 class TestUserInputError:
@@ -68,5 +74,45 @@ class TestDBError:
         assert exc.args == ("hello",)
 
 
+class TestServiceBusyError:
+    """
+    A group of tests that test ServiceBusyError
+    """
+
+    def test_exception(self):
+        """
+        Test that ServiceBusyError is an Exception type
+        """
+        assert issubclass(ServiceBusyError, Exception)
+
+    def test_attributes(self):
+        """
+        Test that ServiceBusyError has expected attributes
+        """
+        exc = ServiceBusyError("hello")
+        assert exc.code == 503
+        assert exc.args == ("hello",)
+
+
+class TestConflictError:
+    """
+    A group of tests that test ConflictError
+    """
+
+    def test_exception(self):
+        """
+        Test that ConflictError is an Exception type
+        """
+        assert issubclass(ConflictError, Exception)
+
+    def test_attributes(self):
+        """
+        Test that ConflictError has expected attributes
+        """
+        exc = ConflictError("hello")
+        assert exc.code == 409
+        assert exc.args == ("hello",)
+
+
 if __name__ == "__main__":
     pytest.main()
@@ -0,0 +1,246 @@
+"""
+pytest based unit testing for everything in extraction.py
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import extraction
+from extraction import cache_key, file_digest, ExtractionCache
+
+
+@pytest.fixture(name="fake_extractor")
+def fixture_fake_extractor(tmp_path, monkeypatch):
+    """
+    Runs extractions in threads of this process, so that the extractor can be
+    replaced by a function of the test. Returns a function that sets it.
+    """
+    pool = ThreadPoolExecutor(max_workers=4)
+    monkeypatch.setattr(extraction, "_get_process_pool", lambda: pool)
+    monkeypatch.setattr(
+        extraction, "extraction_cache", ExtractionCache(tmp_path / "c", 1 << 20)
+    )
+    monkeypatch.setattr(extraction, "UPLOADS_BASE", tmp_path)
+    monkeypatch.setattr(extraction, "_extracting", {})
+
+    def set_extractor(func):
+        monkeypatch.setattr(extraction, "_textract_process", func)
+
+    yield set_extractor
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+class TestCacheKey:
+    """
+    A group of tests that test file_digest and cache_key
+    """
+
+    def test_content_addressed(self, tmp_path):
+        """
+        Files with the same contents must have the same key, irrespective of
+        their names
+        """
+        first = tmp_path / "first.pdf"
+        second = tmp_path / "second.pdf"
+        third = tmp_path / "third.pdf"
+        first.write_bytes(b"same contents")
+        second.write_bytes(b"same contents")
+        third.write_bytes(b"other contents")
+
+        assert file_digest(first) == file_digest(second)
+        assert cache_key(first) == cache_key(second)
+        assert cache_key(first) != cache_key(third)
+
+    def test_settings_in_key(self, tmp_path, monkeypatch):
+        """
+        Changing extractor settings must change the key
+        """
+        file = tmp_path / "file.pdf"
+        file.write_bytes(b"contents")
+        old_key = cache_key(file)
+        monkeypatch.setitem(extraction.EXTRACTOR_SETTINGS, "layout", True)
+        assert cache_key(file) != old_key
+
+
+class TestExtractionCache:
+    """
+    A group of tests that test ExtractionCache
+    """
+
+    def test_get_put(self, tmp_path):
+        """
+        Test that get returns what was put, and hits/misses are counted
+        """
+        cache = ExtractionCache(tmp_path, 1 << 20)
+        assert cache.get("key") is None
+        cache.put("key", "some text")
+        assert cache.get("key") == "some text"
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+        assert cache.stats()["entries"] == 1
+
+    def test_lru_eviction(self, tmp_path):
+        """
+        Test that the least recently used entry is evicted first
+        """
+        cache = ExtractionCache(tmp_path, 25)
+        cache.put("first", "a" * 10)
+        cache.put("second", "b" * 10)
+        assert cache.get("first") == "a" * 10
+
+        # this needs one entry to be evicted, and 'second' is the oldest
+        cache.put("third", "c" * 10)
+        assert cache.get("second") is None
+        assert cache.get("first") == "a" * 10
+        assert cache.get("third") == "c" * 10
+        assert cache.stats()["bytes"] <= 25
+
+
+class TestExtractText:
+    """
+    Tests extract_text function
+    """
+
+    def test_extracts_once(self, tmp_path, fake_extractor):
+        """
+        Test that the same file contents are only extracted once
+        """
+        calls = []
+
+        def fake_process(path):
+            calls.append(path)
+            return "extracted text"
+
+        fake_extractor(fake_process)
+
+        first = tmp_path / "first.pdf"
+        second = tmp_path / "second.pdf"
+        first.write_bytes(b"handout")
+        second.write_bytes(b"handout")
+
+        assert extraction.extract_text(first) == "extracted text"
+        assert extraction.extract_text(second) == "extracted text"
+        assert len(calls) == 1
+
+    def test_timeout(self, tmp_path, fake_extractor, monkeypatch):
+        """
+        Test that a stuck extraction times out, and that its text is still
+        cached once it finishes
+        """
+        release = threading.Event()
+
+        def fake_process(_):
+            release.wait(5)
+            return "late text"
+
+        fake_extractor(fake_process)
+        monkeypatch.setattr(extraction, "EXTRACTION_TIMEOUT", 0.1)
+        file = tmp_path / "slow.pdf"
+        file.write_bytes(b"handout")
+
+        with pytest.raises(TimeoutError):
+            extraction.extract_text(file)
+
+        release.set()
+        extraction._get_process_pool().shutdown(wait=True)
+        assert extraction.extraction_cache.get(extraction.cache_key(file)) == (
+            "late text"
+        )
+
+    def test_timeout_reuses_extraction(self, tmp_path, fake_extractor, monkeypatch):
+        """
+        Test that a call after a timeout waits for the extraction in flight,
+        instead of starting another one
+        """
+        calls = []
+        release = threading.Event()
+
+        def fake_process(path):
+            calls.append(path)
+            release.wait(5)
+            return "late text"
+
+        fake_extractor(fake_process)
+        monkeypatch.setattr(extraction, "EXTRACTION_TIMEOUT", 0.1)
+        file = tmp_path / "slow.pdf"
+        file.write_bytes(b"handout")
+
+        for _ in range(2):
+            with pytest.raises(TimeoutError):
+                extraction.extract_text(file)
+
+        release.set()
+        assert extraction.extract_text(file) == "late text"
+        assert len(calls) == 1
+
+
+class TestBackgroundExtraction:
+    """
+    Tests queue_extraction and get_upload_text functions
+    """
+
+    def test_waits_for_queued_extraction(self, tmp_path, fake_extractor):
+        """
+        Test that get_upload_text waits for a queued extraction instead of
+        extracting again
+        """
+        calls = []
+        started = threading.Event()
+        release = threading.Event()
+
+        def fake_process(path):
+            calls.append(path)
+            started.set()
+            release.wait(5)
+            return "extracted text"
+
+        fake_extractor(fake_process)
+        (tmp_path / "upload.pdf").write_bytes(b"handout")
+
+        assert extraction.queue_extraction("upload.pdf")
+        assert started.wait(5)
+        threading.Timer(0.1, release.set).start()
+        assert extraction.get_upload_text("upload.pdf") == "extracted text"
+        assert len(calls) == 1
+
+    def test_failed_extraction_is_retried(self, tmp_path, fake_extractor):
+        """
+        Test that an error in the background is raised again on use
+        """
+
+        def fake_process(_):
+            raise OSError("pdftotext failed")
+
+        fake_extractor(fake_process)
+        (tmp_path / "upload.pdf").write_bytes(b"handout")
+
+        extraction.queue_extraction("upload.pdf")
+        with pytest.raises(OSError):
+            extraction.get_upload_text("upload.pdf")
+
+    def test_failure_isolation(self, tmp_path, fake_extractor):
+        """
+        Test that get_upload_texts returns None for a file that could not be
+        extracted, and the text of the others
+        """
+
+        def fake_process(path):
+            if path.endswith("bad.pdf"):
+                raise OSError("pdftotext failed")
+            return f"text of {path.rsplit('/', 1)[-1]}"
+
+        fake_extractor(fake_process)
+        for name in ("first.pdf", "bad.pdf", "second.pdf"):
+            (tmp_path / name).write_bytes(name.encode())
+
+        assert extraction.get_upload_texts(["first.pdf", "bad.pdf", "second.pdf"]) == [
+            "text of first.pdf",
+            None,
+            "text of second.pdf",
+        ]
+
+
+if __name__ == "__main__":
+    pytest.main()
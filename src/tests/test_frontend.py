@@ -0,0 +1,82 @@
+"""
+pytest based unit testing for everything in frontend.py
+"""
+
+import os
+
+import pytest
+
+import frontend
+
+
+@pytest.fixture(name="frontend_dir")
+def fixture_frontend_dir(tmp_path, monkeypatch):
+    """
+    Makes a fake frontend folder with a build, and points frontend.py to it
+    """
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src" / "App.js").write_text("app")
+    (tmp_path / "package.json").write_text("{}")
+    (tmp_path / "node_modules").mkdir()
+    (tmp_path / "node_modules" / "dep.js").write_text("dep")
+    (tmp_path / "build").mkdir()
+    monkeypatch.setattr(frontend, "FRONTEND_BASE", tmp_path)
+    monkeypatch.setattr(frontend, "FRONTEND_BUILD", tmp_path / "build")
+    monkeypatch.setattr(
+        frontend, "MANIFEST_PATH", tmp_path / "build" / ".inputs-manifest.json"
+    )
+    frontend.save_manifest()
+    return tmp_path
+
+
+class TestStaleness:
+    """
+    Tests changed_inputs and is_stale functions
+    """
+
+    def test_up_to_date(self, frontend_dir):
+        """
+        Test that a fresh build is not stale, and node_modules is ignored
+        """
+        (frontend_dir / "node_modules" / "dep.js").write_text("new dep")
+        assert not frontend.is_stale()
+
+    def test_touched_but_unchanged(self, frontend_dir):
+        """
+        Test that a file whose modification time changed, but whose contents
+        did not, does not make the build stale
+        """
+        path = frontend_dir / "src" / "App.js"
+        os.utime(path, ns=(1, 1))
+        assert not frontend.changed_inputs(frontend.load_manifest())
+
+    def test_changes(self, frontend_dir):
+        """
+        Test that changed, added and removed files are reported
+        """
+        (frontend_dir / "src" / "App.js").write_text("changed app")
+        (frontend_dir / "src" / "New.js").write_text("new")
+        (frontend_dir / "package.json").unlink()
+        assert sorted(frontend.changed_inputs(frontend.load_manifest())) == [
+            "package.json",
+            "src/App.js",
+            "src/New.js",
+        ]
+        assert frontend.is_stale()
+
+    def test_missing_manifest(self, frontend_dir):
+        """
+        Test that a build without a manifest is adopted only if it is newer
+        than its inputs
+        """
+        frontend.MANIFEST_PATH.unlink()
+        os.utime(frontend_dir / "build", ns=(1, 1))
+        assert frontend.is_stale()
+
+        os.utime(frontend_dir / "build")
+        assert not frontend.is_stale()
+        assert frontend.load_manifest() is not None
+
+
+if __name__ == "__main__":
+    pytest.main()
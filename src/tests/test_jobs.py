@@ -0,0 +1,205 @@
+"""
+pytest based unit testing for everything in jobs.py.
+Jobs are stored in the DB, so the tests of running jobs use an in memory
+MongoDB (mongomock), and are skipped if it is not installed.
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from bson.objectid import ObjectId
+from werkzeug.exceptions import NotFound
+
+import jobs
+from assessment import Assessment
+from exceptions import DBError, OutputFormatError, ServiceBusyError
+from userinput import UserInput
+
+
+@pytest.fixture(name="jobs_db")
+def fixture_jobs_db(monkeypatch):
+    """
+    Stores jobs in an in memory MongoDB, and returns the jobs collection
+    """
+    mongomock = pytest.importorskip("mongomock")
+    collection = mongomock.MongoClient().db.jobs
+
+    def find_one_or_404(job_id):
+        doc = collection.find_one(job_id)
+        if doc is None:
+            raise NotFound()
+        return doc
+
+    # the method flask_pymongo adds to its collections
+    collection.find_one_or_404 = find_one_or_404
+    monkeypatch.setattr(jobs, "_jobs_collection", lambda: collection)
+    return collection
+
+
+class TestSubmitGeneration:
+    """
+    Tests submit_generation function
+    """
+
+    def test_queue_full(self, monkeypatch):
+        """
+        Test that a full queue is reported with ServiceBusyError
+        """
+        monkeypatch.setattr(jobs, "_queue_slots", threading.BoundedSemaphore(1))
+        jobs._queue_slots.acquire()
+        with pytest.raises(ServiceBusyError):
+            jobs.submit_generation(UserInput("Algebra", "MCQ", 5, []))
+
+    def test_slot_released_on_error(self, monkeypatch):
+        """
+        Test that a job that could not be queued does not take a queue slot
+        """
+        monkeypatch.setattr(jobs, "_queue_slots", threading.BoundedSemaphore(1))
+        for _ in range(2):
+            with pytest.raises(DBError):
+                jobs.submit_generation(UserInput("Algebra", "MCQ", 5, []))
+
+
+class TestRunGeneration:
+    """
+    Tests running a submitted job, and polling it with get_job
+    """
+
+    def test_done(self, jobs_db, monkeypatch):
+        """
+        Test that a job moves to done, with the id of the saved assessment
+        """
+        saved = []
+
+        def from_user_input(user_input, use_cache=True, progress=None):
+            progress("generating")
+            ret = Assessment(user_input=user_input, questions=[])
+            monkeypatch.setattr(ret, "save", lambda: saved.append(ret))
+            monkeypatch.setattr(ret, "get_id", lambda: "assessment id")
+            return ret
+
+        monkeypatch.setattr(Assessment, "from_user_input", from_user_input)
+        job_id = jobs.submit_generation(UserInput("Algebra", "MCQ", 5, []))
+        job = jobs.get_job(job_id, wait=5)
+
+        assert job["status"] == jobs.JOB_DONE and len(saved) == 1
+        assert jobs.job_response(job) == {
+            "job_id": job_id,
+            "status": jobs.JOB_DONE,
+            "stage": jobs.JOB_DONE,
+            "assessment_id": "assessment id",
+            "last_modified": saved[0].last_modified,
+            "version": None,
+            "error": None,
+        }
+
+    def test_failed(self, jobs_db, monkeypatch):
+        """
+        Test that a failed job reports the error like the synchronous
+        endpoints do
+        """
+
+        def from_user_input(*_args):
+            raise OutputFormatError("LLM sent invalid json response")
+
+        monkeypatch.setattr(Assessment, "from_user_input", from_user_input)
+        job_id = jobs.submit_generation(UserInput("Algebra", "MCQ", 5, []))
+        response = jobs.job_response(jobs.get_job(job_id, wait=5))
+
+        assert response["status"] == jobs.JOB_FAILED
+        assert response["assessment_id"] is None
+        assert response["error"] == {
+            "error": OutputFormatError.description,
+            "message": "LLM sent invalid json response",
+            "code": OutputFormatError.code,
+        }
+
+    def test_poll_returns_at_once(self, jobs_db):
+        """
+        Test that polling an unfinished job without wait returns right away,
+        and that unknown jobs are not found
+        """
+        job_id = jobs_db.insert_one(
+            {
+                "status": jobs.JOB_QUEUED,
+                "stage": jobs.JOB_QUEUED,
+                "updated": datetime.now(timezone.utc),
+            }
+        ).inserted_id
+        start = time.monotonic()
+        response = jobs.job_response(jobs.get_job(job_id))
+        assert time.monotonic() - start < 0.5
+        assert response["status"] == response["stage"] == jobs.JOB_QUEUED
+
+        with pytest.raises(NotFound):
+            jobs.get_job(ObjectId())
+
+
+class TestStaleJobs:
+    """
+    Tests that only the jobs of a dead worker are reported lost
+    """
+
+    @staticmethod
+    def make_stale(jobs_db, job_id: ObjectId):
+        """
+        Makes the job look like it was last refreshed longer than
+        JOB_STALE_TIMEOUT ago
+        """
+        updated = datetime.now(timezone.utc) - timedelta(
+            seconds=jobs.JOB_STALE_TIMEOUT + 1
+        )
+        jobs_db.update_one({"_id": job_id}, {"$set": {"updated": updated}})
+
+    def test_heartbeat(self, jobs_db, monkeypatch):
+        """
+        Test that the heartbeat keeps the jobs of this process alive, and that
+        the other stale jobs are reported lost
+        """
+        live, lost = jobs_db.insert_many(
+            [{"status": jobs.JOB_QUEUED, "stage": jobs.JOB_QUEUED} for _ in range(2)]
+        ).inserted_ids
+        for job_id in (live, lost):
+            self.make_stale(jobs_db, job_id)
+
+        monkeypatch.setattr(jobs, "_live_jobs", {live})
+        jobs._heartbeat()
+
+        assert jobs.get_job(live)["status"] == jobs.JOB_QUEUED
+        job = jobs.get_job(lost)
+        assert job["status"] == jobs.JOB_FAILED
+        assert job["error"]["error"] == "Job lost"
+
+    def test_lost_job_not_overwritten(self, jobs_db, monkeypatch):
+        """
+        Test that a job that was reported lost while it was running stays
+        failed when it finishes
+        """
+        job_id = jobs_db.insert_one(
+            {"status": jobs.JOB_QUEUED, "stage": jobs.JOB_QUEUED}
+        ).inserted_id
+
+        def from_user_input(user_input, use_cache=True, progress=None):
+            self.make_stale(jobs_db, job_id)
+            assert jobs.get_job(job_id)["status"] == jobs.JOB_FAILED
+            progress("generating")
+            ret = Assessment(user_input=user_input, questions=[])
+            monkeypatch.setattr(ret, "save", lambda: None)
+            return ret
+
+        monkeypatch.setattr(Assessment, "from_user_input", from_user_input)
+        monkeypatch.setattr(jobs, "_queue_slots", threading.BoundedSemaphore(1))
+        jobs._queue_slots.acquire()
+        # run the job in this thread
+        jobs._run_generation(job_id, UserInput("Algebra", "MCQ", 5, []), True)
+
+        job = jobs.get_job(job_id)
+        assert job["status"] == jobs.JOB_FAILED and job["stage"] == "starting"
+        assert job["error"]["error"] == "Job lost"
+        assert "assessment_id" not in job
+
+
+if __name__ == "__main__":
+    pytest.main()
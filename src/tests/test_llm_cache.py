@@ -0,0 +1,119 @@
+"""
+pytest based unit testing for everything in llm_cache.py
+"""
+
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+import configs
+import llm_cache
+
+PAYLOAD = {
+    "inputs": "[INST]Generate 10 MCQ questions on 'Algebra'.[/INST]",
+    "parameters": {"return_full_text": False, "max_new_tokens": 10000},
+}
+
+
+class TestMakeKey:
+    """
+    Tests make_key function
+    """
+
+    def test_whitespace_normalized(self):
+        """
+        Test that whitespace differences in the prompt give the same key
+        """
+        payload = dict(PAYLOAD)
+        payload["inputs"] = "[INST]Generate 10  MCQ questions\n on 'Algebra'.[/INST] "
+        assert llm_cache.make_key("url", payload) == llm_cache.make_key("url", PAYLOAD)
+
+    def test_parameters_in_key(self):
+        """
+        Test that the prompt, parameters and url are all a part of the key
+        """
+        key = llm_cache.make_key("url", PAYLOAD)
+        assert llm_cache.make_key("other url", PAYLOAD) != key
+
+        payload = dict(PAYLOAD)
+        payload["parameters"] = {"return_full_text": False, "max_new_tokens": 100}
+        assert llm_cache.make_key("url", payload) != key
+
+        payload = dict(PAYLOAD)
+        payload["inputs"] = payload["inputs"].replace("10", "20")
+        assert llm_cache.make_key("url", payload) != key
+
+
+class TestWithoutDB:
+    """
+    Tests that the cache is a no-op when there is no database
+    """
+
+    def test_disabled(self):
+        """
+        Test get, put and stats work without a database
+        """
+        assert not llm_cache.is_enabled()
+        llm_cache.put("key", "response")
+        assert llm_cache.get("key") is None
+        assert llm_cache.stats()["enabled"] is False
+
+
+@pytest.fixture(name="cache_db")
+def fixture_cache_db(monkeypatch):
+    """
+    Enables the cache with an in memory MongoDB (mongomock), and returns the
+    db
+    """
+    mongomock = pytest.importorskip("mongomock")
+    db = mongomock.MongoClient().db
+    monkeypatch.setattr(configs, "pymongo", SimpleNamespace(db=db))
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_TTL", 60)
+    monkeypatch.setattr(llm_cache, "_local_stats", {"hits": 0, "misses": 0})
+    monkeypatch.setattr(llm_cache, "_pending_stats", {"hits": 0, "misses": 0})
+    return db
+
+
+class TestWithDB:
+    """
+    Tests the cache with a database
+    """
+
+    def test_get_put(self, cache_db):
+        """
+        Test that a stored response is returned until it is older than the TTL
+        """
+        assert llm_cache.get("key") is None
+        llm_cache.put("key", "response")
+        assert llm_cache.get("key") == "response"
+
+        created = datetime.now(timezone.utc) - timedelta(seconds=61)
+        cache_db.llm_cache.update_one({"_id": "key"}, {"$set": {"created": created}})
+        assert llm_cache.get("key") is None
+
+    def test_stats_batched(self, cache_db, monkeypatch):
+        """
+        Test that lookups only add to the shared stats every
+        STATS_FLUSH_COUNT lookups, and when the stats are read
+        """
+        monkeypatch.setattr(llm_cache, "STATS_FLUSH_COUNT", 3)
+        llm_cache.put("key", "response")
+        llm_cache.get("key")
+        llm_cache.get("other key")
+        assert cache_db.llm_cache_stats.find_one({"_id": "stats"}) is None
+
+        llm_cache.get("key")
+        assert cache_db.llm_cache_stats.find_one({"_id": "stats"}) == {
+            "_id": "stats",
+            "hits": 2,
+            "misses": 1,
+        }
+
+        llm_cache.get("key")
+        stats = llm_cache.stats()
+        assert stats["process"]["hits"] == stats["shared"]["hits"] == 3
+
+
+if __name__ == "__main__":
+    pytest.main()
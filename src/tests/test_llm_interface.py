@@ -2,9 +2,79 @@
 pytest based unit testing for everything in llm_interface.py
 """
 
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
 import pytest
 
-from llm_interface import get_prompt_response
+import llm_interface
+from llm_interface import (
+    get_prompt_response,
+    get_session,
+    session_stats,
+    stream_prompt_response,
+)
+
+
+class _FlakyLLMHandler(BaseHTTPRequestHandler):
+    """
+    Mimics the inference API, but responds 503 to every other request
+    """
+
+    protocol_version = "HTTP/1.1"
+    num_requests = 0
+
+    def do_POST(self):
+        """
+        Handles a POST request
+        """
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        type(self).num_requests += 1
+        if type(self).num_requests % 2:
+            status, body = 503, {"error": "Model is currently loading"}
+        elif payload.get("stream"):
+            self._send_stream(["I", " am", " fine"])
+            return
+        else:
+            status, body = 200, [{"generated_text": "I am fine"}]
+
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, tokens: list[str]):
+        events = [{"token": {"text": i, "special": False}} for i in tokens]
+        events.append({"token": {"text": "</s>", "special": True}})
+        data = "".join(f"data:{json.dumps(i)}\n\n" for i in events).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(name="local_llm")
+def fixture_local_llm(monkeypatch):
+    """
+    Runs a local stand-in for the inference API, and points llm_interface to it
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _FlakyLLMHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(
+        llm_interface, "API_URL", f"http://127.0.0.1:{server.server_port}/"
+    )
+    monkeypatch.setattr(llm_interface, "_adapter", None)
+    yield server
+    server.shutdown()
+    server.server_close()
 
 
 class TestGetPromptResponse:
@@ -18,6 +88,72 @@ class TestGetPromptResponse:
         """
         assert isinstance(get_prompt_response("Hello, how are you"), str)
 
+    @pytest.mark.usefixtures("local_llm")
+    def test_retry_and_reuse(self):
+        """
+        Test that 503 responses are retried, and that the connection is
+        reused across calls
+        """
+        _FlakyLLMHandler.num_requests = 0
+        for _ in range(3):
+            assert get_prompt_response("Hello, how are you") == "I am fine"
+
+        stats = session_stats()
+        assert _FlakyLLMHandler.num_requests == 6
+        assert stats["requests"] == 6
+        assert stats["connections"] == 1
+        assert stats["reused"] == 5
+
+
+class TestStreamPromptResponse:
+    """
+    Tests stream_prompt_response function
+    """
+
+    @pytest.mark.usefixtures("local_llm")
+    def test_tokens_streamed(self):
+        """
+        Test that the text of every non special token is yielded
+        """
+        _FlakyLLMHandler.num_requests = 0
+        assert list(stream_prompt_response("Hello, how are you")) == [
+            "I",
+            " am",
+            " fine",
+        ]
+
+
+class TestGetSession:
+    """
+    Tests get_session function
+    """
+
+    def test_per_process(self, monkeypatch):
+        """
+        Test that the session is reused, except in a new (forked) process
+        """
+        monkeypatch.setattr(llm_interface, "_adapter", None)
+        session = get_session()
+        assert get_session() is session
+
+        monkeypatch.setattr(llm_interface.os, "getpid", lambda: -1)
+        assert get_session() is not session
+
+    def test_per_thread(self, monkeypatch):
+        """
+        Test that every thread has its own session, but all of them share the
+        connection pool of the process
+        """
+        monkeypatch.setattr(llm_interface, "_adapter", None)
+        sessions = [get_session()]
+        thread = threading.Thread(target=lambda: sessions.append(get_session()))
+        thread.start()
+        thread.join()
+
+        assert sessions[0] is not sessions[1]
+        adapters = [i.get_adapter(llm_interface.API_URL) for i in sessions]
+        assert adapters[0] is adapters[1]
+
 
 if __name__ == "__main__":
     pytest.main()
@@ -0,0 +1,78 @@
+"""
+pytest based unit testing for everything in metrics.py
+"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+from prometheus_client import REGISTRY
+
+from metrics import render_metrics, stage
+
+WORKER_SCRIPT = """
+from metrics import stage
+with stage("llm"):
+    pass
+"""
+
+
+def _count(stage_name: str):
+    return (
+        REGISTRY.get_sample_value("stage_duration_seconds_count", {"stage": stage_name})
+        or 0
+    )
+
+
+class TestStage:
+    """
+    Tests stage function
+    """
+
+    def test_observed(self):
+        """
+        Test that every run of a stage is observed, including runs that raise
+        """
+        before = _count("prompt")
+        with stage("prompt"):
+            pass
+
+        with pytest.raises(ValueError):
+            with stage("prompt"):
+                raise ValueError()
+
+        assert _count("prompt") - before == 2
+
+
+class TestRenderMetrics:
+    """
+    Tests render_metrics function
+    """
+
+    def test_single_process(self):
+        """
+        Test that the metrics of this process are rendered without a metrics
+        folder
+        """
+        with stage("retrieval"):
+            pass
+
+        body, content_type = render_metrics()
+        assert content_type.startswith("text/plain")
+        assert b'stage_duration_seconds_count{stage="retrieval"}' in body
+
+    def test_aggregated(self, tmp_path):
+        """
+        Test that the metrics written by several worker processes are summed
+        """
+        env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(tmp_path)}
+        for _ in range(2):
+            subprocess.run([sys.executable, "-c", WORKER_SCRIPT], env=env, check=True)
+
+        body, _ = render_metrics(str(tmp_path))
+        assert b'stage_duration_seconds_count{stage="llm"} 2.0' in body
+
+
+if __name__ == "__main__":
+    pytest.main()
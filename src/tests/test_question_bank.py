@@ -0,0 +1,231 @@
+"""
+pytest based unit testing for everything in question_bank.py
+"""
+
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import assessment as assessment_module
+import configs
+import dedup
+import question_bank
+from assessment import Assessment
+from question_bank import add_assessments, content_hash, find_questions, normalize_text
+from userinput import UserInput
+
+VALID = {"question_type": "Short Answer", "question": "Why?", "sample_answer": "a"}
+
+
+class TestNormalizeText:
+    """
+    Tests normalize_text and content_hash functions
+    """
+
+    def test_normalize_text(self):
+        """
+        Test that case, whitespace and punctuation are ignored
+        """
+        assert normalize_text("  What is\tan ATOM? ") == "what is an atom"
+        assert normalize_text("What is an atom") == normalize_text("what is, an atom?")
+
+    def test_content_hash(self):
+        """
+        Test that the hash depends on the topic and question type the question
+        is banked under, and on its type and normalized text only
+        """
+        question = dict(VALID, question="What is an atom?")
+        group = ("physics", "Short Answer")
+        assert content_hash(question, *group) == content_hash(
+            dict(question, question="what is an ATOM", sample_answer="b"), *group
+        )
+        assert content_hash(question, *group) != content_hash(
+            dict(question, question_type="Long Answer"), *group
+        )
+        assert content_hash(question, *group) != content_hash(
+            question, "chemistry", "Short Answer"
+        )
+        assert content_hash(question, *group) != content_hash(
+            question, "physics", "mixed"
+        )
+
+
+class TestDisabled:
+    """
+    Tests the bank when it is disabled (the default)
+    """
+
+    def test_no_op(self):
+        """
+        Test that nothing is found or added
+        """
+        user_input = UserInput("History", "SA", 3, [])
+        assert find_questions(user_input, 3) == []
+        add_assessments([{"user_input": user_input.to_dict(), "questions": [VALID]}])
+        assert question_bank.stats() == {"enabled": False}
+
+
+@pytest.fixture(name="bank_db")
+def fixture_bank_db(monkeypatch):
+    """
+    Enables the bank, stored in an in memory MongoDB (mongomock, the tests are
+    skipped if it is not installed), and returns the question bank collection
+    """
+    mongomock = pytest.importorskip("mongomock")
+    collection = mongomock.MongoClient().db.question_bank
+
+    # mongomock does not support UpdateOne in bulk_write
+    def bulk_write(ops, ordered=True):
+        for op in ops:
+            collection.update_one(op._filter, op._doc, upsert=op._upsert)
+
+    collection.bulk_write = bulk_write
+    monkeypatch.setattr(question_bank, "QUESTION_BANK", True)
+    monkeypatch.setattr(
+        configs,
+        "pymongo",
+        SimpleNamespace(db=SimpleNamespace(question_bank=collection)),
+    )
+    return collection
+
+
+def bank(topic: str, questions: list[str], keywords: str = ""):
+    """
+    Adds the short answer questions to the bank, generated for topic and the
+    context keywords
+    """
+    user_input = UserInput(topic, "SA", len(questions), [], keywords)
+    add_assessments(
+        [
+            {
+                "user_input": user_input.to_dict(),
+                "questions": [dict(VALID, question=i) for i in questions],
+            }
+        ]
+    )
+
+
+class TestEnabled:
+    """
+    Tests the bank when it is enabled
+    """
+
+    def test_add_and_find(self, bank_db):
+        """
+        Test that questions are found by the topic, question type and context
+        keywords they were added for, and that a question added for another
+        topic is also found under that topic
+        """
+        bank("Physics", ["What is an atom?"], "atoms")
+        assert question_bank.stats() == {"enabled": True, "questions": 1}
+
+        physics = UserInput("physics", "SA", 3, [])
+        assert find_questions(physics, 3) == [dict(VALID, question="What is an atom?")]
+        assert find_questions(UserInput("Physics", "SA", 3, [], "atoms"), 3)
+        assert not find_questions(UserInput("Physics", "SA", 3, [], "ions"), 3)
+        assert not find_questions(UserInput("Physics", "LA", 3, []), 3)
+
+        chemistry = UserInput("Chemistry", "SA", 3, [])
+        assert not find_questions(chemistry, 3)
+        bank("Chemistry", ["What is an atom?"])
+        assert len(find_questions(chemistry, 3)) == 1
+        assert len(find_questions(physics, 3)) == 1
+        assert bank_db.count_documents({}) == 2
+
+    def test_exact_merge(self, bank_db):
+        """
+        Test that adding a duplicate question only adds the new keywords
+        """
+        bank("Physics", ["What is an atom?"], "atoms")
+        bank("Physics", ["what is an ATOM"], "electrons")
+        assert bank_db.count_documents({}) == 1
+        assert sorted(bank_db.find_one()["keywords"]) == ["atoms", "electrons"]
+        assert bank_db.find_one()["question"]["question"] == "What is an atom?"
+
+    def test_near_duplicate_merge(self, bank_db, monkeypatch):
+        """
+        Test that a near-duplicate of a question of the same topic is merged,
+        only if near-duplicate detection is enabled
+        """
+        question = "Describe the causes of World War II."
+        near = "Describe the main causes of World War II."
+        bank("History", [question])
+        bank("History", [near])
+        assert bank_db.count_documents({}) == 2
+
+        bank_db.delete_many({})
+        monkeypatch.setattr(dedup, "DEDUP_THRESHOLD", 0.7)
+        bank("History", [question], "war")
+        bank("History", [near, "Explain photosynthesis in plants."], "causes")
+        docs = list(bank_db.find())
+        assert [i["question"]["question"] for i in docs] == [
+            question,
+            "Explain photosynthesis in plants.",
+        ]
+        assert sorted(docs[0]["keywords"]) == ["causes", "war"]
+
+        # a near-duplicate of another topic is kept
+        bank("Politics", [near])
+        assert bank_db.count_documents({}) == 3
+
+
+class TestFromUserInput:
+    """
+    Tests generating an assessment with questions from the bank
+    """
+
+    def fake_llm(self, monkeypatch, prompts):
+        """
+        Replaces the LLM with one that records the prompts, and answers with
+        as many new questions as they ask for
+        """
+
+        def get_prompt_response(prompt: str, use_cache: bool = True):
+            prompts.append(prompt)
+            num = int(prompt.split("Generate ")[1].split()[0])
+            return json.dumps([dict(VALID, question=f"New {i}?") for i in range(num)])
+
+        monkeypatch.setattr(
+            assessment_module, "get_prompt_response", get_prompt_response
+        )
+
+    def test_shortfall(self, monkeypatch):
+        """
+        Test that only the questions missing from the bank are generated
+        """
+        prompts = []
+        self.fake_llm(monkeypatch, prompts)
+        monkeypatch.setattr(
+            assessment_module,
+            "find_questions",
+            lambda *_: [dict(VALID, question="Banked?")],
+        )
+        assessment = Assessment.from_user_input(UserInput("History", "SA", 3, []))
+        assert len(prompts) == 1
+        assert "Generate 2 " in prompts[0]
+        assert [i.question for i in assessment.questions] == [
+            "Banked?",
+            "New 0?",
+            "New 1?",
+        ]
+
+    def test_fresh(self, monkeypatch):
+        """
+        Test that the bank is bypassed when the cache is not used
+        """
+        prompts = []
+        self.fake_llm(monkeypatch, prompts)
+
+        def find_questions_(*_):
+            pytest.fail("the bank was used")
+
+        monkeypatch.setattr(assessment_module, "find_questions", find_questions_)
+        assessment = Assessment.from_user_input(
+            UserInput("History", "SA", 2, []), use_cache=False
+        )
+        assert len(assessment.questions) == 2
+
+
+if __name__ == "__main__":
+    pytest.main()
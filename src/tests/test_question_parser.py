@@ -0,0 +1,87 @@
+"""
+pytest based unit testing for everything in question_parser.py
+"""
+
+import pytest
+
+from exceptions import OutputFormatError
+from question_parser import IncrementalQuestionParser
+
+OUTPUT = """Here are the questions:
+```json
+[{"question_type": "MCQ", "question": "What is {x} in \\"x = 1\\"?",
+  "options": ["1", "2"], "correct_answer": 0},
+ {"question_type": "Short Answer", "question": "Why?", "sample_answer": "}",},]
+```"""
+
+
+def _feed_in_chunks(parser: IncrementalQuestionParser, text: str, size: int):
+    ret = []
+    for i in range(0, len(text), size):
+        ret.extend(parser.feed(text[i : i + size]))
+
+    return ret
+
+
+class TestIncrementalQuestionParser:
+    """
+    Tests IncrementalQuestionParser
+    """
+
+    def test_chunk_sizes(self):
+        """
+        Test that the output is parsed the same irrespective of chunking, with
+        braces and quotes inside strings
+        """
+        for size in (1, 2, 7, len(OUTPUT)):
+            parser = IncrementalQuestionParser()
+            questions = _feed_in_chunks(parser, OUTPUT, size)
+            parser.close()
+            assert parser.num_parsed == 2
+            assert questions[0]["question"] == 'What is {x} in "x = 1"?'
+            assert questions[1]["sample_answer"] == "}"
+
+    def test_questions_returned_early(self):
+        """
+        Test that a question is returned as soon as its object is complete
+        """
+        parser = IncrementalQuestionParser()
+        end = OUTPUT.index("},") + 1
+        assert len(parser.feed(OUTPUT[:end])) == 1
+        assert len(parser.feed(OUTPUT[end:])) == 1
+
+    def test_incomplete(self):
+        """
+        Test that truncated output is reported on close
+        """
+        parser = IncrementalQuestionParser()
+        parser.feed(OUTPUT[:-30])
+        with pytest.raises(OutputFormatError):
+            parser.close()
+
+    def test_invalid_json(self):
+        """
+        Test that an invalid object errors with OutputFormatError
+        """
+        parser = IncrementalQuestionParser()
+        with pytest.raises(OutputFormatError):
+            parser.feed('[{"question": what}]')
+
+    def test_salvage(self):
+        """
+        Test that in salvage mode, invalid and incomplete objects are dropped
+        with a reason, and the valid ones are returned
+        """
+        parser = IncrementalQuestionParser(salvage=True)
+        questions = parser.feed('[{"question": what}, ' + OUTPUT[:-30])
+        parser.close()
+        assert [i["question_type"] for i in questions] == ["MCQ"]
+        assert parser.num_seen == 3
+        assert parser.num_parsed == 1
+        assert len(parser.dropped) == 2
+        assert parser.dropped[0].startswith("question 1: invalid json")
+        assert parser.dropped[1].startswith("question 3: response ended")
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,149 @@
+"""
+pytest based unit testing for everything in ratelimit.py
+"""
+
+import threading
+import time
+
+import pytest
+
+import ratelimit
+from exceptions import ServiceBusyError
+from ratelimit import acquire, priority, PRIORITY_BATCH, wait_time
+
+
+@pytest.fixture(name="fake_bucket")
+def fixture_fake_bucket(monkeypatch):
+    """
+    Enables the limiter with an in memory bucket of requests, that is empty
+    until the test adds to it. Returns the bucket and the list of granted
+    prompts.
+    """
+    bucket = {"requests": 0}
+    granted = []
+
+    def fake_take(costs, _value):
+        if bucket["requests"] >= costs["requests"]:
+            bucket["requests"] -= costs["requests"]
+            granted.append(threading.current_thread().name)
+            return 0.0
+        return 0.02
+
+    monkeypatch.setattr(ratelimit, "RATES", {"requests": 1.0})
+    monkeypatch.setattr(ratelimit, "is_enabled", lambda: True)
+    monkeypatch.setattr(ratelimit, "_take", fake_take)
+    return bucket, granted
+
+
+class TestWaitTime:
+    """
+    Tests wait_time function
+    """
+
+    def test_wait_time(self, monkeypatch):
+        """
+        Test that the wait is set by the slowest bucket, and that batch calls
+        wait for the reserve to refill too
+        """
+        monkeypatch.setattr(ratelimit, "RATES", {"requests": 1.0, "tokens": 100.0})
+        monkeypatch.setattr(ratelimit, "LLM_RATE_BURST", 10)
+        monkeypatch.setattr(ratelimit, "LLM_BATCH_RESERVE", 0.5)
+        levels = {"requests": 0.5, "tokens": 200}
+        costs = {"requests": 1, "tokens": 400}
+        assert wait_time(levels, costs, ratelimit.PRIORITY_INTERACTIVE) == 2
+        assert wait_time(levels, costs, PRIORITY_BATCH) == 7
+
+    def test_small_capacity(self, monkeypatch):
+        """
+        Test that a batch call is made at once with a full bucket, even if
+        the bucket holds less than its cost and reserve (6 calls a minute
+        with a 10 second burst is a bucket of 1 call)
+        """
+        monkeypatch.setattr(ratelimit, "RATES", {"requests": 0.1})
+        monkeypatch.setattr(ratelimit, "LLM_RATE_BURST", 10)
+        monkeypatch.setattr(ratelimit, "LLM_BATCH_RESERVE", 0.5)
+        monkeypatch.setattr(ratelimit, "LLM_QUEUE_TIMEOUT", 1)
+        levels = {"requests": ratelimit.capacity("requests")}
+        assert levels == {"requests": 1}
+        costs = ratelimit.estimate_costs("prompt")
+        assert wait_time(levels, costs, PRIORITY_BATCH) == 0
+
+        monkeypatch.setattr(ratelimit, "is_enabled", lambda: True)
+        monkeypatch.setattr(
+            ratelimit,
+            "_take",
+            lambda costs, value: max(wait_time(levels, costs, value), 0.0),
+        )
+        start = time.monotonic()
+        with priority(PRIORITY_BATCH):
+            acquire("prompt")
+        assert time.monotonic() - start < 0.5
+
+
+class TestAcquire:
+    """
+    Tests acquire function
+    """
+
+    def test_disabled(self):
+        """
+        Test that acquire returns right away without limits
+        """
+        acquire("prompt")
+
+    def test_priority_order(self, fake_bucket):
+        """
+        Test that waiting calls are granted interactive first, and then in
+        the order they arrived
+        """
+        bucket, granted = fake_bucket
+
+        def batch_call():
+            with priority(PRIORITY_BATCH):
+                acquire("prompt")
+
+        threads = [
+            threading.Thread(target=batch_call, name="batch 1"),
+            threading.Thread(target=batch_call, name="batch 2"),
+            threading.Thread(target=acquire, args=("prompt",), name="interactive"),
+        ]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.05)
+
+        bucket["requests"] = 3
+        for thread in threads:
+            thread.join()
+
+        assert granted == ["interactive", "batch 1", "batch 2"]
+
+    def test_queue_full(self, fake_bucket, monkeypatch):
+        """
+        Test that calls beyond LLM_QUEUE_SIZE are rejected right away
+        """
+        bucket, _ = fake_bucket
+        monkeypatch.setattr(ratelimit, "LLM_QUEUE_SIZE", 1)
+        waiting = threading.Thread(target=acquire, args=("prompt",))
+        waiting.start()
+        time.sleep(0.05)
+        with pytest.raises(ServiceBusyError):
+            acquire("prompt")
+
+        bucket["requests"] = 1
+        waiting.join()
+
+    def test_timeout(self, fake_bucket, monkeypatch):
+        """
+        Test that a call that waits for LLM_QUEUE_TIMEOUT is rejected, and
+        leaves the queue
+        """
+        monkeypatch.setattr(ratelimit, "LLM_QUEUE_TIMEOUT", 0.1)
+        with pytest.raises(ServiceBusyError):
+            acquire("prompt")
+
+        assert not ratelimit._waiting
+        assert not fake_bucket[1]
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,126 @@
+"""
+pytest based unit testing for everything in retrieval.py
+"""
+
+import pytest
+
+import retrieval
+from extraction import ExtractionCache
+from retrieval import (
+    BM25Index,
+    chunk_text,
+    estimate_tokens,
+    select_context,
+    tokenize,
+)
+
+FILLER = "lorem ipsum dolor sit amet consectetur adipiscing elit " * 10
+CHUNKS = [
+    FILLER,
+    "Entropy of an isolated system never decreases, this is the second law of "
+    "thermodynamics.",
+    FILLER,
+    "Photosynthesis converts light energy into chemical energy in plants.",
+]
+
+
+class TestTokenize:
+    """
+    Tests tokenize and chunk_text functions
+    """
+
+    def test_tokenize(self):
+        """
+        Test that words are lowercased and stopwords are removed
+        """
+        assert tokenize("The Laws of Thermodynamics!") == ["laws", "thermodynamics"]
+
+    def test_chunk_text(self):
+        """
+        Test that chunks have the right size and overlap
+        """
+        words = [str(i) for i in range(25)]
+        chunks = chunk_text(" ".join(words), 10, 2)
+        assert chunks[0].split() == words[:10]
+        assert chunks[1].split() == words[8:18]
+        assert chunks[-1].split()[-1] == words[-1]
+        assert chunk_text("", 10, 2) == [""]
+
+
+class TestBM25Index:
+    """
+    Tests BM25Index
+    """
+
+    def test_relevant_chunk_first(self):
+        """
+        Test that the chunk with the query terms scores highest
+        """
+        index = BM25Index.from_chunks(CHUNKS)
+        scores = index.scores("thermodynamics entropy")
+        assert max(range(len(CHUNKS)), key=lambda i: scores[i]) == 1
+        assert scores[0] == scores[2] == 0
+
+    def test_select(self):
+        """
+        Test that selection respects top_k and the budget, and keeps text order
+        """
+        index = BM25Index.from_chunks(CHUNKS)
+        assert index.select("plants thermodynamics", 1000, 2) == [1, 3]
+        assert index.select("plants", 1000, 1) == [3]
+        assert not index.select("plants", 1, 4)
+
+    def test_json_round_trip(self):
+        """
+        Test that an index loaded from JSON gives the same scores
+        """
+        index = BM25Index.from_chunks(CHUNKS)
+        loaded = BM25Index.from_json(index.to_json())
+        assert loaded.scores("energy plants") == index.scores("energy plants")
+
+
+class TestSelectContext:
+    """
+    Tests select_context function
+    """
+
+    def test_small_text_unchanged(self):
+        """
+        Test that text within the budget is not changed
+        """
+        assert select_context(["short text"], "topic", 100, 3) == "short text"
+        assert select_context([FILLER * 10], "topic", 0, 3) == FILLER * 10
+
+    def test_budget(self, tmp_path, monkeypatch):
+        """
+        Test that the selected context fits in the budget, and has the
+        relevant part
+        """
+        monkeypatch.setattr(
+            retrieval, "extraction_cache", ExtractionCache(tmp_path, 1 << 20)
+        )
+        retrieval.get_index.cache_clear()
+        text = " ".join(CHUNKS * 20)
+        context = select_context([text], "second law of thermodynamics", 300, 5)
+        assert estimate_tokens(context) <= 300 + 10
+        assert "thermodynamics" in context
+
+    def test_multiple_texts(self, tmp_path, monkeypatch):
+        """
+        Test that the relevant part is found in any of the texts, within the
+        shared budget
+        """
+        monkeypatch.setattr(
+            retrieval, "extraction_cache", ExtractionCache(tmp_path, 1 << 20)
+        )
+        retrieval.get_index.cache_clear()
+        texts = [FILLER * 20, " ".join(CHUNKS * 5), FILLER * 20]
+        assert select_context(texts[:1], "topic", 0, 3) == texts[0]
+
+        context = select_context(texts, "photosynthesis in plants", 300, 5)
+        assert estimate_tokens(context) <= 300 + 10
+        assert "Photosynthesis" in context
+
+
+if __name__ == "__main__":
+    pytest.main()
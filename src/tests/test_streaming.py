@@ -0,0 +1,79 @@
+"""
+pytest based unit testing for everything in streaming.py
+"""
+
+import json
+
+import pytest
+from bson import json_util, ObjectId
+
+from streaming import iter_json_array, iter_ndjson, sse_event
+
+DOCS = [{"_id": ObjectId(), "value": i} for i in range(7)]
+
+
+class TestIterNdjson:
+    """
+    Tests iter_ndjson function
+    """
+
+    def test_one_document_per_line(self):
+        """
+        Test that every line is one encoded document, in order
+        """
+        lines = "".join(iter_ndjson(DOCS, 3)).splitlines()
+        assert [json_util.loads(i) for i in lines] == DOCS
+
+    def test_batching(self):
+        """
+        Test that chunks have at most batch_size documents
+        """
+        chunks = list(iter_ndjson(DOCS, 3))
+        assert [i.count("\n") for i in chunks] == [3, 3, 1]
+        assert not list(iter_ndjson([], 3))
+
+
+class TestIterJsonArray:
+    """
+    Tests iter_json_array function
+    """
+
+    def test_same_as_dumps(self):
+        """
+        Test that the concatenated chunks are the same as a full dump
+        """
+        for batch_size in (1, 3, 100):
+            assert "".join(iter_json_array(DOCS, batch_size)) == json_util.dumps(DOCS)
+
+    def test_empty(self):
+        """
+        Test that no documents gives an empty JSON array
+        """
+        assert json.loads("".join(iter_json_array([], 3))) == []
+
+
+class TestSseEvent:
+    """
+    Tests sse_event function
+    """
+
+    def test_format(self):
+        """
+        Test that an event has the name, one line of data and a blank line
+        """
+        event = sse_event("question", {"question": "Line 1\nLine 2"})
+        lines = event.split("\n")
+        assert lines[0] == "event: question"
+        assert json.loads(lines[1][len("data: ") :]) == {"question": "Line 1\nLine 2"}
+        assert event.endswith("\n\n") and len(lines) == 4
+
+    def test_event_id(self):
+        """
+        Test that an event with an ID starts with it
+        """
+        event = sse_event("done", {}, "abc")
+        assert event.split("\n")[:2] == ["id: abc", "event: done"]
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -137,6 +137,12 @@ class TestUserInput:
         assert "10" in prompt
         assert "algebra, calculus" in prompt
 
+        # check a prompt for a part of the questions
+        prompt = obj.make_prompt(4, (1, 3))
+        assert "Generate 4 MCQ" in prompt
+        assert "part 2 of 3" in prompt
+        assert prompt != obj.make_prompt(4, (2, 3))
+
 
 if __name__ == "__main__":
     pytest.main()
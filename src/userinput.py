@@ -5,10 +5,11 @@ Implements UserInput class
 import json
 from typing import Any
 
-import textract
-
-from configs import UPLOADS_BASE
+from configs import PDF_CONTEXT_TOKEN_BUDGET, PDF_CONTEXT_TOP_K
 from exceptions import UserInputError
+from extraction import get_upload_texts
+from metrics import stage
+from retrieval import select_context
 
 
 PROMPT_TEMPLATE_MCQ = """
@@ -75,6 +76,7 @@ class UserInput:
                 raise UserInputError("'pdfs' must be list of strings")
 
         self.pdfs = pdfs
+        self._pdf_context: str | None = None
 
     @classmethod
     def from_request_form(cls, request_form: dict[str, Any]):
@@ -103,32 +105,71 @@ class UserInput:
         except (ValueError, TypeError):
             raise UserInputError("Incorrect form field type") from None
 
-    def make_prompt(self):
+    def pdf_context(self):
         """
-        Make a prompt that is sent to the LLM
+        Returns the prompt text that adds context from the uploaded PDFs. All
+        PDFs are extracted concurrently (PDFs that could not be extracted are
+        skipped), and only the parts of their text most relevant to the topic
+        and context keywords are used, within PDF_CONTEXT_TOKEN_BUDGET. The
+        text is computed once, and then reused by later calls.
         """
-        context_keywords = (
-            f"Try to inculcate the following context: {self.context_keywords}"
-            if self.context_keywords
-            else ""
-        )
+        if self._pdf_context is None:
+            self._pdf_context = ""
+            with stage("extraction"):
+                texts = [i for i in get_upload_texts(self.pdfs) if i]
+            if texts:
+                with stage("retrieval"):
+                    processed = select_context(
+                        texts,
+                        f"{self.topic} {self.context_keywords}",
+                        PDF_CONTEXT_TOKEN_BUDGET,
+                        PDF_CONTEXT_TOP_K,
+                    )
+                if processed:
+                    self._pdf_context = (
+                        f"Here is some additional context on the topic: {processed}"
+                    )
+
+        return self._pdf_context
+
+    def make_prompt(
+        self, num_questions: int | None = None, part: tuple[int, int] | None = None
+    ):
+        """
+        Make a prompt that is sent to the LLM.
 
-        pdf_text = ""
-        if self.pdfs:
-            processed = textract.process(UPLOADS_BASE / self.pdfs[0]).decode()
-            if processed:
-                pdf_text = f"Here is some additional context on the topic: {processed}"
+        By default the prompt asks for all the questions. To split generation
+        into multiple prompts, pass the num_questions of this prompt and the
+        part as a (part index, number of parts) pair.
+        """
+        if num_questions is None:
+            num_questions = self.num_questions
+
+        instructions = []
+        if self.context_keywords:
+            instructions.append(
+                f"Try to inculcate the following context: {self.context_keywords}"
+            )
+
+        if part is not None:
+            instructions.append(
+                f"These questions are part {part[0] + 1} of {part[1]} of a larger "
+                "assessment, so focus on a different aspect of the topic than "
+                "the other parts would."
+            )
 
+        extra_instructions = " ".join(instructions)
+        pdf_text = self.pdf_context()
         if "mcq" in self.question_type:
             return PROMPT_TEMPLATE_MCQ.format(
-                self.num_questions, self.topic, context_keywords, pdf_text
+                num_questions, self.topic, extra_instructions, pdf_text
             )
 
         return PROMPT_TEMPLATE_SUBJECTIVE.format(
-            self.num_questions,
+            num_questions,
             self.question_type,
             self.topic,
-            context_keywords,
+            extra_instructions,
             self.question_type,
             pdf_text,
         )